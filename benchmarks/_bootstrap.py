@@ -0,0 +1,63 @@
+# Benchmarks run outside of Flow Launcher: point `src.shared` to throwaway portable data directory before importing src
+
+import os
+import sys
+import json
+import atexit
+import shutil
+import tempfile
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SETTINGS = {"default_media_type": "Both", "preferable_name": "English", "limit": "10",
+            "language": "English", "cache_ttl": "60"}
+
+
+def setup_environment() -> str:
+    for path in (ROOT_PATH, os.path.join(ROOT_PATH, "lib")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    if os.environ.get("SHIKIFLOW_BENCH_DIR"):
+        return os.environ["SHIKIFLOW_BENCH_DIR"]
+    data_dir = tempfile.mkdtemp(prefix="shikiflow-bench-")
+    atexit.register(shutil.rmtree, data_dir, ignore_errors=True)
+    settings_dir = os.path.join(data_dir, "UserData", "Settings", "Plugins", "ShikiFlow")
+    os.makedirs(settings_dir)
+    with open(os.path.join(settings_dir, "Settings.json"), mode="w", encoding="utf-8") as f:
+        json.dump(SETTINGS, f)
+    with open(os.path.join(settings_dir, "osettings.json"), mode="w", encoding="utf-8") as f:
+        json.dump({"external_links": list(), "external_search": list()}, f)
+    os.environ["FLOW_PROGRAM_DIRECTORY"] = data_dir
+    os.environ["FLOW_APPLICATION_DIRECTORY"] = data_dir
+    os.environ["SHIKIFLOW_BENCH_DIR"] = data_dir
+    return data_dir
+
+
+def make_node(i: int, media_type: str = "Anime") -> dict:
+    """Detail-profile GraphQL node as Shikimori returns it"""
+    type_ = media_type.lower()
+    node = {"id": str(i), "malId": i, "name": f"Title {i}", "russian": f"Тайтл {i}", "english": f"Title EN {i}",
+            "japanese": "タイトル", "synonyms": [f"T{i}"], "licenseNameRu": None, "licensors": ["Studio"],
+            "isCensored": False, "url": f"https://shikimori.one/{type_}s/{i}", "airedOn": {"date": "2002-10-03"},
+            "externalLinks": [{"kind": "myanimelist", "url": f"https://myanimelist.net/{type_}/{i}"},
+                              {"kind": "official_site", "url": f"https://example.com/{i}"}],
+            "poster": {"previewUrl": f"https://shikimori.one/{i}.jpg", "originalUrl": f"https://shikimori.one/{i}o.jpg"},
+            "status": "released"}
+    if media_type == "Anime":
+        node.update(kind="tv", season="fall_2002", episodes=220, episodesAired=0)
+    else:
+        node.update(kind="manga", chapters=700, volumes=72)
+    return node
+
+
+def load_fixture(name: str):
+    """Response from benchmarks/fixtures: hand-made in shape of Shikimori's until re-recorded with benchmarks/record.py"""
+    with open(os.path.join(FIXTURES_PATH, name), mode="r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_anma(count: int) -> list[dict]:
+    """Synthetic AnMa external search list of `count` entries, domains of fixture repeated under new names"""
+    base = load_fixture("anma.json")
+    return [{**base[i % len(base)], "name": f"{base[i % len(base)]['name']} {i}"} for i in range(count)]
@@ -0,0 +1,40 @@
+# Decode and result construction cost of lazy FromGraph entries against eagerly decoded records
+# Usage: python -m benchmarks.bench_records [entries]
+
+import sys
+import time
+
+from ._bootstrap import setup_environment, make_node, SETTINGS
+
+setup_environment()
+
+from src.shiki.graphql import AnimeEntryFromGraph, MangaEntryFromGraph, AnimeRecord, MangaRecord  # noqa: E402
+from src.result import ResultConstructor  # noqa: E402
+
+
+def measure(anime_cls, manga_cls, nodes: list[tuple[str, dict]], repeat: int = 5) -> tuple[float, float]:
+    constructor = ResultConstructor(SETTINGS, lang="en")
+    decode_best, results_best = float("inf"), float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        entries = [anime_cls(node) if type_ == "Anime" else manga_cls(node) for type_, node in nodes]
+        decode_best = min(decode_best, time.perf_counter() - start)
+        start = time.perf_counter()
+        for entry in entries:
+            constructor.make_result(entry)
+        results_best = min(results_best, time.perf_counter() - start)
+    return decode_best, results_best
+
+
+def main(count: int = 5000):
+    nodes = [("Anime" if i % 2 else "Manga", make_node(i, "Anime" if i % 2 else "Manga")) for i in range(1, count + 1)]
+    print(f"{count} entries, best of 5")
+    for label, anime_cls, manga_cls in (("FromGraph", AnimeEntryFromGraph, MangaEntryFromGraph),
+                                        ("Record", AnimeRecord, MangaRecord)):
+        decode, results = measure(anime_cls, manga_cls, nodes)
+        print(f"{label:>10}: decode {decode * 1000:8.2f} ms, results {results * 1000:8.2f} ms, "
+              f"total {(decode + results) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
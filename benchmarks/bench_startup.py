@@ -0,0 +1,75 @@
+# Cold start regression check: `-X importtime` of src.plugin and hint response in fresh interpreter
+# Usage: python -m benchmarks.bench_startup [--budget MS] [--runs N]
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+from ._bootstrap import setup_environment, ROOT_PATH
+
+DEFAULT_BUDGET_MS = 150
+# Modules that must not be imported before the first network request
+FORBIDDEN_MODULES = ("httpx", "httpcore", "sqlite3", "src.search", "src.result", "src.mirror")
+
+HINT_SCRIPT = """
+import sys, time, asyncio
+start = time.perf_counter()
+import src.plugin as plugin
+asyncio.run(plugin.query("ab"))
+asyncio.run(plugin.query("s:"))
+print(time.perf_counter() - start, ",".join(x for x in %r if x in sys.modules), sep="|")
+"""
+
+
+def import_time_us(module: str) -> dict[str, int]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT_PATH,
+                          capture_output=True, text=True, check=True)
+    cumulative = dict()
+    for line in proc.stderr.splitlines():
+        matched = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+        if matched:
+            cumulative[matched.group(3)] = int(matched.group(1))
+    return cumulative
+
+
+def hint_response() -> tuple[float, list[str]]:
+    proc = subprocess.run([sys.executable, "-c", HINT_SCRIPT % (FORBIDDEN_MODULES, )], cwd=ROOT_PATH,
+                          capture_output=True, text=True, check=True)
+    elapsed, imported = proc.stdout.strip().splitlines()[-1].split("|")
+    return float(elapsed), [x for x in imported.split(",") if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("SHIKIFLOW_STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS)),
+                        help="Max median import time of src.plugin, ms")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    
+    setup_environment()
+    
+    timings = sorted(import_time_us("src.plugin")["src.plugin"] / 1000 for _ in range(args.runs))
+    median = timings[len(timings) // 2]
+    top = sorted(import_time_us("src.plugin").items(), key=lambda x: x[1], reverse=True)[1:11]
+    print(f"src.plugin import: median {median:.1f} ms over {args.runs} runs (budget {args.budget:.0f} ms)")
+    print("Heaviest imports:")
+    for name, us in top:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    
+    elapsed, imported = hint_response()
+    print(f"Hint + settings menu response: {elapsed * 1000:.1f} ms")
+    
+    failed = False
+    if imported:
+        print(f"FAIL: imported on startup path: {', '.join(imported)}")
+        failed = True
+    if median > args.budget:
+        print("FAIL: import time is over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
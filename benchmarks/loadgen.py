@@ -0,0 +1,114 @@
+# End-to-end load generator: replays prefix-by-prefix typing through plugin `query()` and `context_menu()`
+# against local stand-in server and reports latency distributions and request counts
+# Usage: python -m benchmarks.loadgen [--sessions 20] [--keystroke 90] [--target HOST:PORT] [stand-in options]
+
+import os
+import time
+import random
+import asyncio
+import argparse
+from statistics import median
+
+from ._bootstrap import setup_environment
+from .standin import StandInServer, add_config_arguments, config_from_arguments
+
+import typing as t
+
+# Titles people type, each one is typed prefix by prefix as single session
+TITLES = ("naruto", "наруто", "naruto shippuuden", "boruto", "the last naruto", "road to ninja",
+          "blood prison", "naruto movie", "shippuden", "naruto x ut")
+
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return (f"n={len(values)} p50={median(values):.1f} p90={pick(0.9):.1f} p99={pick(0.99):.1f} "
+            f"max={values[-1]:.1f} ms")
+
+
+class LoadGenerator:
+    def __init__(self, keystroke_ms: float, jitter_ms: float, concurrent: bool, seed: t.Optional[int] = None):
+        import src.plugin as plugin
+        from src.supersession import supersession
+        
+        if concurrent:  # Resident v2 process keeps supersession in memory
+            supersession.keep_in_memory()
+        self.plugin = plugin
+        self.keystroke_ms = keystroke_ms
+        self.jitter_ms = jitter_ms
+        self.concurrent = concurrent
+        self.random = random.Random(seed)
+        self.latencies: dict[str, list[float]] = {"query": list(), "context_menu": list()}
+        self.failures: dict[str, int] = dict()
+    
+    async def timed(self, kind: str, coro: t.Awaitable):
+        start = time.perf_counter()
+        try:
+            return await coro
+        except Exception as e:
+            self.failures[type(e).__name__] = self.failures.get(type(e).__name__, 0) + 1
+            return None
+        finally:
+            self.latencies[kind].append((time.perf_counter() - start) * 1000)
+    
+    async def session(self, title: str):
+        """Type title like Flow user does: every keystroke is a query, then open context menu of top result"""
+        pending = list()
+        response = None
+        for end in range(1, len(title) + 1):
+            call = self.timed("query", self.plugin.query(title[:end]))
+            if self.concurrent:  # JSON-RPC v2: Flow does not wait for previous keystroke
+                pending.append(asyncio.ensure_future(call))
+            else:  # JSON-RPC v1: one process per keystroke, effectively sequential
+                response = await call
+            await asyncio.sleep(max(0.0, self.keystroke_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        if pending:
+            response = (await asyncio.gather(*pending))[-1]
+        results = response.get("result") if isinstance(response, dict) else None
+        if results and results[0].get("ContextData"):
+            await self.timed("context_menu", self.plugin.context_menu(results[0]["ContextData"]))
+    
+    async def run(self, sessions: int):
+        for index in range(sessions):
+            await self.session(TITLES[index % len(TITLES)])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadgen", description="End-to-end load generator")
+    parser.add_argument("--sessions", type=int, default=20, help="Typed titles to replay")
+    parser.add_argument("--keystroke", type=float, default=90.0, help="Mean delay between keystrokes, ms")
+    parser.add_argument("--keystroke-jitter", type=float, default=40.0)
+    parser.add_argument("--concurrent", action="store_true", help="Do not wait for previous keystroke (v2 server)")
+    parser.add_argument("--target", default=None, help="Use already running stand-in at HOST:PORT")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    
+    setup_environment()
+    server = None
+    if args.target is None:
+        server = StandInServer(config=config_from_arguments(args)).start()
+    os.environ["SHK_DOMAIN"] = args.target or server.address
+    os.environ["SHK_SCHEME"] = "http"
+    
+    generator = LoadGenerator(args.keystroke, args.keystroke_jitter, args.concurrent, seed=args.seed)
+    started = time.perf_counter()
+    asyncio.run(generator.run(args.sessions))
+    elapsed = time.perf_counter() - started
+    
+    print(f"{args.sessions} sessions in {elapsed:.1f} s ({'concurrent' if args.concurrent else 'sequential'} keystrokes)")
+    for kind, values in generator.latencies.items():
+        print(f"  {kind:<13} {percentiles(values)}")
+    if generator.failures:
+        print("  failures      " + ", ".join(f"{k}: {v}" for k, v in generator.failures.items()))
+    if server is not None:
+        counters = server.counters
+        print(f"  server        requests={counters.requests} graphql={counters.graphql} throttled={counters.throttled} "
+              f"errors={counters.errors} sent={counters.bytes_sent / 1024:.1f} KB")
+        print("  operations    " + ", ".join(f"{k}: {v}" for k, v in sorted(counters.operations.items())))
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Re-record benchmarks/fixtures from live Shikimori GraphQL API and AnMa CDN
+# Usage: python -m benchmarks.record [search]
+
+import os
+import sys
+import json
+
+from ._bootstrap import setup_environment, FIXTURES_PATH
+
+setup_environment()
+
+from src.graphql_queries import GraphQLQueryConstructor  # noqa: E402
+from src.shiki.graphql import GraphQLShikiClient  # noqa: E402
+from src.anma_data import ANMA_URL  # noqa: E402
+
+RESULTS_LIMIT = 20
+
+
+def save(name: str, data):
+    with open(os.path.join(FIXTURES_PATH, name), mode="w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    print(f"Recorded {name}")
+
+
+def main(search: str = "naruto"):
+    with GraphQLShikiClient("ShikiFlow") as client:
+        save("anime_search_detail.json", client.get_raw_data(GraphQLQueryConstructor.anime_get_main_search(search, RESULTS_LIMIT)))
+        save("manga_search_detail.json", client.get_raw_data(GraphQLQueryConstructor.manga_get_main_search(search, RESULTS_LIMIT)))
+        save("both_search_list.json", client.get_raw_data(GraphQLQueryConstructor.both_get_main_search(
+            search, RESULTS_LIMIT, profile="list")))
+        save("anma.json", client.get(ANMA_URL).raise_for_status().json())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
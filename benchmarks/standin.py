@@ -0,0 +1,269 @@
+# Local stand-in for Shikimori `/api/graphql` and `/oauth/token`: replays response fixtures with
+# configurable latency, jitter, injected 429/5xx and Shikimori-like rate limits (5 rps, 90 rpm)
+# Usage: python -m benchmarks.standin [--port 8765] [--latency 120] [--jitter 40] [--error-rate 0.01]
+# Point the plugin at it with SHK_DOMAIN=127.0.0.1:8765 SHK_SCHEME=http
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ._bootstrap import load_fixture, make_node
+
+import typing as t
+
+
+@dataclass
+class StandInConfig:
+    latency_ms: float = 120.0
+    jitter_ms: float = 40.0
+    error_rate: float = 0.0  # Share of requests answered with 5xx
+    throttle_rate: float = 0.0  # Share of requests answered with 429 regardless of rate limits
+    rps: int = 5
+    rpm: int = 90
+    seed: t.Optional[int] = None
+
+
+@dataclass
+class StandInCounters:
+    requests: int = 0
+    graphql: int = 0
+    oauth: int = 0
+    throttled: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    operations: dict[str, int] = field(default_factory=dict)
+
+
+class Catalog:
+    """Fixture nodes indexed for search and by-id lookups, unknown ids are synthesized"""
+    NAME_FIELDS = ("name", "russian", "english", "japanese", "licenseNameRu")
+    
+    def __init__(self):
+        self.nodes = {"animes": load_fixture("anime_search_detail.json")["data"]["animes"],
+                      "mangas": load_fixture("manga_search_detail.json")["data"]["mangas"]}
+        self.by_id = {key: {int(x["id"]): x for x in nodes} for key, nodes in self.nodes.items()}
+    
+    def search(self, key: str, search: str, limit: int) -> list[dict]:
+        search = search.lower()
+        found = [x for x in self.nodes[key] if any(search in (x.get(name) or "").lower() for name in self.NAME_FIELDS)]
+        return found[:limit]
+    
+    def ids(self, key: str, ids: list[int]) -> list[dict]:
+        return [self.by_id[key].get(x) or make_node(x, "Anime" if key == "animes" else "Manga") for x in ids]
+    
+    def page(self, key: str, page: int, limit: int) -> list[dict]:
+        return self.nodes[key][(page - 1) * limit:page * limit]
+
+
+def top_level_fields(selection: str) -> set[str]:
+    fields, depth, token = set(), 0, ""
+    for char in selection:
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        if depth == 0 and (char.isalnum() or char == "_"):
+            token += char
+            continue
+        if token:
+            fields.add(token)
+            token = ""
+    if token:
+        fields.add(token)
+    return fields
+
+
+def project(node: dict, fields: set[str]) -> dict:
+    return {k: v for k, v in node.items() if k in fields}
+
+
+def selections(query: str) -> list[tuple[str, str, dict[str, str], str]]:
+    """(response key, root field, {argument: variable}, selection) of every root field of GraphQL document"""
+    result = list()
+    for matched in re.finditer(r"(?:\b(\w+)\s*:\s*)?\b(animes|mangas)\s*\(([^)]*)\)\s*\{", query):
+        depth, start = 1, matched.end()
+        end = start
+        while depth and end < len(query):
+            depth += {"{": 1, "}": -1}.get(query[end], 0)
+            end += 1
+        arguments = dict(re.findall(r"(\w+)\s*:\s*\$(\w+)", matched.group(3)))
+        result.append((matched.group(1) or matched.group(2), matched.group(2), arguments, query[start:end - 1]))
+    return result
+
+
+class RateLimiter:
+    def __init__(self, rps: int, rpm: int):
+        self.rps, self.rpm = rps, rpm
+        self.history: deque[float] = deque()
+        self.lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            while self.history and now - self.history[0] > 60:
+                self.history.popleft()
+            last_second = sum(1 for x in self.history if now - x <= 1)
+            if (self.rps and last_second >= self.rps) or (self.rpm and len(self.history) >= self.rpm):
+                return False
+            self.history.append(now)
+            return True
+
+
+class StandInServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: t.Optional[StandInConfig] = None):
+        self.config = config if config is not None else StandInConfig()
+        self.counters = StandInCounters()
+        self.catalog = Catalog()
+        self.limiter = RateLimiter(self.config.rps, self.config.rpm)
+        self.random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread: t.Optional[threading.Thread] = None
+    
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+    
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            setattr(self.counters, name, getattr(self.counters, name) + value)
+    
+    def delay(self):
+        with self._lock:
+            jitter = self.random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+        time.sleep(max(0.0, self.config.latency_ms + jitter) / 1000)
+    
+    def fault(self) -> t.Optional[int]:
+        """Status code to fail request with, if any"""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.config.throttle_rate or not self.limiter.allow():
+            self.count("throttled")
+            return 429
+        if roll < self.config.throttle_rate + self.config.error_rate:
+            self.count("errors")
+            return self.random.choice((500, 502, 503))
+        return None
+    
+    def graphql(self, payload: dict) -> dict:
+        query, variables = payload.get("query", ""), payload.get("variables") or dict()
+        operation = re.match(r"\s*query\s+(\w+)", query)
+        with self._lock:
+            name = operation.group(1) if operation else "anonymous"
+            self.counters.operations[name] = self.counters.operations.get(name, 0) + 1
+        data = dict()
+        for response_key, key, arguments, selection in selections(query):
+            values = {name: variables.get(variable) for name, variable in arguments.items()}
+            limit = int(values.get("limit") or 10)
+            if "ids" in arguments:
+                nodes = self.catalog.ids(key, [int(x) for x in str(values.get("ids") or "").split(",") if x])
+            elif "page" in arguments:
+                nodes = self.catalog.page(key, int(values.get("page") or 1), limit)
+            else:
+                nodes = self.catalog.search(key, str(values.get("search") or ""), limit)
+            fields = top_level_fields(selection)
+            data[response_key] = [project(x, fields) for x in nodes]
+        return {"data": data}
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def send_json(self, status: int, body: dict, headers: t.Optional[dict] = None):
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(raw)))
+                for key, value in (headers or dict()).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(raw)
+                server.count("bytes_sent", len(raw))
+            
+            def do_POST(self):
+                server.count("requests")
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                server.delay()
+                status = server.fault()
+                if status == 429:
+                    return self.send_json(429, {"message": "Retry later"}, {"Retry-After": "1"})
+                if status is not None:
+                    return self.send_json(status, {"message": "Internal server error"})
+                if self.path.startswith("/api/graphql"):
+                    server.count("graphql")
+                    try:
+                        payload = json.loads(body or b"{}")
+                    except json.JSONDecodeError:
+                        return self.send_json(400, {"errors": [{"message": "Malformed JSON"}]})
+                    return self.send_json(200, server.graphql(payload))
+                if self.path.startswith("/oauth/token"):
+                    server.count("oauth")
+                    return self.send_json(200, {"access_token": "standin-access", "refresh_token": "standin-refresh",
+                                                "token_type": "Bearer", "expires_in": 86400, "created_at": int(time.time()),
+                                                "scope": "user_rates"})
+                return self.send_json(404, {"message": "Not found"})
+        
+        return Handler
+    
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="standin", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=120.0, help="Base response latency, ms")
+    parser.add_argument("--jitter", type=float, default=40.0, help="Uniform latency jitter, +-ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 5xx responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of forced 429 responses")
+    parser.add_argument("--rps", type=int, default=5, help="Requests per second before 429, 0 disables")
+    parser.add_argument("--rpm", type=int, default=90, help="Requests per minute before 429, 0 disables")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_arguments(args: argparse.Namespace) -> StandInConfig:
+    return StandInConfig(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                         throttle_rate=args.throttle_rate, rps=args.rps, rpm=args.rpm, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.standin", description="Local Shikimori stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = StandInServer(args.host, args.port, config_from_arguments(args))
+    print(f"Serving on http://{server.address}, use SHK_DOMAIN={server.address} SHK_SCHEME=http")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.counters.__dict__, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# Offline benchmark suite over GraphQL response fixtures and synthetic scale fixtures
+# Usage: python -m benchmarks [-k NAME] [--save] [--threshold 0.3] [--repeat 7]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from statistics import median
+
+from ._bootstrap import setup_environment, load_fixture, make_node, make_anma, SETTINGS
+
+import typing as t
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_THRESHOLD = 0.3  # Fail when median time or peak memory grew by more than 30%
+SCALE_ENTRIES = 10_000
+SCALE_EXT_SEARCHES = 1_000
+
+CASES: dict[str, t.Callable[[], t.Callable[[], t.Any]]] = dict()
+
+
+def case(func: t.Callable[[], t.Callable[[], t.Any]]):
+    """Register benchmark: decorated function does the setup and returns callable to measure"""
+    CASES[func.__name__] = func
+    return func
+
+
+def _scale_payload(count: int) -> dict:
+    half = count // 2
+    return {"data": {"animes": [make_node(i, "Anime") for i in range(1, half + 1)],
+                     "mangas": [make_node(i, "Manga") for i in range(1, count - half + 1)]}}
+
+
+def _fresh(payload: dict) -> dict:
+    # parse_data replaces node lists in place, nodes themselves are left untouched
+    return {"data": {k: list(v) for k, v in payload["data"].items()}}
+
+
+def _fixture_payload() -> dict:
+    return {"data": {"animes": load_fixture("anime_search_detail.json")["data"]["animes"],
+                     "mangas": load_fixture("manga_search_detail.json")["data"]["mangas"]}}
+
+
+# Queries
+
+@case
+def search_tags():
+    from src.plugin import SearchTags
+    queries = ["naruto", "a:naruto", "m: berserk", "am:one piece", "i:1,20,1735", "s:exts e", "o:frieren",
+               "https://shikimori.one/animes/20-naruto", "ab", "b:shingeki no kyojin"] * 100
+    return lambda: [SearchTags(x).clean_query for x in queries]
+
+
+@case
+def query_constructor():
+    from src.graphql_queries import GraphQLQueryConstructor
+    queries = [f"naruto {i}" for i in range(1000)]
+    def run():
+        for i, x in enumerate(queries):
+            GraphQLQueryConstructor.anime_get_main_search(x, 10, profile="list")
+            GraphQLQueryConstructor.both_get_main_search(x, 10)
+            GraphQLQueryConstructor.both_get_main_by_ids((i, i + 1, i + 2))
+    return run
+
+
+@case
+def batch_constructor():
+    from src.graphql_queries import GraphQLQueryConstructor
+    queries = [GraphQLQueryConstructor.anime_get_main_search(f"naruto {i}", 5, profile="list") for i in range(10)]
+    return lambda: [GraphQLQueryConstructor.batch(queries[:i % len(queries) + 1]) for i in range(1000)]
+
+
+# Parsing
+
+@case
+def parse_data_fixture():
+    from src.shiki.graphql import GraphQLDataParser
+    payload = _fixture_payload()
+    return lambda: GraphQLDataParser.parse_data(_fresh(payload))
+
+
+@case
+def parse_data_scale():
+    from src.shiki.graphql import GraphQLDataParser
+    payload = _scale_payload(SCALE_ENTRIES)
+    return lambda: GraphQLDataParser.parse_data(_fresh(payload))
+
+
+@case
+def parse_batch_fixture():
+    from src.shiki.graphql import GraphQLDataParser
+    payload = _fixture_payload()["data"]
+    aliases = [{f"o{i}_animes": "animes", f"o{i}_mangas": "mangas"} for i in range(10)]
+    batched = {"data": {alias: payload[field] for x in aliases for alias, field in x.items()}}
+    return lambda: GraphQLDataParser.parse_batch(batched, aliases)
+
+
+@case
+def json_decode_scale():
+    text = json.dumps(_scale_payload(SCALE_ENTRIES), ensure_ascii=False)
+    return lambda: json.loads(text)
+
+
+@case
+def entry_properties_scale():
+    from src.shiki.graphql import GraphQLDataParser
+    data = GraphQLDataParser.parse_data(_fresh(_scale_payload(SCALE_ENTRIES)))
+    entries = data["animes"] + data["mangas"]
+    fields = ("id_", "mal_id", "name", "russian", "english", "japanese", "synonyms", "url", "aired_on",
+              "kind", "status", "external_links", "icon_url", "is_censored")
+    return lambda: [getattr(entry, field) for entry in entries for field in fields]
+
+
+# Results
+
+def _result_constructor():
+    from src.result import ResultConstructor
+    return ResultConstructor(SETTINGS, lang="en")
+
+
+@case
+def result_generator_fixture():
+    from src.shiki.graphql import GraphQLDataParser
+    constructor = _result_constructor()
+    data = GraphQLDataParser.parse_data(_fresh(_fixture_payload()))
+    return lambda: list(constructor.result_generator(data))
+
+
+@case
+def result_generator_scale():
+    from src.shiki.graphql import GraphQLDataParser
+    constructor = _result_constructor()
+    data = GraphQLDataParser.parse_data(_fresh(_scale_payload(SCALE_ENTRIES)))
+    return lambda: list(constructor.result_generator(data))
+
+
+@case
+def context_menu_fixture():
+    from src.shiki.graphql import GraphQLDataParser
+    constructor = _result_constructor()
+    data = GraphQLDataParser.parse_data(_fresh(_fixture_payload()))
+    entries = data["animes"] + data["mangas"]
+    return lambda: [constructor.make_context_menu(x) for x in entries]
+
+
+# Settings menu
+
+def _external_search_export(anma: list[dict]):
+    import src.osettings_menu as osettings_menu
+    osettings_menu.get_anma_data = lambda: anma  # Offline: AnMa list fixture instead of CDN
+    return lambda: (osettings_menu.OSettingsMenu.external_search_export(""),
+                    osettings_menu.OSettingsMenu.external_search_export("anime"))
+
+
+@case
+def external_search_export_fixture():
+    return _external_search_export(load_fixture("anma.json"))
+
+
+@case
+def external_search_export_scale():
+    return _external_search_export(make_anma(SCALE_EXT_SEARCHES))
+
+
+@case
+def picker_typing_scale():
+    from src.picker_index import FuzzyIndex
+    index = FuzzyIndex(make_anma(SCALE_EXT_SEARCHES), name=lambda x: x["name"])
+    prefixes = ["anime"[:i] for i in range(1, 6)] + ["mintm"[:i] for i in range(1, 6)]
+    
+    def run():
+        index._queries.clear()  # Every run types queries from scratch
+        return [index.search(x) for x in prefixes]
+    return run
+
+
+@case
+def anma_store_load():
+    import tempfile
+    from src.anma_data import AnmaStore
+    store = AnmaStore(os.path.join(tempfile.mkdtemp(), "anma_data.json"))
+    store.data = make_anma(SCALE_EXT_SEARCHES)
+    store.meta["fetched"] = time.time()
+    store.save()
+    return lambda: AnmaStore(store.path).get()
+
+
+@case
+def favicon_lookup():
+    from src.favicon import get_favicon_manager
+    from src.shiki.types import MediaEntry
+    urls = [x["url"] if isinstance(x["url"], str) else x["url"]["Anime"] for x in make_anma(SCALE_EXT_SEARCHES)]
+    urls += list(MediaEntry.EXT_LINKS_HOMEPAGE.values())
+    return lambda: [get_favicon_manager().get_fav_path(x) for x in urls]
+
+
+# Runner
+
+def measure(func: t.Callable[[], t.Any], repeat: int, min_time: float = 0.2) -> dict:
+    func()  # Warm up memoization and imports
+    timings = list()
+    started = time.perf_counter()
+    while len(timings) < repeat or (time.perf_counter() - started < min_time and len(timings) < repeat * 10):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_ms": median(timings) * 1000, "min_ms": min(timings) * 1000, "runs": len(timings),
+            "peak_kb": peak / 1024}
+
+
+def load_baselines(path: str = BASELINES_FILE) -> dict:
+    if not os.path.exists(path):
+        return dict()
+    with open(path, mode="r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(name: str, result: dict, baseline: t.Optional[dict], threshold: float) -> list[str]:
+    if not baseline:
+        return list()
+    regressions = list()
+    for key in ("median_ms", "peak_kb"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + threshold):
+            regressions.append(f"{name}: {key} {result[key]:.2f} > {baseline[key]:.2f} (+{result[key] / baseline[key] - 1:.0%})")
+    return regressions
+
+
+def main(argv: t.Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline benchmark suite")
+    parser.add_argument("-k", dest="pattern", default="", help="Run only cases with this substring in name")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baselines", default=BASELINES_FILE)
+    parser.add_argument("--save", action="store_true", help="Store results as new baselines")
+    args = parser.parse_args(argv)
+    
+    setup_environment()
+    baselines = load_baselines(args.baselines)
+    results, regressions = dict(), list()
+    print(f"{'case':<34}{'median ms':>12}{'min ms':>12}{'peak KB':>12}{'baseline ms':>14}")
+    for name, setup in CASES.items():
+        if args.pattern not in name:
+            continue
+        results[name] = measure(setup(), args.repeat)
+        baseline = baselines.get(name)
+        print(f"{name:<34}{results[name]['median_ms']:>12.2f}{results[name]['min_ms']:>12.2f}"
+              f"{results[name]['peak_kb']:>12.1f}{baseline['median_ms'] if baseline else float('nan'):>14.2f}")
+        regressions += compare(name, results[name], baseline, args.threshold)
+    
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, mode="w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baselines saved to {args.baselines}")
+        return
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0%}:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
@@ -1,5 +1,4 @@
 import logging
-from logging.handlers import TimedRotatingFileHandler
 import sys
 import os
 from pathlib import Path
@@ -13,16 +12,18 @@ try:
 except ImportError:
     pass
 
-file_handler = TimedRotatingFileHandler("shikiflow.log", when='D', interval=1, backupCount=1, encoding='utf-8')
-formatter = logging.Formatter(fmt="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
-file_handler.setFormatter(formatter)
+from src.log import setup_logging
 
-logging.basicConfig(handlers=[file_handler], level=logging.DEBUG if os.environ.get("SHK_LOGGING_DEBUG") else logging.INFO)
+setup_logging(str(plugin_dir / "shikiflow.log"), level=logging.DEBUG if os.environ.get("SHK_LOGGING_DEBUG") else logging.INFO)
 
 
 def run():
-    from src.plugin import plugin
-    plugin.run()
+    if len(sys.argv) > 1:  # JsonRPC V1: request is passed as argument, one process per call
+        from src.plugin import plugin
+        plugin.run()
+    else:  # JsonRPC V2: resident process talking over stdio
+        from src.server import serve
+        serve()
 
 try:
     run()
@@ -0,0 +1,26 @@
+# Bulk resolver CLI: python resolve.py titles.txt -o resolved.jsonl
+# Lines are titles, Shikimori IDs or `mal:<id>`, see `python resolve.py --help`
+import os
+import sys
+from pathlib import Path
+
+plugin_dir = Path.absolute(Path(__file__).parent)
+sys.path = [str(plugin_dir / p) for p in (".", "lib", "plugin")] + sys.path
+
+# Run outside of Flow: find its data from plugin's place (<data>/Plugins/ShikiFlow-x), so caches are shared
+if "FLOW_APPLICATION_DIRECTORY" not in os.environ:
+    data_dir = plugin_dir.parent.parent
+    flow_dir = data_dir.parent if data_dir.name == "UserData" else data_dir  # Portable or roaming
+    os.environ.setdefault("FLOW_PROGRAM_DIRECTORY", str(flow_dir))
+    os.environ.setdefault("FLOW_APPLICATION_DIRECTORY", str(flow_dir))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(str(plugin_dir / ".env"))
+except ImportError:
+    pass
+
+from src.resolver import main
+
+if __name__ == "__main__":
+    main()
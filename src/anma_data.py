@@ -1,50 +1,128 @@
-from datetime import date
+from datetime import date, datetime
 import os
 import json
-
-import httpx
+import time
+import logging
+import threading
 
 from .shared import PLUGIN_CACHE_FOLDER
 
+import typing as t
+
+logger = logging.getLogger(__name__)
+
 ANMA_URL = r"https://cdn.jsdelivr.net/gh/NoPlagiarism/AnMaSearchTerms@master/all.min.json"
 ANMA_CACHE_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "anma_data.json") if PLUGIN_CACHE_FOLDER else None
 DAYS_CACHE_ALIVE = 7
+CACHE_VERSION = 2
+FIELDS = ("name", "media_type", "url")  # Cached entries are rows of these, without keys repeated in every entry
+
+
+class AnmaStore:
+    """AnMa search terms, parsed once per process.
+    
+    Stale list is served at once and revalidated in background thread with ETag/Last-Modified,
+    only first ever use waits for download"""
+    RETRY_INTERVAL = 60.0
+    
+    def __init__(self, path: t.Optional[str] = ANMA_CACHE_FILE, url: str = ANMA_URL,
+                 max_age: float = DAYS_CACHE_ALIVE * 24 * 60 * 60):
+        self.path = path
+        self.url = url
+        self.max_age = max_age
+        self.data: t.Optional[list[dict]] = None
+        self.meta = {"fetched": 0.0, "etag": None, "last_modified": None}
+        self._loaded = False
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+        self._thread: t.Optional[threading.Thread] = None
+    
+    @staticmethod
+    def pack(data: list[dict]) -> list[list]:
+        return [[x.get(key) for key in FIELDS] for x in data]
+    
+    @staticmethod
+    def unpack(rows: list[list]) -> list[dict]:
+        return [dict(zip(FIELDS, row)) for row in rows]
+    
+    def load(self):
+        self._loaded = True
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, mode="r", encoding="utf-8") as f:
+                raw_data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Got exc %s while loading AnMa cache", e)
+            return
+        if raw_data.get("version") == CACHE_VERSION:
+            self.data = self.unpack(raw_data["rows"])
+            self.meta = {key: raw_data.get(key) for key in self.meta}
+        elif "data" in raw_data and "date" in raw_data:  # Cache of older versions, refreshed as stale
+            self.data = raw_data["data"]
+            self.meta["fetched"] = datetime.combine(date.fromisoformat(raw_data["date"]), datetime.min.time()).timestamp()
+    
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.path + ".tmp", mode="w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, **self.meta, "rows": self.pack(self.data)}, f,
+                          ensure_ascii=False, separators=(",", ":"))
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logger.warning("Got exc %s while saving AnMa cache", e)
+    
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - (self.meta["fetched"] or 0.0) >= self.max_age
+    
+    def refresh(self):
+        """Download list if it changed since last time"""
+        import httpx
+        
+        headers = {"User-Agent": "ShikiFlow"}
+        if self.data is not None and self.meta["etag"]:
+            headers["If-None-Match"] = self.meta["etag"]
+        if self.data is not None and self.meta["last_modified"]:
+            headers["If-Modified-Since"] = self.meta["last_modified"]
+        try:
+            resp = httpx.get(self.url, headers=headers, follow_redirects=True)
+            if resp.status_code != 304:
+                resp.raise_for_status()
+                data = resp.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning("Got exc %s while refreshing AnMa data", e)
+            self._next_attempt = time.time() + self.RETRY_INTERVAL
+            return
+        with self._lock:
+            if resp.status_code != 304:
+                self.data = data
+            self.meta = {"fetched": time.time(), "etag": resp.headers.get("ETag", self.meta["etag"]),
+                         "last_modified": resp.headers.get("Last-Modified", self.meta["last_modified"])}
+            self.save()
+        logger.info("AnMa data is %s", "not modified" if resp.status_code == 304 else "updated")
+    
+    def _refresh_in_background(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.refresh, name="anma-refresh", daemon=True)
+        self._thread.start()
+    
+    def get(self) -> list[dict]:
+        if not self._loaded:
+            self.load()
+        if self.is_stale and time.time() >= self._next_attempt:
+            if self.data is None:
+                self.refresh()
+            else:
+                self._refresh_in_background()
+        return self.data if self.data is not None else list()
+
+
+anma_store = AnmaStore()
+
 
-def check_cache():
-    if PLUGIN_CACHE_FOLDER is None:
-        return
-    if not os.path.exists(PLUGIN_CACHE_FOLDER):
-        os.makedirs(PLUGIN_CACHE_FOLDER)
-    if not os.path.exists(ANMA_CACHE_FILE):
-        return False
-    try:
-        with open(ANMA_CACHE_FILE, mode="r", encoding="utf-8") as f:
-            raw_data = json.load(f)
-    except Exception:
-        return False
-    if "data" not in raw_data:
-        return False
-    try:
-        dt = date.fromisoformat(raw_data["data"])
-        return (date.today() - dt).days >= DAYS_CACHE_ALIVE
-    except Exception:
-        return False
-
-def load_cache():
-    if check_cache():
-        with open(ANMA_CACHE_FILE, mode="r", encoding="utf-8") as f:
-            return json.load(f)["data"]
-
-def get_anma_data():
-    if check_cache():
-        return load_cache()
-    
-    resp = httpx.get(ANMA_URL, headers={"User-Agent": "ShikiFlow"})
-    data = resp.json()
-    
-    # Cache
-    if PLUGIN_CACHE_FOLDER is not None:
-        with open(ANMA_CACHE_FILE, mode="w+", encoding="utf-8") as f:
-            json.dump({"date": date.today().isoformat(), "data": data}, f)
-    
-    return data
+def get_anma_data() -> list[dict]:
+    return anma_store.get()
@@ -0,0 +1,23 @@
+import os
+import sys
+import logging
+import subprocess
+
+from .shared import ROOT_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def spawn_background(module: str, *args: str) -> subprocess.Popen:
+    """Run `python -m <module> <args>` detached from current process, so long jobs outlive Flow's call"""
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (ROOT_PATH, os.path.join(ROOT_PATH, "lib"), env.get("PYTHONPATH"))))
+    kwargs = dict()
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+    else:
+        kwargs["start_new_session"] = True
+    logger.info(f"Spawning background job {module} {' '.join(args)}")
+    return subprocess.Popen([sys.executable, "-m", module, *args], cwd=ROOT_PATH, env=env,
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            **kwargs)
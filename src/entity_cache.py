@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .shiki.graphql import MediaEntryFromGraph, decode_node, merge_node
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "entities.sqlite3") if PLUGIN_CACHE_FOLDER else None
+
+
+class EntityCache:
+    """Normalized store of GraphQL entry nodes keyed by (type, id), shared by search, ID lookups and context menu.
+    
+    Partial projections (list and detail selections) of the same entry are merged into one node, `detail_at`
+    tells when detail projection was fetched last. Decoded entries of recent lookups are kept in memory,
+    nodes themselves on disk (in memory only when there is no `path`).
+    Results carry only small handle (see `make_handle`), context menu resolves it here"""
+    DEFAULT_MAX_ENTRIES = 5000
+    DEFAULT_MEMORY_ENTRIES = 500
+    DEFAULT_MAX_AGE = 60 * 60
+    ABSENT_MAX_AGE = 7 * 24 * 60 * 60  # New entries get new ids, so "no manga with this id" holds for long
+    
+    def __init__(self, path: t.Optional[str] = ENTITY_CACHE_FILE, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 memory_entries: int = DEFAULT_MEMORY_ENTRIES, max_age: int = DEFAULT_MAX_AGE):
+        self.path = path if path else ":memory:"
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.max_age = max_age  # Entries fetched earlier are stale for ID lookups
+        # (type, id): (entry, detail_at)
+        self._memory: OrderedDict[tuple[str, int], tuple[MediaEntryFromGraph, t.Optional[float]]] = OrderedDict()
+        
+        if path and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._init_db()
+    
+    def _init_db(self):
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entities ("
+                           "type TEXT NOT NULL, id INTEGER NOT NULL, payload TEXT NOT NULL,"
+                           "fetched_at REAL NOT NULL, detail_at REAL, PRIMARY KEY (type, id))")
+        if "detail_at" not in [x[1] for x in self._conn.execute("PRAGMA table_info(entities)")]:
+            self._conn.execute("ALTER TABLE entities ADD COLUMN detail_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entities_fetched ON entities (fetched_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS absent ("
+                           "type TEXT NOT NULL, id INTEGER NOT NULL, checked_at REAL NOT NULL, PRIMARY KEY (type, id))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+    
+    @property
+    def generation(self) -> int:
+        """Bumped on every clear, so handles issued before it are not resolved to wrong data"""
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+    
+    def make_handle(self, entry: MediaEntryFromGraph) -> dict:
+        return {"type_": entry.type_, "id": entry.id_, "gen": self.generation}
+    
+    @staticmethod
+    def is_handle(context_data: dict) -> bool:
+        return "id" in context_data and "_data" not in context_data
+    
+    def _remember(self, key: tuple[str, int], entry: MediaEntryFromGraph, detail_at: t.Optional[float]):
+        self._memory[key] = (entry, detail_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def put(self, entry: MediaEntryFromGraph):
+        now = time.time()
+        row = self._conn.execute("SELECT payload, detail_at FROM entities WHERE type = ? AND id = ?",
+                                 (entry.type_, entry.id_)).fetchone()
+        payload = merge_node(json.loads(row[0]), entry._data) if row else dict(entry._data)  # Lean entry must not wipe fields of detailed one
+        detail_at = now if entry.has_details else (row[1] if row else None)
+        self._conn.execute("INSERT OR REPLACE INTO entities (type, id, payload, fetched_at, detail_at) VALUES (?, ?, ?, ?, ?)",
+                           (entry.type_, entry.id_, json.dumps(payload, ensure_ascii=False), now, detail_at))
+        self._conn.execute("DELETE FROM absent WHERE type = ? AND id = ?", (entry.type_, entry.id_))
+        self._remember((entry.type_, entry.id_), decode_node(entry.type_, payload), detail_at)
+    
+    def put_many(self, data: t.Optional[dict]):
+        """Store entries from data in shape of GraphQLShikiClient.parse_data"""
+        if not data:
+            return
+        entries = list(data.get("animes", list())) + list(data.get("mangas", list()))
+        self._conn.execute("BEGIN")
+        try:
+            for entry in entries:
+                self.put(entry)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            for entry in entries:  # Memory must not outlive rolled back rows
+                self._memory.pop((entry.type_, entry.id_), None)
+            raise
+        self._conn.execute("COMMIT")
+        self.evict()
+    
+    def _get(self, media_type: str, id_: int) -> t.Optional[tuple[MediaEntryFromGraph, t.Optional[float]]]:
+        key = (media_type.capitalize(), int(id_))
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        row = self._conn.execute("SELECT payload, detail_at FROM entities WHERE type = ? AND id = ?", key).fetchone()
+        if row is None:
+            return None
+        found = (decode_node(media_type, json.loads(row[0])), row[1])
+        self._remember(key, *found)
+        return found
+    
+    def get(self, media_type: str, id_: int) -> t.Optional[MediaEntryFromGraph]:
+        found = self._get(media_type, id_)
+        return found[0] if found else None
+    
+    def get_many(self, media_type: str, ids: t.Iterable[int], detailed: bool = False) -> tuple[dict[int, MediaEntryFromGraph], list[int]]:
+        """Known entries by id and ids, that are missing (or stale, when `detailed` projection is asked for)"""
+        found, missing = dict(), list()
+        now = time.time()
+        for id_ in ids:
+            cached = self._get(media_type, id_)
+            if cached is None or (detailed and (cached[1] is None or now - cached[1] > self.max_age)):
+                missing.append(int(id_))
+            else:
+                found[int(id_)] = cached[0]
+        return found, missing
+    
+    def mark_absent(self, media_type: str, ids: t.Iterable[int]):
+        """Server has no entry of `media_type` with these ids, they will not be asked for it again for a while"""
+        now = time.time()
+        self._conn.executemany("INSERT OR REPLACE INTO absent (type, id, checked_at) VALUES (?, ?, ?)",
+                               [(media_type.capitalize(), int(x), now) for x in ids])
+    
+    def absent(self, media_type: str, ids: t.Iterable[int]) -> set[int]:
+        ids = [int(x) for x in ids]
+        result = set()
+        for start in range(0, len(ids), 500):  # Keep under SQLite variables limit
+            chunk = ids[start:start + 500]
+            result.update(x[0] for x in self._conn.execute(
+                f"SELECT id FROM absent WHERE type = ? AND checked_at > ? AND id IN ({', '.join('?' * len(chunk))})",
+                (media_type.capitalize(), time.time() - self.ABSENT_MAX_AGE, *chunk)))
+        return result
+    
+    def resolve_handle(self, handle: dict) -> t.Optional[MediaEntryFromGraph]:
+        if handle.get("gen", 0) != self.generation:
+            return None
+        return self.get(handle["type_"], handle["id"])
+    
+    def evict(self):
+        self._conn.execute("DELETE FROM entities WHERE rowid IN "
+                           "(SELECT rowid FROM entities ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)", (self.max_entries, ))
+    
+    def clear(self):
+        self._memory.clear()
+        self._conn.execute("DELETE FROM entities")
+        self._conn.execute("DELETE FROM absent")
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+    
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+    
+    def close(self):
+        self._conn.close()
@@ -1,13 +1,21 @@
-import asyncio
-import base64
-from io import BytesIO
 import os
+import re
+import json
+import time
+import html
+import base64
+import asyncio
 import logging
+from io import BytesIO
+from functools import cache
 
-import httpx
+from .shared import FAVICON_FOLDER_ROOT, FAVICON_FOLDER_CUSTOM, PLUGIN_CACHE_FOLDER, url_host
 
 import typing as t
 
+if t.TYPE_CHECKING:
+    import httpx
+
 logger = logging.getLogger(__name__)
 
 # 2nd level domains where subdomains used
@@ -20,28 +28,60 @@ GLOBAL_DOMAINS = [
     "usagi.one",
 ]
 
+FAVICON_FETCH_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "favicon_fetch.json") if PLUGIN_CACHE_FOLDER else None
+
+ICON_SIZE = 32  # Same as bundled favicons
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+ICO_MAGIC = b"\x00\x00\x01\x00"
+LINK_RE = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+ATTR_RE = re.compile(r"""([\w-]+)\s*=\s*("[^"]*"|'[^']*'|[^\s>]+)""")
+
+
+def build_suffix_trie(domains: t.Iterable[str]) -> dict:
+    """Trie over reversed domain labels: "wikipedia.org" is {"org": {"wikipedia": {None: "wikipedia.org"}}}"""
+    trie = dict()
+    for domain in domains:
+        node = trie
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, dict())
+        node[None] = domain
+    return trie
+
+
+GLOBAL_DOMAINS_TRIE = build_suffix_trie(GLOBAL_DOMAINS)
+
 
 class BasicFaviconProvider:    
     @staticmethod
     def simplify_domain(dom: str):
-        res = dom[4:] if dom.startswith("www.") else dom
-        for x in GLOBAL_DOMAINS:
-            if dom.endswith(x):
-                return x
-        return res
+        """Collapse subdomains of global domains (ru.wikipedia.org -> wikipedia.org), strip www"""
+        node = GLOBAL_DOMAINS_TRIE
+        for label in reversed(dom.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            if None in node:
+                return node[None]
+        return dom[4:] if dom.startswith("www.") else dom
     
     @staticmethod
-    def get_domain(dom: httpx.URL | str) -> str:
+    def get_domain(dom: t.Union["httpx.URL", str]) -> str:
         if isinstance(dom, str):
             if "/" in dom and not (dom.startswith("http://") or dom.startswith("https://")):
                 dom = "https://" + dom
             if dom.startswith("https://") or dom.startswith("http://"):
-                return httpx.URL(dom).host
+                return url_host(dom)
             return dom
         return dom.host
 
 
-class FaviconManager:    
+class FaviconManager:
+    """Favicon lookups over index of cache folders, built with one scan per folder.
+    
+    Folders are rescanned when mtime of any of them changed, mtimes are checked at most every `CHECK_INTERVAL`"""
+    CHECK_INTERVAL = 5.0
+    MAX_LOOKUPS = 4096
+    
     def __init__(self, cache_paths: list[str]):
         
         self.cache_paths = [x for x in cache_paths if x]  # Escape None's in arguments
@@ -49,15 +89,319 @@ class FaviconManager:
         for path in self.cache_paths:
             if not os.path.exists(path):
                 os.makedirs(path)
+        
+        self._folders: dict[str, dict[str, str]] = dict()  # Folder: {simplified domain: favicon path}
+        self._index: dict[str, str] = dict()  # All folders merged, earlier ones win
+        self._lookups: dict[str, t.Optional[str]] = dict()  # Url or domain as passed: favicon path
+        self._mtimes: list[float] = list()
+        self._checked_at = 0.0
+        self.rebuild()
     
-    @staticmethod
-    def get_fav_path_in_folder(dom: str | httpx.URL, path: str) -> t.Optional[str]:
-        fav_path = os.path.join(path, BasicFaviconProvider.simplify_domain(BasicFaviconProvider.get_domain(dom)) + ".png")
-        if os.path.exists(fav_path):
-            return fav_path
+    def _folder_mtimes(self) -> list[float]:
+        mtimes = list()
+        for path in self.cache_paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(0.0)
+        return mtimes
     
-    def get_fav_path(self, dom: str | httpx.URL) -> t.Optional[str]:
+    def rebuild(self):
+        folders = dict()
         for path in self.cache_paths:
-            fav_path = self.get_fav_path_in_folder(dom, path)
-            if fav_path:
-                return fav_path
+            folders[path] = dict()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(".png") and entry.is_file():
+                            folders[path][entry.name[:-4]] = entry.path
+            except OSError as e:
+                logger.warning("Got exc %s while scanning favicons in %s", e, path)
+        self._folders = folders
+        self._index = dict()
+        for folder in reversed(folders.values()):
+            self._index.update(folder)
+        self._lookups = dict()
+        self._mtimes = self._folder_mtimes()
+        self._checked_at = time.monotonic()
+    
+    def invalidate(self):
+        """Favicons were added or removed by this process, next lookup rescans folders"""
+        self._checked_at = 0.0
+        self._mtimes = list()
+    
+    def _check(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._folder_mtimes() != self._mtimes:
+            self.rebuild()
+    
+    def get_fav_path_in_folder(self, dom: t.Union[str, "httpx.URL"], path: str) -> t.Optional[str]:
+        self._check()
+        folder = self._folders.get(path)
+        if folder is None:
+            fav_path = os.path.join(path, BasicFaviconProvider.simplify_domain(BasicFaviconProvider.get_domain(dom)) + ".png")
+            return fav_path if os.path.exists(fav_path) else None
+        return folder.get(BasicFaviconProvider.simplify_domain(BasicFaviconProvider.get_domain(dom)))
+    
+    def get_fav_path(self, dom: t.Union[str, "httpx.URL"]) -> t.Optional[str]:
+        self._check()
+        key = str(dom)
+        if key not in self._lookups:
+            if len(self._lookups) >= self.MAX_LOOKUPS:
+                self._lookups.clear()
+            self._lookups[key] = self._index.get(BasicFaviconProvider.simplify_domain(BasicFaviconProvider.get_domain(dom)))
+        return self._lookups[key]
+
+
+@cache
+def get_favicon_manager() -> FaviconManager:
+    """Shared manager over custom and bundled favicons, created on first lookup"""
+    return FaviconManager([FAVICON_FOLDER_CUSTOM, FAVICON_FOLDER_ROOT])
+
+
+def external_search_urls(include_anma: bool = False) -> list[str]:
+    """Urls of external searches, which are shown with favicons"""
+    from itertools import chain
+    from .osettings import osettings, ExtSearch
+    from .anma_data import get_anma_data
+    
+    urls = list()
+    for exts in chain(osettings.external_search, (map(ExtSearch.from_dict, get_anma_data()) if include_anma else list())):  # type: ExtSearch
+        if isinstance(exts.url, dict):
+            urls += [exts.url['Anime'], exts.url['Manga']]
+        else:
+            urls.append(exts.url)
+    return urls
+
+
+def ico_png_frame(data: bytes) -> t.Optional[bytes]:
+    """Largest PNG-encoded image of ICO file, BMP-encoded ones need Pillow"""
+    best = None
+    for index in range(int.from_bytes(data[4:6], "little")):
+        entry = data[6 + index * 16:22 + index * 16]
+        if len(entry) < 16:
+            break
+        width = entry[0] or 256
+        size, offset = int.from_bytes(entry[8:12], "little"), int.from_bytes(entry[12:16], "little")
+        frame = data[offset:offset + size]
+        if frame.startswith(PNG_MAGIC) and (best is None or width > best[0]):
+            best = (width, frame)
+    return best[1] if best else None
+
+
+def to_png(data: bytes, size: int = ICON_SIZE) -> t.Optional[bytes]:
+    """Icon of any format as PNG not larger than `size`. Without Pillow only PNG (also inside ICO) is accepted as is"""
+    try:
+        from PIL import Image
+    except ImportError:
+        if data.startswith(PNG_MAGIC):
+            return data
+        if data.startswith(ICO_MAGIC):
+            return ico_png_frame(data)
+        return None
+    try:
+        with Image.open(BytesIO(data)) as image:  # ICO is opened at its largest size
+            image = image.convert("RGBA")
+            image.thumbnail((size, size), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, format="PNG")
+            return output.getvalue()
+    except Exception as e:
+        logger.debug("Got exc %s while converting icon", e)
+        return None
+
+
+def decode_data_uri(uri: str) -> t.Optional[bytes]:
+    header, _, payload = uri.partition(",")
+    try:
+        return base64.b64decode(payload) if header.endswith(";base64") else None
+    except ValueError:
+        return None
+
+
+def find_icon_links(page: str) -> list[str]:
+    """Icon hrefs declared in page, best first: PNG ones of size closest to ICON_SIZE from above"""
+    candidates = list()
+    for tag in LINK_RE.findall(page):
+        attrs = {key.lower(): html.unescape(value.strip("\"'")) for key, value in ATTR_RE.findall(tag)}
+        rel = attrs.get("rel", "").lower().split()
+        href = attrs.get("href", "").strip()
+        if not href or not ("icon" in rel or "apple-touch-icon" in rel):
+            continue
+        if "svg" in attrs.get("type", "") or href.split("?")[0].endswith(".svg") or href.startswith("data:image/svg"):
+            continue  # Can not be rendered without browser
+        is_png = "png" in attrs.get("type", "") or href.split("?")[0].endswith(".png") or href.startswith("data:image/png")
+        sizes = [int(x) for x in re.findall(r"(\d+)x\d+", attrs.get("sizes", ""))]
+        size = max(sizes) if sizes else 16
+        candidates.append(((not is_png, size < ICON_SIZE, abs(size - ICON_SIZE)), href))
+    return [href for _, href in sorted(candidates, key=lambda x: x[0])]
+
+
+class FaviconFetcher:
+    """Downloads missing favicons into custom folder, many hosts at once.
+    
+    Hosts without usable icon are remembered for `FAILURE_MAX_AGE`, afterwards their pages are requested
+    conditionally, so dead and unchanged hosts are not processed again on every run"""
+    CONCURRENCY = 16
+    HOST_TIMEOUT = 20.0
+    REQUEST_TIMEOUT = 8.0
+    MAX_ICON_BYTES = 1024 * 1024
+    FAILURE_MAX_AGE = 7 * 24 * 60 * 60
+    RUN_MAX_AGE = 30 * 60  # Run started earlier is considered dead
+    USER_AGENT = "Mozilla/5.0 (compatible; ShikiFlow favicon fetcher)"
+    
+    def __init__(self, folder: t.Optional[str] = FAVICON_FOLDER_CUSTOM, path: t.Optional[str] = FAVICON_FETCH_FILE,
+                 concurrency: int = CONCURRENCY):
+        self.folder = folder
+        self.path = path
+        self.concurrency = concurrency
+        self.state = self._load()
+    
+    def _load(self) -> dict:
+        state = {"started": None, "failures": dict()}
+        if self.path is None:
+            return state
+        try:
+            with open(self.path, mode="r", encoding="utf-8") as f:
+                return {**state, **json.load(f)}
+        except (OSError, json.JSONDecodeError):
+            return state
+    
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path + ".tmp", mode="w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logger.warning("Got exc %s while writing favicon fetch state", e)
+    
+    @property
+    def is_fetching(self) -> bool:
+        started = self.state["started"]
+        return bool(started) and time.time() - started < self.RUN_MAX_AGE
+    
+    def failed_recently(self, domain: str) -> bool:
+        failure = self.state["failures"].get(domain)
+        return failure is not None and time.time() - failure["checked"] < self.FAILURE_MAX_AGE
+    
+    def pending(self, urls: t.Iterable[str]) -> tuple[list[str], list[str]]:
+        """Hosts without favicons to be fetched and ones skipped as failed recently, one host per domain"""
+        manager = get_favicon_manager()
+        hosts, skipped, seen = list(), list(), set()
+        for url in urls:
+            host = BasicFaviconProvider.get_domain(url)
+            domain = BasicFaviconProvider.simplify_domain(host)
+            if not host or domain in seen or manager.get_fav_path(host) is not None:
+                continue
+            seen.add(domain)
+            (skipped if self.failed_recently(domain) else hosts).append(host)
+        return hosts, skipped
+    
+    async def _get_icon(self, client: "httpx.AsyncClient", url: str) -> t.Optional[bytes]:
+        if url.startswith("data:"):
+            data = decode_data_uri(url)
+        else:
+            resp = await client.get(url)
+            if resp.status_code != 200 or len(resp.content) > self.MAX_ICON_BYTES:
+                return None
+            data = resp.content
+        return to_png(data) if data else None
+    
+    async def fetch_host(self, client: "httpx.AsyncClient", host: str) -> str:
+        """Fetch and store icon of `host`, returns "ok" or reason of failure"""
+        import httpx
+        
+        domain = BasicFaviconProvider.simplify_domain(host)
+        failure = self.state["failures"].get(domain) or dict()
+        headers = dict()
+        if failure.get("etag"):
+            headers["If-None-Match"] = failure["etag"]
+        if failure.get("last_modified"):
+            headers["If-Modified-Since"] = failure["last_modified"]
+        
+        try:
+            resp = await client.get(f"https://{host}/", headers=headers)
+        except httpx.HTTPError as e:
+            return f"unreachable: {type(e).__name__}"
+        if resp.status_code == 304:
+            return "not modified"
+        validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        links = find_icon_links(resp.text) if resp.status_code == 200 else list()
+        
+        for href in links + ["/favicon.ico"]:
+            try:
+                icon = await self._get_icon(client, href if href.startswith("data:") else str(resp.url.join(href)))
+            except httpx.HTTPError as e:
+                logger.debug("Got exc %s while getting icon %s of %s", e, href, host)
+                continue
+            if icon:
+                self._write(domain, icon)
+                return "ok"
+        failure.update(validators)
+        self.state["failures"][domain] = failure
+        return "no icon"
+    
+    def _write(self, domain: str, icon: bytes):
+        os.makedirs(self.folder, exist_ok=True)
+        fav_path = os.path.join(self.folder, domain + ".png")
+        with open(fav_path + ".tmp", mode="wb") as f:
+            f.write(icon)
+        os.replace(fav_path + ".tmp", fav_path)
+    
+    async def _run_host(self, semaphore: asyncio.Semaphore, client: "httpx.AsyncClient", host: str) -> str:
+        domain = BasicFaviconProvider.simplify_domain(host)
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(self.fetch_host(client, host), self.HOST_TIMEOUT)
+            except asyncio.TimeoutError:
+                result = "timeout"
+        if result == "ok":
+            self.state["failures"].pop(domain, None)
+        else:
+            logger.info("No favicon for %s: %s", host, result)
+            failure = self.state["failures"].setdefault(domain, dict())
+            failure["checked"] = time.time()
+            if result != "not modified":  # Page is the same, so is the reason
+                failure["reason"] = result
+        return result
+    
+    async def run(self, hosts: list[str]) -> dict[str, int]:
+        """Fetch favicons of all `hosts`, `concurrency` at once. Returns count of hosts per result"""
+        import httpx
+        
+        self.state["started"] = time.time()
+        self._save()
+        try:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            async with httpx.AsyncClient(follow_redirects=True, timeout=self.REQUEST_TIMEOUT,
+                                         limits=httpx.Limits(max_connections=self.concurrency),
+                                         headers={"User-Agent": self.USER_AGENT}) as client:
+                results = await asyncio.gather(*(self._run_host(semaphore, client, x) for x in hosts))
+        finally:
+            self.state["started"] = None
+            self._save()
+        counts = dict()
+        for result in results:
+            key = result.split(":")[0]
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+if __name__ == "__main__":
+    import sys
+    from .shared import PLUGIN_SETTINGS_DIRECTORY
+    
+    logging.basicConfig(filename=os.path.join(PLUGIN_SETTINGS_DIRECTORY, "favicons.log") if PLUGIN_SETTINGS_DIRECTORY else None,
+                        level=logging.INFO)
+    fetcher = FaviconFetcher()
+    if fetcher.is_fetching:
+        logger.info("Favicons are already being fetched")
+    else:
+        hosts, skipped = fetcher.pending(external_search_urls(include_anma="--all" in sys.argv[1:]))
+        logger.info("Fetching favicons of %d hosts, %d skipped as failed recently", len(hosts), len(skipped))
+        logger.info("Favicons fetched: %s", asyncio.run(fetcher.run(hosts)))
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import typing as t
+
+
+class FileLock:
+    """Exclusive lock shared between processes, held on separate `<path>.lock` file.
+    
+    Every holder opens its own descriptor, so threads of one process may wait for it at once"""
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path + ".lock"
+        self.timeout = timeout
+    
+    @staticmethod
+    def _try_lock(fd: int) -> bool:
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+    
+    def acquire(self) -> t.Optional[int]:
+        """Descriptor holding the lock, None if it was not taken in `timeout` (callers may go on without it)"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if time.monotonic() > deadline:
+                os.close(fd)
+                return None
+            time.sleep(0.01)
+        return fd
+    
+    @staticmethod
+    def release(fd: t.Optional[int]):
+        if fd is None:
+            return
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    
+    @contextmanager
+    def held(self) -> t.Iterator[bool]:
+        """Lock held for `with` block, yields whether it was taken"""
+        fd = self.acquire()
+        try:
+            yield fd is not None
+        finally:
+            self.release(fd)
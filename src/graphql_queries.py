@@ -1,5 +1,52 @@
+import re
+import json
+import hashlib
+from dataclasses import dataclass, field
+
 import typing as t
 
+
+@dataclass(frozen=True)
+class GraphQLDocument:
+    name: str
+    text: str
+    hash: str = field(init=False)  # Stable across runs, usable as persisted query id or cache key
+    
+    def __post_init__(self):
+        object.__setattr__(self, "hash", hashlib.sha256(self.text.encode("utf-8")).hexdigest())
+
+
+class PreparedQuery(t.NamedTuple):
+    document: GraphQLDocument
+    variables: dict
+    
+    @property
+    def query(self) -> str:
+        return self.document.text
+    
+    @property
+    def cache_key(self) -> str:
+        return self.document.hash + ":" + json.dumps(self.variables, sort_keys=True, ensure_ascii=False)
+
+
+class BatchedQuery(t.NamedTuple):
+    """Several prepared queries in one document, root fields of each one are aliased"""
+    document: GraphQLDocument
+    variables: dict
+    aliases: tuple[dict[str, str], ...]  # Per operation: response key -> root field
+    
+    @property
+    def query(self) -> str:
+        return self.document.text
+    
+    @property
+    def cache_key(self) -> str:
+        return self.document.hash + ":" + json.dumps(self.variables, sort_keys=True, ensure_ascii=False)
+
+
+PROFILE_TYPE: t.TypeAlias = t.Literal['list', 'detail']
+
+
 class GraphQLQueryConstructor:
     media_main_info = "id, malId, name, russian, licenseNameRu, english,"\
             "japanese, synonyms, licensors, isCensored, url, airedOn { date }, externalLinks { kind, url },"\
@@ -7,30 +54,105 @@ class GraphQLQueryConstructor:
     anime_main_info = media_main_info + ", kind, season, episodes, episodesAired, status"
     manga_main_info = media_main_info + ", kind, status, chapters, volumes"
     
-
+    # Lean selection for result list: every name (for title and local refinement of next keystrokes),
+    # subtitle fields and poster. External links are fetched on open of censored entry and by context menu
+    media_list_info = "id, name, russian, licenseNameRu, english, japanese, synonyms, isCensored, url, "\
+            "poster { previewUrl }"
+    anime_list_info = media_list_info + ", kind, season, episodes, episodesAired, status"
+    manga_list_info = media_list_info + ", kind, status, chapters, volumes"
+    
+    OPERATIONS: dict[str, str] = {
+        "AnimeSearch": "query AnimeSearch($search: String, $limit: PositiveInt) {"
+            "animes(search: $search, limit: $limit) { %ANIME% } }",
+        "MangaSearch": "query MangaSearch($search: String, $limit: PositiveInt) {"
+            "mangas(search: $search, limit: $limit) { %MANGA% } }",
+        "BothSearch": "query BothSearch($search: String, $limit: PositiveInt) {"
+            "animes(search: $search, limit: $limit) { %ANIME% } "
+            "mangas(search: $search, limit: $limit) { %MANGA% } }",
+        "AnimeByIds": "query AnimeByIds($ids: String, $limit: PositiveInt) {"
+            "animes(ids: $ids, limit: $limit) { %ANIME% } }",
+        "MangaByIds": "query MangaByIds($ids: String, $limit: PositiveInt) {"
+            "mangas(ids: $ids, limit: $limit) { %MANGA% } }",
+        "BothByIds": "query BothByIds($ids: String, $limit: PositiveInt) {"
+            "animes(ids: $ids, limit: $limit) { %ANIME% } "
+            "mangas(ids: $ids, limit: $limit) { %MANGA% } }",
+        "AnimePage": "query AnimePage($page: PositiveInt, $limit: PositiveInt, $order: OrderEnum, $status: AnimeStatusString) {"
+            "animes(page: $page, limit: $limit, order: $order, status: $status) { %ANIME% } }",
+        "MangaPage": "query MangaPage($page: PositiveInt, $limit: PositiveInt, $order: OrderEnum, $status: MangaStatusString) {"
+            "mangas(page: $page, limit: $limit, order: $order, status: $status) { %MANGA% } }",
+    }
+    
+    # Every (operation, profile) combination is built once and reused
+    DOCUMENTS: dict[tuple[str, str], GraphQLDocument] = dict()
+    BATCH_DOCUMENTS: dict[tuple[str, ...], tuple[GraphQLDocument, tuple[dict[str, str], ...]]] = dict()
+    
+    @classmethod
+    def selection(cls, media_type: t.Literal['Anime', 'Manga'], profile: PROFILE_TYPE = "detail") -> str:
+        if profile == "detail":
+            return cls.anime_main_info if media_type == "Anime" else cls.manga_main_info
+        return cls.anime_list_info if media_type == "Anime" else cls.manga_list_info
+    
+    @classmethod
+    def get_document(cls, name: str, profile: PROFILE_TYPE = "detail") -> GraphQLDocument:
+        key = (name, profile)
+        if key not in cls.DOCUMENTS:
+            text = cls.OPERATIONS[name].replace("%ANIME%", cls.selection("Anime", profile))\
+                .replace("%MANGA%", cls.selection("Manga", profile))
+            cls.DOCUMENTS[key] = GraphQLDocument(name, text)
+        return cls.DOCUMENTS[key]
+    
+    @classmethod
+    def prepare(cls, name: str, profile: PROFILE_TYPE = "detail", **variables) -> PreparedQuery:
+        return PreparedQuery(cls.get_document(name, profile),
+                             {k: v for k, v in variables.items() if v is not None})
+    
+    @staticmethod
+    def _batch_part(index: int, text: str) -> tuple[t.Optional[str], str, dict[str, str]]:
+        """Variable definitions and root fields of operation, with variables suffixed and fields aliased by `index`"""
+        header, body = text.split("{", 1)
+        rename = lambda part: re.sub(r"\$(\w+)", rf"$\1_{index}", part)
+        definitions = re.search(r"\((.*)\)", header)
+        aliases = dict()
+        
+        def alias(matched: re.Match) -> str:
+            aliases[f"o{index}_{matched.group(1)}"] = matched.group(1)
+            return f"o{index}_{matched.group(1)}: {matched.group(1)}("
+        
+        fields = re.sub(r"\b(animes|mangas)\s*\(", alias, rename(body.rsplit("}", 1)[0]))
+        return rename(definitions.group(1)) if definitions else None, fields.strip(), aliases
+    
+    @classmethod
+    def batch(cls, queries: t.Sequence[PreparedQuery]) -> BatchedQuery:
+        """Combine independent queries into one document: one round trip, one request of rate limit.
+        Response is split back with GraphQLDataParser.parse_batch"""
+        key = tuple(x.document.hash for x in queries)
+        if key not in cls.BATCH_DOCUMENTS:
+            definitions, fields, aliases = list(), list(), list()
+            for index, query in enumerate(queries):
+                part_definitions, part_fields, part_aliases = cls._batch_part(index, query.query)
+                if part_definitions:
+                    definitions.append(part_definitions)
+                fields.append(part_fields)
+                aliases.append(part_aliases)
+            text = "query Batch" + (f"({', '.join(definitions)})" if definitions else "") + " { " + " ".join(fields) + " }"
+            cls.BATCH_DOCUMENTS[key] = (GraphQLDocument("Batch", text), tuple(aliases))
+        document, aliases = cls.BATCH_DOCUMENTS[key]
+        variables = {f"{name}_{index}": value for index, query in enumerate(queries) for name, value in query.variables.items()}
+        return BatchedQuery(document, variables, aliases)
+    
     @classmethod
-    def anime_get_main_search(cls, search: str, limit: int) -> str:
-        query = "query( $search: String = \"%SEARCH%\", $limit: PositiveInt = %LIMIT% )  {"\
-            "animes( search: $search, limit: $limit ) { " + cls.anime_main_info + "} }"
-        query = query.replace("%SEARCH%", search).replace("%LIMIT%", str(limit))  # XXX: Custom formatter
-        return query
+    def anime_get_main_search(cls, search: str, limit: int, profile: PROFILE_TYPE = "detail") -> PreparedQuery:
+        return cls.prepare("AnimeSearch", profile, search=search, limit=limit)
     
     @classmethod
-    def manga_get_main_search(cls, search: str, limit: int) -> str:
-        query = "query( $search: String = \"%SEARCH%\", $limit: PositiveInt = %LIMIT% )  {"\
-            "mangas( search: $search, limit: $limit ) { " + cls.manga_main_info + "} }"
-        query = query.replace("%SEARCH%", search).replace("%LIMIT%", str(limit))  # XXX: Custom formatter
-        return query
+    def manga_get_main_search(cls, search: str, limit: int, profile: PROFILE_TYPE = "detail") -> PreparedQuery:
+        return cls.prepare("MangaSearch", profile, search=search, limit=limit)
     
     @classmethod
-    def both_get_main_search(cls, search: str, limit: int) -> str:
+    def both_get_main_search(cls, search: str, limit: int, profile: PROFILE_TYPE = "detail") -> PreparedQuery:
         if limit % 2:
             limit += 1
-        query = "query( $search: String = \"%SEARCH%\", $limit: PositiveInt = %LIMIT% )  {"\
-                "animes( search: $search, limit: $limit ) { " + cls.anime_main_info + "} "\
-                "mangas( search: $search, limit: $limit ) { " + cls.manga_main_info + "} }"
-        query = query.replace("%SEARCH%", search).replace("%LIMIT%", str(limit // 2))
-        return query
+        return cls.prepare("BothSearch", profile, search=search, limit=limit // 2)
     
     @staticmethod
     def _get_string_ids(ids: t.Iterable[int]) -> str:
@@ -38,23 +160,21 @@ class GraphQLQueryConstructor:
         return ids_string
     
     @classmethod
-    def anime_get_main_by_ids(cls, ids: t.Iterable[int]) -> str:
-        query = "query( $ids: String = \"%IDS%\", $limit: PositiveInt = %LIMIT% ) {"\
-            "animes ( ids: $ids, limit: $limit ) {" + cls.anime_main_info + "} }"
-        query = query.replace("%IDS%", cls._get_string_ids(ids)).replace("%LIMIT%", str(len(ids)+1))
-        return query
+    def anime_get_main_by_ids(cls, ids: t.Iterable[int], profile: PROFILE_TYPE = "detail") -> PreparedQuery:
+        return cls.prepare("AnimeByIds", profile, ids=cls._get_string_ids(ids), limit=len(ids))
+    
+    @classmethod
+    def manga_get_main_by_ids(cls, ids: t.Iterable[int], profile: PROFILE_TYPE = "detail") -> PreparedQuery:
+        return cls.prepare("MangaByIds", profile, ids=cls._get_string_ids(ids), limit=len(ids))
+    
+    @classmethod
+    def both_get_main_by_ids(cls, ids: t.Iterable[int], profile: PROFILE_TYPE = "detail") -> PreparedQuery:
+        return cls.prepare("BothByIds", profile, ids=cls._get_string_ids(ids), limit=len(ids))
     
     @classmethod
-    def manga_get_main_by_ids(cls, ids: t.Iterable[int]) -> str:
-        query = "query( $ids: String = \"%IDS%\", $limit: PositiveInt = %LIMIT% ) {"\
-            "mangas ( ids: $ids, limit: $limit ) {" + cls.manga_main_info + "} }"
-        query = query.replace("%IDS%", cls._get_string_ids(ids)).replace("%LIMIT%", str(len(ids)+1))
-        return query
+    def anime_get_main_page(cls, page: int, limit: int, order: str = "id", status: t.Optional[str] = None) -> PreparedQuery:
+        return cls.prepare("AnimePage", page=page, limit=limit, order=order, status=status)
     
     @classmethod
-    def both_get_main_by_ids(cls, ids: t.Iterable[int]) -> str:
-        query = "query( $ids: String = \"%IDS%\", $limit: PositiveInt = %LIMIT% ) {"\
-                "animes ( ids: $ids, limit: $limit ) {" + cls.anime_main_info + "} "\
-                "mangas ( ids: $ids, limit: $limit ) {" + cls.manga_main_info + "} }"
-        query = query.replace("%IDS%", cls._get_string_ids(ids)).replace("%LIMIT%", str(len(ids)+1))
-        return query
+    def manga_get_main_page(cls, page: int, limit: int, order: str = "id", status: t.Optional[str] = None) -> PreparedQuery:
+        return cls.prepare("MangaPage", page=page, limit=limit, order=order, status=status)
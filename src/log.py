@@ -0,0 +1,151 @@
+# Logging off the query hot path: records go through in-memory queue to background writer thread,
+# file writes and rotation are serialized between plugin processes with file lock
+
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import date
+from logging.handlers import QueueHandler, QueueListener
+
+from .file_lock import FileLock
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s - %(process)d - %(levelname)s - %(name)s - %(message)s"
+
+# Payload dumps are opt-in per stage: SHK_DEBUG_PAYLOADS=graphql,search (or "all")
+PAYLOAD_LOGGERS = {
+    "graphql": "src.shiki.graphql.payload",  # Raw GraphQL responses in GraphQLShikiClient.get_data
+    "search": "src.search.payload",  # Raw responses of plugin's search client
+    "context": "src.plugin.payload",  # Context data of context menu calls
+}
+PAYLOAD_MAX_CHARS = 4000
+
+
+class ProcessSafeRotatingFileHandler(logging.Handler):
+    """Daily rotating file handler safe for many processes writing one file.
+    
+    Every write reopens file under FileLock, so rotation made by one process is seen by others
+    (TimedRotatingFileHandler keeps its own handle and rotation time, and processes rename file under each other)"""
+    def __init__(self, filename: str, backup_count: int = 1, encoding: str = "utf-8"):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.backup_count = backup_count
+        self.encoding = encoding
+        self.lock_file = FileLock(self.filename)
+    
+    def should_rotate(self) -> bool:
+        try:
+            return date.fromtimestamp(os.path.getmtime(self.filename)) < date.today()
+        except OSError:
+            return False
+    
+    def rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source, target = f"{self.filename}.{index}", f"{self.filename}.{index + 1}"
+            if os.path.exists(source):
+                os.replace(source, target)
+        if self.backup_count > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.remove(self.filename)
+    
+    def emit(self, record: logging.LogRecord):
+        self.write_batch([record])
+    
+    def write_batch(self, records: list[logging.LogRecord]):
+        try:
+            text = "".join(self.format(x) + "\n" for x in records)
+            with self.lock_file.held():
+                if self.should_rotate():
+                    self.rotate()
+                with open(self.filename, mode="a", encoding=self.encoding) as f:
+                    f.write(text)
+        except Exception:
+            for record in records:
+                self.handleError(record)
+
+
+class BatchingQueueListener(QueueListener):
+    """Drains everything queued so far into one locked write instead of lock + open per record"""
+    def _monitor(self):
+        while True:
+            record = self.dequeue(True)
+            if record is self._sentinel:
+                break
+            batch, stop = [record], False
+            while True:
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stop = True
+                    break
+                batch.append(record)
+            for handler in self.handlers:
+                batch_level = [x for x in batch if x.levelno >= handler.level]
+                if isinstance(handler, ProcessSafeRotatingFileHandler):
+                    handler.write_batch(batch_level)
+                else:
+                    for x in batch_level:
+                        handler.handle(x)
+            if stop:
+                break
+
+
+class LazyJson:
+    """Postpones json.dumps of payload until record is actually formatted, truncated to `max_chars`"""
+    __slots__ = ("payload", "max_chars")
+    
+    def __init__(self, payload: t.Any, max_chars: int = PAYLOAD_MAX_CHARS):
+        self.payload = payload
+        self.max_chars = max_chars
+    
+    def __str__(self):
+        text = json.dumps(self.payload, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return text[:self.max_chars] + f"... ({len(text)} chars)"
+        return text
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def setup_payload_loggers(stages: t.Iterable[str], sample_rate: float = 1.0):
+    """Payload loggers are off unless their stage is opted in, so dumps cost one level check"""
+    stages = set(stages)
+    for stage, name in PAYLOAD_LOGGERS.items():
+        payload_logger = logging.getLogger(name)
+        enabled = "all" in stages or stage in stages
+        payload_logger.setLevel(logging.DEBUG if enabled else logging.WARNING)
+        payload_logger.filters = [SampleFilter(sample_rate)] if enabled and sample_rate < 1 else list()
+
+
+def setup_logging(filename: str, level: int = logging.INFO, backup_count: int = 1) -> QueueListener:
+    """Route all records through queue to background writer thread, flushed at exit"""
+    file_handler = ProcessSafeRotatingFileHandler(filename, backup_count=backup_count)
+    file_handler.setFormatter(logging.Formatter(fmt=LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = BatchingQueueListener(log_queue, file_handler, respect_handler_level=True)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))  # Only merges args, layout is done by file handler
+    logging.basicConfig(handlers=[queue_handler], level=level, force=True)
+    
+    stages = [x.strip() for x in os.environ.get("SHK_DEBUG_PAYLOADS", "").split(",") if x.strip()]
+    setup_payload_loggers(stages, float(os.environ.get("SHK_DEBUG_SAMPLE", "1")))
+    
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
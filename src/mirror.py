@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+from difflib import SequenceMatcher
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .graphql_queries import GraphQLQueryConstructor, PreparedQuery
+
+import typing as t
+
+if t.TYPE_CHECKING:
+    from .shiki.graphql import GraphQLShikiClient
+
+logger = logging.getLogger(__name__)
+
+MIRROR_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "mirror.sqlite3") if PLUGIN_CACHE_FOLDER else None
+
+MEDIA_TYPE: t.TypeAlias = t.Literal['Anime', 'Manga']
+
+
+class CatalogMirror:
+    """Local copy of Shikimori catalog, searchable by every title of entry"""
+    PAGE_LIMIT = 50  # Max limit allowed by Shikimori GraphQL
+    PAGE_DELAY = 0.4  # Stay under ~5 rps
+    REFRESH_STATUSES = {"Anime": ("ongoing", "anons"), "Manga": ("ongoing", "anons", "paused")}  # Stored entries still changing
+    STALE_REFRESH = 10 * 60  # Refresh without progress for that long is dead (every page takes seconds at most)
+    TYPO_MIN_RATIO = 0.6
+    
+    def __init__(self, path: t.Optional[str] = MIRROR_FILE):
+        self.path = path if path else ":memory:"
+        if path and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._init_db()
+    
+    def _init_db(self):
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "  rowid INTEGER PRIMARY KEY, type TEXT NOT NULL, id INTEGER NOT NULL, payload TEXT NOT NULL,"
+            "  UNIQUE (type, id));"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(names, tokenize = 'unicode61 remove_diacritics 2');"
+        )
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS titles_trigram USING fts5(names, tokenize = 'trigram')")
+            self.has_trigram = True
+        except sqlite3.OperationalError:  # SQLite < 3.34
+            logger.warning("FTS5 trigram tokenizer is not available, typo tolerance is disabled")
+            self.has_trigram = False
+        self._conn.commit()
+    
+    # Meta
+    
+    def get_meta(self, key: str) -> t.Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key, )).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: t.Any):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+    
+    @property
+    def last_refresh(self) -> t.Optional[float]:
+        value = self.get_meta("last_refresh")
+        return float(value) if value else None
+    
+    @property
+    def is_refreshing(self) -> bool:
+        """Refresh is started and still makes progress: full download takes tens of minutes, so every page is noted"""
+        started = self.get_meta("refresh_started")
+        if not started:
+            return False
+        progress = max(float(started), float(self.get_meta("refresh_progress") or 0))
+        return time.time() - progress < self.STALE_REFRESH
+    
+    def count(self, media_type: t.Optional[MEDIA_TYPE] = None) -> int:
+        if media_type is None:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM entries WHERE type = ?", (media_type, )).fetchone()[0]
+    
+    def __bool__(self):
+        return self._conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is not None
+    
+    def max_id(self, media_type: MEDIA_TYPE) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM entries WHERE type = ?", (media_type, )).fetchone()[0]
+    
+    def changing_ids(self, media_type: MEDIA_TYPE) -> list[int]:
+        """Ids of stored entries that were ongoing (or announced) when fetched"""
+        statuses = self.REFRESH_STATUSES[media_type]
+        return [x[0] for x in self._conn.execute(
+            "SELECT id FROM entries WHERE type = ? "
+            f"AND json_extract(payload, '$.status') IN ({','.join('?' * len(statuses))}) ORDER BY id",
+            (media_type, *statuses))]
+    
+    # Storing
+    
+    @staticmethod
+    def _entry_from_payload(media_type: MEDIA_TYPE, payload: dict):
+        from .shiki.graphql import decode_node  # Keeps httpx out of status-only imports (s:mirror menu)
+        
+        return decode_node(media_type, payload)
+    
+    def upsert(self, media_type: MEDIA_TYPE, nodes: t.Iterable[dict]):
+        for node in nodes:
+            self._conn.execute(
+                "INSERT INTO entries (type, id, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT (type, id) DO UPDATE SET payload = excluded.payload",
+                (media_type, int(node["id"]), json.dumps(node, ensure_ascii=False)))
+            rowid = self._conn.execute("SELECT rowid FROM entries WHERE type = ? AND id = ?",
+                                       (media_type, int(node["id"]))).fetchone()[0]
+            names = "\n".join(self._entry_from_payload(media_type, node).get_names_tuple())
+            self._conn.execute("DELETE FROM titles WHERE rowid = ?", (rowid, ))
+            self._conn.execute("INSERT INTO titles (rowid, names) VALUES (?, ?)", (rowid, names))
+            if self.has_trigram:
+                self._conn.execute("DELETE FROM titles_trigram WHERE rowid = ?", (rowid, ))
+                self._conn.execute("INSERT INTO titles_trigram (rowid, names) VALUES (?, ?)", (rowid, names.lower()))
+        self._conn.commit()
+    
+    # Downloading
+    
+    def _fetch(self, client: "GraphQLShikiClient", media_type: MEDIA_TYPE, query: PreparedQuery) -> list[dict]:
+        data = client.get_raw_data(query)
+        time.sleep(self.PAGE_DELAY)
+        field = media_type.lower() + "s"
+        nodes = (data.get("data") or dict()).get(field)
+        if data.get("errors") or not isinstance(nodes, list):
+            # Partial page would end paging early or leave holes, so whole update stops and is retried next time
+            from .shiki.graphql import GraphQLError
+            raise GraphQLError(data.get("errors") or [{"message": f"No {field} in response"}], data.get("data"))
+        self.set_meta("refresh_progress", time.time())  # Committed with upsert of these nodes
+        return nodes
+    
+    def _get_page(self, client: "GraphQLShikiClient", media_type: MEDIA_TYPE, page: int, order: str) -> list[dict]:
+        if media_type == "Anime":
+            query = GraphQLQueryConstructor.anime_get_main_page(page, self.PAGE_LIMIT, order=order)
+        else:
+            query = GraphQLQueryConstructor.manga_get_main_page(page, self.PAGE_LIMIT, order=order)
+        return self._fetch(client, media_type, query)
+    
+    def _get_by_ids(self, client: "GraphQLShikiClient", media_type: MEDIA_TYPE, ids: list[int]) -> list[dict]:
+        if media_type == "Anime":
+            query = GraphQLQueryConstructor.anime_get_main_by_ids(ids)
+        else:
+            query = GraphQLQueryConstructor.manga_get_main_by_ids(ids)
+        return self._fetch(client, media_type, query)
+    
+    def download(self, client: "GraphQLShikiClient", media_type: MEDIA_TYPE):
+        """Download whole catalog of `media_type`"""
+        page = 1
+        while True:
+            nodes = self._get_page(client, media_type, page, order="id")
+            self.upsert(media_type, nodes)
+            logger.info(f"Mirror: {media_type} page {page}, {len(nodes)} entries")
+            if len(nodes) < self.PAGE_LIMIT:
+                return
+            page += 1
+    
+    def refresh(self, client: "GraphQLShikiClient", media_type: MEDIA_TYPE):
+        """Fetch entries added since last refresh and re-fetch stored entries that were still changing.
+        
+        Those are picked by stored status, as filter by current one would miss entries released since"""
+        known_max_id = self.max_id(media_type)
+        page = 1
+        while True:
+            nodes = self._get_page(client, media_type, page, order="id_desc")
+            new_nodes = [x for x in nodes if int(x["id"]) > known_max_id]
+            self.upsert(media_type, new_nodes)
+            if len(new_nodes) < len(nodes) or len(nodes) < self.PAGE_LIMIT:
+                break
+            page += 1
+        ids = self.changing_ids(media_type)
+        for start in range(0, len(ids), self.PAGE_LIMIT):
+            self.upsert(media_type, self._get_by_ids(client, media_type, ids[start:start + self.PAGE_LIMIT]))
+    
+    def update(self, client: "GraphQLShikiClient"):
+        """Full download for empty mirror, incremental refresh otherwise"""
+        self.set_meta("refresh_started", time.time())
+        self._conn.commit()
+        try:
+            for media_type in ("Anime", "Manga"):
+                if self.max_id(media_type):
+                    self.refresh(client, media_type)
+                else:
+                    self.download(client, media_type)
+            self.set_meta("last_refresh", time.time())
+        finally:
+            self.set_meta("refresh_started", "")
+            self.set_meta("refresh_progress", "")
+            self._conn.commit()
+    
+    # Searching
+    
+    @staticmethod
+    def _tokenize(query: str) -> list[str]:
+        return re.findall(r"\w+", query.lower())
+    
+    def _types_filter(self, media_type: t.Literal['Anime', 'Manga', 'Both']) -> tuple[str]:
+        return ("Anime", "Manga") if media_type == "Both" else (media_type, )
+    
+    def _search_prefix(self, tokens: list[str], types: tuple[str], limit: int) -> list[tuple]:
+        fts_query = " ".join('"{0}"*'.format(x.replace('"', '""')) for x in tokens)
+        return self._conn.execute(
+            "SELECT entries.rowid, entries.type, entries.payload FROM titles "
+            "JOIN entries ON entries.rowid = titles.rowid "
+            f"WHERE titles MATCH ? AND entries.type IN ({','.join('?' * len(types))}) "
+            "ORDER BY titles.rank LIMIT ?",
+            (fts_query, *types, limit)).fetchall()
+    
+    def _search_typo(self, query: str, types: tuple[str], limit: int, exclude: set[int]) -> list[tuple]:
+        query = " ".join(self._tokenize(query))
+        trigrams = {query[i:i+3] for i in range(len(query) - 2)}
+        trigrams = [x for x in trigrams if " " not in x]
+        if not trigrams:
+            return list()
+        fts_query = " OR ".join('"{0}"'.format(x.replace('"', '""')) for x in trigrams)
+        rows = self._conn.execute(
+            "SELECT entries.rowid, entries.type, entries.payload, titles_trigram.names FROM titles_trigram "
+            "JOIN entries ON entries.rowid = titles_trigram.rowid "
+            f"WHERE titles_trigram MATCH ? AND entries.type IN ({','.join('?' * len(types))}) "
+            "ORDER BY titles_trigram.rank LIMIT ?",
+            (fts_query, *types, limit * 10)).fetchall()
+        scored = list()
+        for rowid, type_, payload, names in rows:
+            if rowid in exclude:
+                continue
+            # Compare with beginning of every title, so partial input still scores high
+            ratio = max(SequenceMatcher(None, query, name[:len(query)]).ratio() for name in names.split("\n"))
+            if ratio >= self.TYPO_MIN_RATIO:
+                scored.append((ratio, (rowid, type_, payload)))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [x[1] for x in scored[:limit]]
+    
+    def search(self, query: str, limit: int, media_type: t.Literal['Anime', 'Manga', 'Both']) -> dict:
+        """Prefix search, topped up with typo-tolerant matches. Returns data in shape of GraphQLShikiClient.parse_data"""
+        types = self._types_filter(media_type)
+        tokens = self._tokenize(query)
+        rows = self._search_prefix(tokens, types, limit) if tokens else list()
+        if len(rows) < limit and self.has_trigram and len(query) >= 3:
+            rows += self._search_typo(query, types, limit - len(rows), exclude={x[0] for x in rows})
+        data = {"animes": list(), "mangas": list()}
+        for _, type_, payload in rows:
+            data[type_.lower() + "s"].append(self._entry_from_payload(type_, json.loads(payload)))
+        return data
+    
+    def close(self):
+        self._conn.close()
+
+mirror = CatalogMirror()
+
+
+if __name__ == "__main__":
+    from .shared import PLUGIN_SETTINGS_DIRECTORY
+    
+    logging.basicConfig(filename=os.path.join(PLUGIN_SETTINGS_DIRECTORY, "mirror.log") if PLUGIN_SETTINGS_DIRECTORY else None,
+                        level=logging.INFO)
+    if mirror.is_refreshing:
+        logger.info("Mirror is already refreshing")
+    else:
+        import httpx
+        from .shiki.graphql import GraphQLShikiClient
+        from .rate_limit import SharedRateLimiter
+        
+        # Background job, so it rather waits in queue than gets dropped
+        with GraphQLShikiClient("ShikiFlow", rate_limiter=SharedRateLimiter(max_wait=60)) as client:
+            try:
+                mirror.update(client)
+            except httpx.HTTPError as e:
+                logger.error(f"Mirror update failed, it is retried on next s:mirror: {e}")
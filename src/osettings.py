@@ -37,9 +37,11 @@ class OSettings:
     
     def __init__(self, data: t.Optional[dict] = None):
         self._data = data if data else dict()
+        self._ext_search_keys: t.Optional[set[tuple]] = None
         self.initialize()
     
     def load(self):
+        self._ext_search_keys = None
         try:
             with open(OSETTINGS_FILE, mode="r", encoding="utf-8") as f:
                 self._data = json.load(f)
@@ -82,17 +84,33 @@ class OSettings:
     def external_search(self):
         return list(map(lambda x: ExtSearch(**x), self._data["external_search"]))
     
+    @staticmethod
+    def ext_search_key(data: dict) -> tuple:
+        url = data["url"]
+        return data["name"], data["media_type"], tuple(sorted(url.items())) if isinstance(url, dict) else url
+    
     def check_if_ext_search(self, ext: ExtSearch):
-        return ext.to_dict() in self._data["external_search"]
+        if self._ext_search_keys is None:
+            self._ext_search_keys = set(map(self.ext_search_key, self._data["external_search"]))
+        return self.ext_search_key(ext.to_dict()) in self._ext_search_keys
     
     def add_external_search(self, ext: ExtSearch):
         ext_data = ext.to_dict()
         if ext_data not in self._data["external_search"]:
             self._data["external_search"].append(ext.to_dict())
+            self._ext_search_keys = None
     
     def del_external_search(self, ext: ExtSearch):
         index = self._data["external_search"].index(ext.to_dict())
         if index > 0:
             del self._data["external_search"][index]
+            self._ext_search_keys = None
+    
+    @property
+    def stats_enabled(self) -> bool:
+        return self._data.get("stats_enabled", False)
+    
+    def set_stats_enabled(self, enabled: bool):
+        self._data["stats_enabled"] = enabled
 
 osettings = OSettings()
@@ -1,17 +1,15 @@
 import os
-from itertools import chain
+from datetime import datetime
 import logging
 
-from httpx import URL
-
 from pyflowlauncher import ResultResponse, Result, send_results, api
-from pyflowlauncher.string_matcher import string_matcher, MatchData
 from pyflowlauncher.icons import FOLDER, BROWSER
 
 from .anma_data import get_anma_data
 from .osettings import osettings, ExtSearch
-from .shared import FS_ICO_PATH, PLUGIN_ID, PLUGIN_SETTINGS_DIRECTORY, FAVICON_FOLDER_ROOT, FAVICON_FOLDER_CUSTOM
-from .favicon import FaviconManager
+from .shared import FS_ICO_PATH, PLUGIN_ID, PLUGIN_SETTINGS_DIRECTORY, url_host
+from .favicon import get_favicon_manager, external_search_urls, FaviconFetcher
+from .picker_index import FuzzyIndex
 from .shiki.types import MediaEntry
 
 import typing as t
@@ -19,33 +17,34 @@ import typing as t
 logger = logging.getLogger(__name__)
 
 
-class FalseMatchData:
-    matched = True
-    score = 0
+EXT_LINKS_INDEX = FuzzyIndex(MediaEntry.EXT_LINKS_NAMES.items(), name=lambda x: x[1])
+_anma_index: t.Optional[tuple[list[dict], FuzzyIndex[tuple[ExtSearch, str]]]] = None
+
+
+def get_anma_index() -> FuzzyIndex[tuple[ExtSearch, str]]:
+    """Index of AnMa searches with their favicon urls, built once per AnMa data version"""
+    global _anma_index
+    data = get_anma_data()
+    if _anma_index is None or _anma_index[0] is not data:
+        searches = map(ExtSearch.from_dict, data)
+        _anma_index = (data, FuzzyIndex(((x, x.search("null", 'Anime')) for x in searches), name=lambda x: x[0].name))
+    return _anma_index[1]
 
 
 class OSettingsMenu:
-    fav_man = FaviconManager([FAVICON_FOLDER_CUSTOM, FAVICON_FOLDER_ROOT])
-    
     def __init__(self, lang: t.Literal['ru', 'en'] = 'ru'):
         self.lang = lang
     
     @classmethod
     def external_links(cls, query: str):
         results = list()
-        chosen_list = osettings.external_links
+        chosen_list = set(osettings.external_links)
         
-        for ext_id, ext_name in MediaEntry.EXT_LINKS_NAMES.items():
-            if query:
-                match = string_matcher(query, ext_name)
-            else:
-                match = FalseMatchData
-            if not match.matched:
-                continue
+        for (ext_id, ext_name), score in EXT_LINKS_INDEX.search(query):
             results.append(
                 Result(Title=f"{ext_name} {'[CHOSEN]' if ext_id in chosen_list else ''}",
-                       Score=match.score,
-                       IcoPath=cls.fav_man.get_fav_path(MediaEntry.EXT_LINKS_HOMEPAGE[ext_id]) or FS_ICO_PATH,
+                       Score=score,
+                       IcoPath=get_favicon_manager().get_fav_path(MediaEntry.EXT_LINKS_HOMEPAGE[ext_id]) or FS_ICO_PATH,
                        ContextData={"type_": "OSettings", "ext_link": ext_id})
             )
         
@@ -69,7 +68,7 @@ class OSettingsMenu:
             res.append(Result(
                 Title=f"{exts.name} ({exts.media_type})",
                 SubTitle=exts.url if isinstance(exts.url, str) else f"{exts.url['Anime']}\n{exts.url['Manga']}",
-                IcoPath=cls.fav_man.get_fav_path(exts.search("null", 'Anime')) or FS_ICO_PATH,
+                IcoPath=get_favicon_manager().get_fav_path(exts.search("null", 'Anime')) or FS_ICO_PATH,
                 ContextData={"type_":"OSettings", "exts_delete": exts.to_dict()}
             ))
         return send_results(results=res)
@@ -87,20 +86,14 @@ class OSettingsMenu:
     @classmethod
     def external_search_export(cls, query: str):
         res = list()
-        data = tuple(map(ExtSearch.from_dict, get_anma_data()))
-        for exts in data:
-            if query:
-                match = string_matcher(query, exts.name)
-            else:
-                match = FalseMatchData
-            if not match.matched:
-                continue
+        for (exts, icon_url), score in get_anma_index().search(query):
             if osettings.check_if_ext_search(exts):
                 continue
             res.append(Result(
                 Title=f"{exts.name} ({exts.media_type})",
                 SubTitle=exts.url if isinstance(exts.url, str) else f"{exts.url['Anime']}\n{exts.url['Manga']}",
-                IcoPath=cls.fav_man.get_fav_path(exts.search("null", 'Anime')) or FS_ICO_PATH,
+                IcoPath=get_favicon_manager().get_fav_path(icon_url) or FS_ICO_PATH,
+                Score=score,
                 ContextData={"type_": "OSettings", "exts_add": exts.to_dict()}
             ))
         return send_results(results=res)
@@ -137,21 +130,15 @@ class OSettingsMenu:
     def external_favicons_check(self, query: str):
         is_all_selected = False
         if query.startswith("a:"):
-            query = query[2:]
+            query = query[2:].strip()
             is_all_selected = True
-        missing = list()
-        
-        for exts in chain(osettings.external_search, (map(ExtSearch.from_dict, get_anma_data()) if is_all_selected else list())): #type: ExtSearch
-            if isinstance(exts.url, dict):
-                if self.fav_man.get_fav_path(exts.url['Anime']) is None:
-                    missing.append(URL(exts.url['Anime']).host)
-                if self.fav_man.get_fav_path(exts.url['Manga']) is None:
-                    missing.append(URL(exts.url['Manga']).host)
-            else:
-                if self.fav_man.get_fav_path(exts.url) is None:
-                    missing.append(URL(exts.url).host)
+        urls = external_search_urls(include_anma=is_all_selected)
+        if query.startswith("fetch"):
+            return send_results(results=[self.external_favicons_fetch(urls, is_all_selected)])
+        get_favicon_manager().invalidate()  # User is checking favicons just added, do not wait for mtime check
+        missing = [url_host(x) for x in urls if get_favicon_manager().get_fav_path(x) is None]
         
-        return send_results(results=[
+        return send_results(results=[self.external_favicons_fetch(urls, is_all_selected)] + [
             Result(
                 Title=x,
                 IcoPath=FS_ICO_PATH,
@@ -160,6 +147,26 @@ class OSettingsMenu:
             )
         for x in missing] if missing else [Result(Title="Всё на месте :>" if self.lang == 'ru' else "Seems alright :>", IcoPath=FS_ICO_PATH)])
     
+    def external_favicons_fetch(self, urls: list[str], is_all_selected: bool) -> Result:
+        fetcher = FaviconFetcher()
+        if fetcher.is_fetching:
+            return Result(
+                Title="Иконки скачиваются..." if self.lang == 'ru' else "Downloading favicons...",
+                SubTitle="В фоне, проверьте позже" if self.lang == 'ru' else "In background, check later",
+                IcoPath=FS_ICO_PATH,
+                Score=100
+            )
+        hosts, skipped = fetcher.pending(urls)
+        return Result(
+            Title=(f"Скачать недостающие иконки: {len(hosts)}" if self.lang == 'ru' else f"Download missing favicons: {len(hosts)}")
+                if hosts else ("Нечего скачивать" if self.lang == 'ru' else "Nothing to download"),
+            SubTitle=(f"Пропущено недавно неудачных: {len(skipped)}" if self.lang == 'ru' else f"Skipped as failed recently: {len(skipped)}")
+                if skipped else ("В фоне, с самих сайтов" if self.lang == 'ru' else "In background, from sites themselves") if hosts else None,
+            IcoPath=FS_ICO_PATH,
+            Score=100,
+            JsonRPCAction=dict(method="favicons_fetch", parameters=[is_all_selected]) if hosts else None
+        )
+    
     def external_favicons_context(self, context_data: dict):
         sub_title_string = lambda x: ("Открыть" if self.lang == 'ru' else "Open") + f" {x}"
         return send_results(results=[
@@ -177,6 +184,76 @@ class OSettingsMenu:
             ),
         ])
     
+    def mirror_menu(self):
+        from .mirror import mirror
+        
+        if mirror:
+            status = f"{mirror.count('Anime')} " + ("аниме" if self.lang == 'ru' else "anime") + \
+                f", {mirror.count('Manga')} " + ("манги" if self.lang == 'ru' else "manga")
+            updated = datetime.fromtimestamp(mirror.last_refresh).strftime("%Y-%m-%d %H:%M") if mirror.last_refresh else "N/A"
+            sub_title = ("Обновлено: " if self.lang == 'ru' else "Updated: ") + updated
+        else:
+            status = "Офлайн-копия не скачана" if self.lang == 'ru' else "Offline mirror is not downloaded"
+            sub_title = "Поиск с тегом o:" if self.lang == 'ru' else "Search it with o: tag"
+        if mirror.is_refreshing:
+            action_title = "Обновляется..." if self.lang == 'ru' else "Refreshing..."
+            action = None
+        else:
+            if mirror:
+                action_title = "Обновить офлайн-копию" if self.lang == 'ru' else "Refresh offline mirror"
+            else:
+                action_title = "Скачать офлайн-копию" if self.lang == 'ru' else "Download offline mirror"
+            action = dict(method="mirror_refresh", parameters=[])
+        return send_results(results=[
+            Result(Title=status, SubTitle=sub_title, IcoPath=FS_ICO_PATH),
+            Result(
+                Title=action_title,
+                SubTitle="В фоне, первая загрузка займёт десятки минут" if self.lang == 'ru' else "In background, first download takes tens of minutes",
+                IcoPath=FS_ICO_PATH,
+                JsonRPCAction=action
+            )
+        ])
+    
+    def stats_menu(self):
+        from .stats import stats
+        
+        results = [Result(
+            Title=("Статистика запросов включена" if self.lang == 'ru' else "Query stats are enabled") if stats.enabled
+                else ("Статистика запросов выключена" if self.lang == 'ru' else "Query stats are disabled"),
+            SubTitle="Нажмите, чтобы переключить" if self.lang == 'ru' else "Press to toggle",
+            IcoPath=FS_ICO_PATH,
+            Score=100,
+            JsonRPCAction=dict(method="stats_toggle", parameters=[])
+        )]
+        summary = stats.summary()
+        if not summary["count"]:
+            return send_results(results=results)
+        for index, (stage, (p50, p95, count)) in enumerate(summary["stages"].items()):
+            results.append(Result(
+                Title=f"{stage}: p50 {p50:.1f} ms, p95 {p95:.1f} ms",
+                SubTitle=f"{count} " + ("замеров" if self.lang == 'ru' else "samples"),
+                IcoPath=FS_ICO_PATH,
+                Score=90 - index
+            ))
+        cache_ratio = f"{summary['cache_hit_ratio']:.0%}" if summary["cache_hit_ratio"] is not None else "N/A"
+        mean_kb = f"{summary['mean_bytes'] / 1024:.1f} KB" if summary["mean_bytes"] is not None else "N/A"
+        superseded_ratio = f"{summary['superseded_ratio']:.0%}" if summary["superseded_ratio"] is not None else "N/A"
+        results.append(Result(
+            Title=("Попадания в кэш: " if self.lang == 'ru' else "Cache hits: ") + cache_ratio,
+            SubTitle=("Средний ответ: " if self.lang == 'ru' else "Mean response: ") + mean_kb
+                     + (", отменено устаревших: " if self.lang == 'ru' else ", superseded: ") + superseded_ratio,
+            IcoPath=FS_ICO_PATH,
+            Score=0
+        ))
+        results.append(Result(
+            Title="Очистить статистику" if self.lang == 'ru' else "Clear stats",
+            SubTitle=f"{summary['count']} " + ("последних запросов" if self.lang == 'ru' else "last queries"),
+            IcoPath=FS_ICO_PATH,
+            Score=-1,
+            JsonRPCAction=dict(method="stats_clear", parameters=[])
+        ))
+        return send_results(results=results)
+    
     def query(self, query: str):
         if query.startswith("extl"):
             return self.external_links(query[4:].strip())
@@ -184,6 +261,10 @@ class OSettingsMenu:
             return self.external_search_index(query[4:].strip())
         elif query.startswith("fav"):
             return self.external_favicons_check(query[4:].strip())
+        elif query.startswith("mirror"):
+            return self.mirror_menu()
+        elif query.startswith("stats"):
+            return self.stats_menu()
         else:
             return send_results(results=[
                 Result(
@@ -198,7 +279,18 @@ class OSettingsMenu:
                 ),
                 Result(
                     Title="s:fav",
-                    SubTitle="Все ли иконки на месте" if self.lang == 'ru' else "Are all favicons on place",
+                    SubTitle="Все ли иконки на месте, s:fav fetch скачает недостающие" if self.lang == 'ru'
+                        else "Are all favicons on place, s:fav fetch downloads missing ones",
+                    IcoPath=FS_ICO_PATH
+                ),
+                Result(
+                    Title="s:mirror",
+                    SubTitle="Офлайн-копия каталога" if self.lang == 'ru' else "Offline catalog mirror",
+                    IcoPath=FS_ICO_PATH
+                ),
+                Result(
+                    Title="s:stats",
+                    SubTitle="Время этапов поиска" if self.lang == 'ru' else "Search stage timings",
                     IcoPath=FS_ICO_PATH
                 ),
                 Result(
@@ -0,0 +1,67 @@
+# Pickers of settings menu match every keystroke against whole list with Flow's fuzzy string_matcher,
+# which is slow in Python. Index leaves it only names that can match at all
+
+from collections import OrderedDict
+
+from pyflowlauncher.string_matcher import string_matcher
+
+import typing as t
+
+T = t.TypeVar("T")
+
+
+class FuzzyIndex(t.Generic[T]):
+    """Ranked string_matcher matches over fixed list of items.
+    
+    Every character of query (but spaces) has to be found in name for it to match, both as subsequence and acronym,
+    so table of characters gives candidates by AND of bitsets. Contiguous n-grams can not be used, as matcher
+    allows gaps. Matches of last queries are kept as prefix table: names matching "nar" are among ones matching "na",
+    since query matches only if its characters are subsequence of name"""
+    MAX_QUERIES = 32
+    
+    def __init__(self, items: t.Iterable[T], name: t.Callable[[T], str]):
+        self.items = list(items)
+        self.names = [name(x) for x in self.items]
+        self._all = (1 << len(self.items)) - 1
+        self._chars: dict[str, int] = dict()  # Lowercase character: bitset of items with it in name
+        for index, item_name in enumerate(self.names):
+            for char in set(item_name.lower()):
+                self._chars[char] = self._chars.get(char, 0) | (1 << index)
+        self._queries: OrderedDict[str, tuple[list[int], list[tuple[T, int]]]] = OrderedDict()  # Query: (indexes, matches)
+    
+    def candidates(self, query: str) -> t.Iterable[int]:
+        mask = self._all
+        for char in set(query.lower()) - {" "}:
+            mask &= self._chars.get(char, 0)
+            if not mask:
+                return list()
+        base = max((x for x in self._queries if query.startswith(x)), key=len, default=None)
+        if base is not None:
+            return [x for x in self._queries[base][0] if mask >> x & 1]
+        indexes = list()
+        while mask:
+            lowest = mask & -mask
+            indexes.append(lowest.bit_length() - 1)
+            mask ^= lowest
+        return indexes
+    
+    def search(self, query: str) -> list[tuple[T, int]]:
+        """Matched items with scores, best first. Empty query matches all items with score 0, in list order"""
+        query = query.strip()
+        if not query:
+            return [(x, 0) for x in self.items]
+        if query in self._queries:
+            self._queries.move_to_end(query)
+            return self._queries[query][1]
+        indexes, scores = list(), list()
+        for index in self.candidates(query):
+            match = string_matcher(query, self.names[index])
+            if match.matched:
+                indexes.append(index)
+                scores.append(match.score)
+        order = sorted(range(len(indexes)), key=lambda x: -scores[x])  # Stable, equal scores keep list order
+        matched = [(self.items[indexes[x]], scores[x]) for x in order]
+        self._queries[query] = (indexes, matched)
+        while len(self._queries) > self.MAX_QUERIES:
+            self._queries.popitem(last=False)
+        return matched
@@ -5,30 +5,95 @@ import logging
 
 from pyflowlauncher import Plugin, Result, send_results as _send_results, api, ResultResponse
 
-from .osettings_menu import OSettingsMenu, osettings as _osettings
-from .result import ResultConstructor
-from .graphql_queries import GraphQLQueryConstructor
-from .search import SearchQLClient
+from .osettings import osettings as _osettings
+from .stats import stats
+from .supersession import Superseded
 from .shared import FS_ICO_PATH, SETTINGS_TYPE, SETTINGS_FILE, FL_SETTINGS_FILE
 
 import typing as t
 
+if t.TYPE_CHECKING:
+    from .search import AsyncSearchQLClient
+    from .entity_cache import EntityCache
+    from .poster_cache import PosterCache
+    from .result import ResultConstructor
+    from .osettings_menu import OSettingsMenu
+    from .shiki.graphql import MediaEntryFromGraph
+
 logger = logging.getLogger(__name__)
+payload_logger = logging.getLogger(__name__ + ".payload")
 
 plugin = Plugin()
 
 def get_settings():
-    # XXX: JsonRPC V2 will fix it?
+    # JsonRPC V2 server passes settings with every query, see update_settings
     if plugin.settings:
         return plugin.settings
     with open(SETTINGS_FILE, mode="r", encoding="utf-8") as f:
         return json.load(f)
 
-client = SearchQLClient("ShikiFlow")
 settings = get_settings()
 lang = settings['language'][:2].lower()
-result_constructor = ResultConstructor(settings=settings)
-osettings = OSettingsMenu(lang=lang)
+
+# Heavy objects (and httpx import) are created on first use, so hint and settings responses start fast
+_entities: t.Optional["EntityCache"] = None
+_client: t.Optional["AsyncSearchQLClient"] = None
+_posters: t.Optional["PosterCache"] = None
+_result_constructor: t.Optional["ResultConstructor"] = None
+_osettings_menu: t.Optional["OSettingsMenu"] = None
+
+def get_entities() -> "EntityCache":
+    global _entities
+    if _entities is None:
+        from .entity_cache import EntityCache
+        _entities = EntityCache(max_age=int(settings.get("cache_ttl", "60")) * 60)
+    return _entities
+
+def get_posters() -> "PosterCache":
+    global _posters
+    if _posters is None:
+        from .poster_cache import PosterCache
+        _posters = PosterCache()
+    return _posters
+
+def get_client() -> "AsyncSearchQLClient":
+    global _client
+    if _client is None:
+        from .search import AsyncSearchQLClient
+        from .query_cache import QueryCache
+        from .rate_limit import SharedRateLimiter
+        from .refine import PrefixRefiner
+        _client = AsyncSearchQLClient("ShikiFlow", cache=QueryCache(ttl=int(settings.get("cache_ttl", "60")) * 60),
+                                      entities=get_entities(), rate_limiter=SharedRateLimiter(), refiner=PrefixRefiner())
+    return _client
+
+def get_result_constructor() -> "ResultConstructor":
+    global _result_constructor
+    if _result_constructor is None:
+        from .result import ResultConstructor
+        _result_constructor = ResultConstructor(settings=settings, entities=get_entities(), posters=get_posters())
+    return _result_constructor
+
+def get_osettings_menu() -> "OSettingsMenu":
+    global _osettings_menu
+    if _osettings_menu is None:
+        from .osettings_menu import OSettingsMenu
+        _osettings_menu = OSettingsMenu(lang=lang)
+    return _osettings_menu
+
+
+def update_settings(new_settings: dict):
+    global lang
+    settings.update(new_settings)
+    lang = settings['language'][:2].lower()
+    if _result_constructor is not None:
+        _result_constructor.lang = lang
+    if _osettings_menu is not None:
+        _osettings_menu.lang = lang
+    if _client is not None and _client.cache is not None:
+        _client.cache.ttl = int(settings.get("cache_ttl", "60")) * 60
+    if _entities is not None:
+        _entities.max_age = int(settings.get("cache_ttl", "60")) * 60
 
 
 if _osettings.first_initial:
@@ -49,6 +114,12 @@ if _osettings.first_initial:
 else:
     send_results = _send_results
 
+_localized_send_results = send_results
+
+def send_results(*args, **kwargs) -> ResultResponse:
+    with stats.span("send"):
+        return _localized_send_results(*args, **kwargs)
+
 
 class SearchTags:
     TAG_ANIME = "a"
@@ -56,6 +127,7 @@ class SearchTags:
     TAG_BOTH = "b"
     TAG_ID = "i"
     TAG_SETTINGS = "s"
+    TAG_OFFLINE = "o"
     
     original_query: str
     
@@ -69,12 +141,15 @@ class SearchTags:
     
     show_settings_menu: bool = False
     
+    search_offline: bool = False
+    
     RAW_TAG_TO_VAR: dict[str, str] = {
         TAG_ANIME: "search_only_anime",
         TAG_MANGA: "search_only_manga",
         TAG_BOTH: "search_both_types",
         TAG_ID: "search_by_id",
-        TAG_SETTINGS: "show_settings_menu"
+        TAG_SETTINGS: "show_settings_menu",
+        TAG_OFFLINE: "search_offline"
     }
     
     @property
@@ -123,8 +198,19 @@ class SearchTags:
 
 
 @plugin.on_method
-def query(query: str) -> ResultResponse:
-    search_tags = SearchTags(query)
+async def query(query: str) -> ResultResponse:
+    stats.begin("query")
+    try:
+        return await search_query(query)
+    except Superseded:
+        stats.set_superseded()
+        return send_results([])  # Flow drops responses to stale queries anyway
+    finally:
+        stats.finish()
+
+async def search_query(query: str) -> ResultResponse:
+    with stats.span("tags"):
+        search_tags = SearchTags(query)
     query = search_tags.clean_query
     if search_tags.search_by_id:  # Checking ids beforehand
         try:
@@ -133,7 +219,7 @@ def query(query: str) -> ResultResponse:
         except Exception as e:
             return send_results([Result(Title="Введите правильные ID" if lang == 'ru' else "Enter valid ids", SubTitle="Открыть ReadMe" if lang == 'ru' else "Open ReadMe" if lang == 'ru' else "ReadMe is planned", IcoPath=FS_ICO_PATH)], JsonRPCAction=api.open_url("https://github.com/NoPlagiarism/ShikiFlow"))
     if search_tags.show_settings_menu:
-        return osettings.query(query)
+        return get_osettings_menu().query(query)
     """ MEDIA ENTRIES """
     if len(query) <= 2:
         return send_results([
@@ -141,27 +227,66 @@ def query(query: str) -> ResultResponse:
             Result(Title="m:", SubTitle="Искать Мангу" if lang == 'ru' else "Search Manga", IcoPath=FS_ICO_PATH),
             Result(Title="a:", SubTitle="Искать Аниме" if lang == 'ru' else "Search Anime", IcoPath=FS_ICO_PATH),
             Result(Title="b:", SubTitle="Искать Всё" if lang == 'ru' else "Search Both", IcoPath=FS_ICO_PATH),
+            Result(Title="o:", SubTitle="Искать в офлайн-копии" if lang == 'ru' else "Search Offline mirror", IcoPath=FS_ICO_PATH),
             Result(Title="s:", SubTitle="Дополнительные настройки" if lang == 'ru' else "Additional settings", IcoPath=FS_ICO_PATH)
         ])
     if search_tags.get_media_type() is not None:
         current_search_type = search_tags.get_media_type()
     else:
         current_search_type = settings.get("default_media_type", "Anime")
+    import httpx
+    from .mirror import mirror
+    from .supersession import supersession
+    from .shiki.graphql import GraphQLError
+    
+    client = get_client()
+    error: t.Optional[GraphQLError] = None
     url_matched = re.match(r".*(?P<media_type>animes|mangas)\/(?P<shk_id>\d+).*", query)
-    if url_matched:
-        media_type_raw = url_matched.group("media_type")
-        shk_id = int(url_matched.group("shk_id"))
-        data = client.search_by_ids((shk_id, ), media_type_raw[:-1].capitalize())
-    elif search_tags.search_by_id:
-        data = client.search_both_by_ids(ids=search_tags.get_ids())
+    # Pasted urls and ids come at once, only typed text is debounced
+    turn = await supersession.begin(debounce=not (url_matched or search_tags.search_by_id or search_tags.search_offline))
+    if url_matched or search_tags.search_by_id:
+        try:
+            if url_matched:
+                media_type_raw = url_matched.group("media_type")
+                shk_id = int(url_matched.group("shk_id"))
+                data = await turn.run(client.search_by_ids((shk_id, ), media_type_raw[:-1].capitalize()))
+            else:
+                data = await turn.run(client.search_both_by_ids(ids=search_tags.get_ids()))
+        except GraphQLError as e:  # Some of ids were not answered, show what was found and the error
+            logger.warning(f"Got exc {e} while searching by ids")
+            data, error = e.data, e
+    elif search_tags.search_offline:
+        with stats.span("offline"):
+            data = mirror.search(query=query, limit=int(settings.get("limit", "10")), media_type=current_search_type)
+        client.remember(data)
     else:
-        data = client.search_by_query(query=query, limit=int(settings.get("limit", "10")), media_type=current_search_type)
+        try:
+            data = await turn.run(client.search_by_query(query=query, limit=int(settings.get("limit", "10")), media_type=current_search_type,
+                                                         profile="list"))
+        except httpx.HTTPError as e:
+            if not mirror:
+                raise
+            logger.warning(f"Got exc {e} while searching, falling back to offline mirror")
+            with stats.span("offline"):
+                data = mirror.search(query=query, limit=int(settings.get("limit", "10")), media_type=current_search_type)
+            client.remember(data)
+    turn.check()
+    turn.finish()
+    error_results = [Result(
+        Title="Shikimori ответил ошибкой" if lang == 'ru' else "Shikimori answered with error",
+        SubTitle=str(error),
+        IcoPath=FS_ICO_PATH,
+        Score=-100
+    )] if error is not None else list()
+    if data:
+        get_posters().prefetch(list(data.get("animes") or ()) + list(data.get("mangas") or ()))
     if not data:
-        return send_results([Result(
+        return send_results(error_results or [Result(
             Title="Нет результатов" if lang == 'ru' else "No results",
             IcoPath=FS_ICO_PATH
         )])
-    results = list(result_constructor.result_generator(data))
+    with stats.span("results"):
+        results = list(get_result_constructor().result_generator(data)) + error_results
     if not results:
         return send_results([Result(
             Title="Нет результатов" if lang == 'ru' else "No results",
@@ -169,13 +294,74 @@ def query(query: str) -> ResultResponse:
         )])
     return send_results(results=results)
 
+async def resolve_media(context_data: dict) -> t.Optional["MediaEntryFromGraph"]:
+    """Detailed entry for result's ContextData, lean one if details can not be fetched"""
+    import httpx
+    from .entity_cache import EntityCache
+    from .shiki.graphql import MediaEntryFromGraph
+    
+    client = get_client()
+    try:
+        if EntityCache.is_handle(context_data):
+            return await client.resolve_handle(context_data)
+        return await client.hydrate(MediaEntryFromGraph.from_raw_dict(context_data))
+    except httpx.HTTPError as e:
+        logger.warning(f"Got exc {e} while fetching details of {context_data}")
+        return get_entities().get(context_data["type_"], context_data["id"]) if EntityCache.is_handle(context_data) \
+            else MediaEntryFromGraph.from_raw_dict(context_data)
+
 @plugin.on_method
-def context_menu(context_data):
-    import json; logger.debug(context_data)
+async def context_menu(context_data):
+    payload_logger.debug("%s", context_data)
     
     if isinstance(context_data, dict):
         if context_data.get("type_", "") == "OSettings":
-            return osettings.context_menu(context_data)
+            return get_osettings_menu().context_menu(context_data)
         """ MEDIA ENTRIES """
         if context_data.get("type_", "").lower() in ("anime", "manga"):
-            return send_results(result_constructor.make_context_menu(context_data))
+            media = await resolve_media(context_data)
+            if media is None:
+                return send_results([Result(
+                    Title="Нет результатов" if lang == 'ru' else "No results",
+                    IcoPath=FS_ICO_PATH
+                )])
+            return send_results(get_result_constructor().make_context_menu(media))
+
+@plugin.on_method
+async def open_media(context_data: dict):
+    """Open action of censored entry: its external links are not in list selection"""
+    import webbrowser
+    from .result import ResultConstructor
+    
+    media = await resolve_media(context_data)
+    url = ResultConstructor.find_any_link(media) if media is not None else None
+    if url:
+        webbrowser.open(url)
+    else:
+        logger.info(f"No link to open for {context_data}")
+
+@plugin.on_method
+def mirror_refresh():
+    from .mirror import mirror
+    from .background import spawn_background
+    
+    if not mirror.is_refreshing:
+        spawn_background("src.mirror")
+
+@plugin.on_method
+def favicons_fetch(include_anma: bool = False):
+    from .favicon import FaviconFetcher
+    from .background import spawn_background
+    
+    if not FaviconFetcher().is_fetching:
+        spawn_background("src.favicon", *(["--all"] if include_anma else []))
+
+@plugin.on_method
+def stats_toggle():
+    _osettings.set_stats_enabled(not _osettings.stats_enabled)
+    _osettings.save()
+    stats.enabled = _osettings.stats_enabled
+
+@plugin.on_method
+def stats_clear():
+    stats.clear()
@@ -0,0 +1,195 @@
+# Flow downloads result icons itself, every time they are shown. Posters are kept locally instead: results point
+# at local thumbnail once it is fetched, at remote poster until then
+
+import os
+import asyncio
+import hashlib
+import logging
+from io import BytesIO
+from collections import OrderedDict
+from importlib.util import find_spec
+from urllib.parse import urlsplit
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .shiki.types import MediaEntry
+
+import typing as t
+
+if t.TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+POSTER_CACHE_FOLDER = os.path.join(PLUGIN_CACHE_FOLDER, "Posters") if PLUGIN_CACHE_FOLDER else None
+
+IMAGE_MAGICS = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"RIFF")
+
+
+class PosterCache:
+    """Poster thumbnails on disk keyed by entry and poster url, least recently used are evicted over `max_bytes`.
+    
+    Folder is scanned once, so lookups do not touch disk. Missing posters are fetched in background of resident
+    process only: process of v1 call exits right after results are sent, cancelling fetches midway"""
+    THUMBNAIL_SIZE = 96
+    MAX_BYTES = 50 * 1024 * 1024
+    MAX_POSTER_BYTES = 2 * 1024 * 1024
+    CONCURRENCY = 4
+    TIMEOUT = 10.0
+    
+    def __init__(self, folder: t.Optional[str] = POSTER_CACHE_FOLDER, max_bytes: int = MAX_BYTES,
+                 concurrency: int = CONCURRENCY):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.has_pillow = find_spec("PIL") is not None
+        self.prefetching = False
+        self._files: OrderedDict[str, int] = OrderedDict()  # File name: size, least recently used first
+        self._size = 0
+        self._touched: set[str] = set()  # Used since last prefetch, their mtimes keep order between runs
+        self._pending: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._client: t.Optional["httpx.AsyncClient"] = None
+        self._semaphore: t.Optional[asyncio.Semaphore] = None
+        self._load()
+    
+    def enable_prefetch(self):
+        """Called by resident process, it outlives query, so fetches started by `prefetch` get to finish"""
+        self.prefetching = True
+    
+    def _load(self):
+        if self.folder is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        files = list()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".tmp"):  # Left by interrupted write
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._files[name] = size
+            self._size += size
+    
+    @staticmethod
+    def poster_url(media: MediaEntry) -> t.Optional[str]:
+        url = media.icon_url
+        return url if url and url.startswith(("https://", "http://")) else None
+    
+    def file_name(self, media: MediaEntry, url: str) -> str:
+        digest = hashlib.blake2s(url.encode(), digest_size=6).hexdigest()
+        ext = ".jpg" if self.has_pillow else (os.path.splitext(urlsplit(url).path)[1] or ".jpg")
+        return f"{media.type_.lower()}_{media.id_}_{digest}{ext}"
+    
+    def get(self, media: MediaEntry) -> t.Optional[str]:
+        """Local thumbnail of media's poster, if it is fetched already"""
+        url = self.poster_url(media)
+        if url is None or self.folder is None:
+            return None
+        name = self.file_name(media, url)
+        if name not in self._files:
+            return None
+        self._files.move_to_end(name)
+        self._touched.add(name)
+        return os.path.join(self.folder, name)
+    
+    def prefetch(self, entries: t.Iterable[MediaEntry]):
+        """Fetch missing posters of `entries` in background of running event loop"""
+        if self.folder is None or not self.prefetching:
+            return
+        missing = dict()
+        for media in entries:
+            url = self.poster_url(media)
+            if url is None:
+                continue
+            name = self.file_name(media, url)
+            if name not in self._files and name not in self._pending:
+                missing[name] = url
+        if not missing and not self._touched:
+            return
+        self._pending.update(missing)
+        task = asyncio.get_running_loop().create_task(self._fetch_all(missing))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    def _flush_touched(self):
+        for name in self._touched:
+            try:
+                os.utime(os.path.join(self.folder, name))
+            except OSError:
+                self._forget(name)
+        self._touched.clear()
+    
+    def thumbnail(self, data: bytes) -> t.Optional[bytes]:
+        if not self.has_pillow:
+            return data if data.startswith(IMAGE_MAGICS) else None
+        from PIL import Image
+        
+        try:
+            with Image.open(BytesIO(data)) as image:
+                image = image.convert("RGB")
+                image.thumbnail((self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE), Image.LANCZOS)
+                output = BytesIO()
+                image.save(output, format="JPEG", quality=85)
+                return output.getvalue()
+        except Exception as e:
+            logger.debug("Got exc %s while making poster thumbnail", e)
+            return None
+    
+    async def _fetch_all(self, missing: dict[str, str]):
+        import httpx
+        
+        self._flush_touched()
+        if self._client is None:
+            self._client = httpx.AsyncClient(follow_redirects=True, timeout=self.TIMEOUT, headers={"User-Agent": "ShikiFlow"},
+                                             limits=httpx.Limits(max_connections=self.concurrency))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(self._fetch(name, url) for name, url in missing.items()))
+        finally:
+            self._pending.difference_update(missing)
+        self._evict()
+    
+    async def _fetch(self, name: str, url: str):
+        import httpx
+        
+        try:
+            async with self._semaphore:
+                resp = await self._client.get(url)
+        except httpx.HTTPError as e:
+            logger.debug("Got exc %s while fetching poster %s", e, url)
+            return
+        if resp.status_code != 200 or len(resp.content) > self.MAX_POSTER_BYTES:
+            return
+        data = await asyncio.to_thread(self.thumbnail, resp.content)  # Decoding and resizing take milliseconds
+        if data is not None:
+            self._write(name, data)
+    
+    def _write(self, name: str, data: bytes):
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path + ".tmp", mode="wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning("Got exc %s while writing poster %s", e, name)
+            return
+        self._forget(name)
+        self._files[name] = len(data)
+        self._size += len(data)
+    
+    def _forget(self, name: str):
+        self._size -= self._files.pop(name, 0)
+    
+    def _evict(self):
+        while self._size > self.max_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            self._touched.discard(name)
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError as e:
+                logger.debug("Got exc %s while evicting poster %s", e, name)
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+
+from .shared import PLUGIN_CACHE_FOLDER
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "query_cache.sqlite3") if PLUGIN_CACHE_FOLDER else None
+
+
+class QueryCache:
+    """Disk-backed cache of raw GraphQL search payloads.
+    
+    Entries are keyed on normalized query, media type, limit and selection variant, expire after `ttl` seconds
+    and the least recently used ones are evicted when there are more than `max_entries`"""
+    DEFAULT_TTL = 60 * 60
+    DEFAULT_MAX_ENTRIES = 1000
+    
+    def __init__(self, path: t.Optional[str] = QUERY_CACHE_FILE,
+                 ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path if path else ":memory:"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        
+        if path and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._init_db()
+    
+    def _init_db(self):
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS queries ("
+                           "key TEXT PRIMARY KEY, payload TEXT NOT NULL,"
+                           "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS queries_accessed ON queries (accessed_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0)")
+    
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+    
+    @classmethod
+    def make_key(cls, query: str, media_type: str, limit: int, variant: str = "") -> str:
+        return f"{media_type.lower()}|{int(limit)}|{variant}|{cls.normalize_query(query)}"
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+    
+    def _count(self, name: t.Literal['hits', 'misses']):
+        self._conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name, ))
+    
+    def get(self, query: str, media_type: str, limit: int, variant: str = "") -> t.Optional[dict]:
+        if not self.enabled:
+            return None
+        key = self.make_key(query, media_type, limit, variant)
+        now = time.time()
+        row = self._conn.execute("SELECT payload, created_at FROM queries WHERE key = ?", (key, )).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self._count("misses")
+            logger.debug("Query cache miss: %s", key)
+            return None
+        self._conn.execute("UPDATE queries SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        logger.debug("Query cache hit: %s", key)
+        return json.loads(row[0])
+    
+    def set(self, query: str, media_type: str, limit: int, payload: dict, variant: str = ""):
+        if not self.enabled:
+            return
+        key = self.make_key(query, media_type, limit, variant)
+        now = time.time()
+        self._conn.execute("INSERT OR REPLACE INTO queries (key, payload, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                           (key, json.dumps(payload, ensure_ascii=False), now, now))
+        self.evict()
+    
+    def evict(self):
+        self._conn.execute("DELETE FROM queries WHERE created_at < ?", (time.time() - self.ttl, ))
+        self._conn.execute("DELETE FROM queries WHERE key IN "
+                           "(SELECT key FROM queries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries, ))
+    
+    def clear(self):
+        self._conn.execute("DELETE FROM queries")
+        self._conn.execute("UPDATE counters SET value = 0")
+    
+    @property
+    def hits(self) -> int:
+        return self._conn.execute("SELECT value FROM counters WHERE name = 'hits'").fetchone()[0]
+    
+    @property
+    def misses(self) -> int:
+        return self._conn.execute("SELECT value FROM counters WHERE name = 'misses'").fetchone()[0]
+    
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    
+    def close(self):
+        self._conn.close()
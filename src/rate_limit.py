@@ -0,0 +1,107 @@
+# Token buckets shared by all running plugin processes: Flow starts process per keystroke (or many tasks
+# in one process), and each of them alone knows nothing about Shikimori limits of 5 rps and 90 rpm
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import nullcontext
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .file_lock import FileLock
+from .shiki.raw_shiki import RequestDropped
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "rate_limit.json") if PLUGIN_CACHE_FOLDER else None
+
+# name: (capacity, tokens per second), a bit under Shikimori limits to leave room for clock drift
+BUCKETS = {
+    "rps": (5, 4.5),
+    "rpm": (90, 1.4),
+}
+
+
+class SharedRateLimiter:
+    """Token bucket scheduler, state is kept in small JSON file under lock and read on every request.
+    
+    Tokens may go below zero: every reservation takes place in queue, and is told how long to wait.
+    Reservation, that would wait longer than `max_wait`, is dropped (newest-first)"""
+    def __init__(self, path: t.Optional[str] = RATE_LIMIT_FILE, max_wait: float = 3.0,
+                 buckets: t.Optional[dict[str, tuple[float, float]]] = None):
+        self.path = path
+        self.max_wait = max_wait
+        self.buckets = buckets if buckets is not None else BUCKETS
+        self.lock_file = FileLock(path, timeout=1.0) if path else None
+        self._state: dict = dict()  # Used when there is no cache folder or lock was not taken
+        self._lock = threading.Lock()
+    
+    def _load(self) -> dict:
+        if self.path is None or not os.path.exists(self.path):
+            return dict()
+        try:
+            with open(self.path, mode="r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return dict()
+    
+    def _save(self, state: dict):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, mode="w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError as e:
+            logger.warning("Got exc %s while writing rate limit state", e)
+    
+    def _update(self, func: t.Callable[[dict, float], t.Any]) -> t.Any:
+        """Run `func(state, now)` on refilled state under lock and store it back"""
+        # Threads of this process (requests sent via asyncio.to_thread) queue here, other processes on file lock
+        with self._lock, (self.lock_file.held() if self.lock_file else nullcontext(False)) as locked:
+            state = self._load() if locked else self._state
+            now = time.time()  # Wall clock, monotonic one is not shared between processes
+            for name, (capacity, rate) in self.buckets.items():
+                tokens, updated = state.get(name, (capacity, now))
+                state[name] = (min(capacity, tokens + max(0.0, now - updated) * rate), now)
+            result = func(state, now)
+            if locked:
+                self._save(state)
+            else:
+                self._state = state
+            return result
+    
+    def _reserve(self, state: dict, now: float) -> float:
+        wait = max(0.0, state.get("blocked_until", 0.0) - now)
+        for name, (capacity, rate) in self.buckets.items():
+            tokens, _ = state[name]
+            wait = max(wait, (1 - tokens) / rate)
+        if wait > self.max_wait:
+            return wait  # Not counted, so it does not delay requests queued before it
+        for name in self.buckets:
+            tokens, updated = state[name]
+            state[name] = (tokens - 1, updated)
+        return wait
+    
+    def reserve(self) -> float:
+        """Seconds to wait before sending request, raises RequestDropped if queue is too long"""
+        wait = self._update(self._reserve)
+        if wait > self.max_wait:
+            logger.info("Request dropped by rate limiter, it would wait %.2f s", wait)
+            raise RequestDropped(f"Rate limit queue is full, request would wait {wait:.2f} s")
+        if wait > 0:
+            logger.debug("Rate limiter delays request by %.2f s", wait)
+        return wait
+    
+    def _penalize(self, state: dict, now: float, retry_after: float):
+        state["blocked_until"] = max(state.get("blocked_until", 0.0), now + retry_after)
+        for name in self.buckets:
+            tokens, updated = state[name]
+            state[name] = (min(0.0, tokens), updated)
+    
+    def penalize(self, retry_after: float):
+        """429 from server: nobody sends anything for `retry_after` seconds, buckets are emptied"""
+        logger.info("Got 429, rate limiter is blocked for %.2f s", retry_after)
+        self._update(lambda state, now: self._penalize(state, now, retry_after))
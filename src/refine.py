@@ -0,0 +1,76 @@
+import re
+import logging
+from collections import OrderedDict
+
+from .shiki.types import MediaEntry
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+MEDIA_KEYS = {"Anime": ("animes", ), "Manga": ("mangas", ), "Both": ("animes", "mangas")}
+
+
+class PrefixRefiner:
+    """Answers query extending earlier one by filtering its results locally.
+    
+    Search results with fewer entries than limit are complete: anything matching "narut" is among results
+    for "naru" already. Such sets are remembered per media type and selection variant"""
+    MIN_PREFIX = 3  # Shorter queries are matched by server too loosely to trust
+    MAX_SETS = 16
+    
+    def __init__(self, max_sets: int = MAX_SETS):
+        self.max_sets = max_sets
+        self._sets: OrderedDict[tuple[str, str, str], dict] = OrderedDict()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(re.sub(r"[\W_]+", " ", text.casefold().replace("ё", "е")).split())
+    
+    @classmethod
+    def matches(cls, entry: MediaEntry, tokens: list[str]) -> bool:
+        names = [cls.normalize(x) for x in entry.get_names_tuple() if isinstance(x, str)]
+        return any(all(token in name for token in tokens) for name in names)
+    
+    @staticmethod
+    def is_complete(data: dict, media_type: str, limit: int) -> bool:
+        # Both is requested as two searches, each one for half of limit
+        part_limit = (limit + 1) // 2 if media_type == "Both" else limit
+        return all(len(data.get(key) or ()) < part_limit for key in MEDIA_KEYS[media_type])
+    
+    def remember(self, query: str, media_type: str, limit: int, data: t.Optional[dict], variant: str = ""):
+        query = self.normalize(query)
+        if not data or len(query) < self.MIN_PREFIX or not self.is_complete(data, media_type, limit):
+            return
+        key = (media_type, variant, query)
+        self._sets[key] = {x: list(data.get(x) or ()) for x in MEDIA_KEYS[media_type]}
+        self._sets.move_to_end(key)
+        while len(self._sets) > self.max_sets:
+            self._sets.popitem(last=False)
+    
+    def _find_base(self, media_type: str, variant: str, query: str) -> t.Optional[dict]:
+        best = None
+        for (set_media_type, set_variant, set_query), data in self._sets.items():
+            if set_media_type != media_type or set_variant != variant or not query.startswith(set_query):
+                continue
+            if best is None or len(set_query) > len(best[0]):
+                best = (set_query, data)
+        return best[1] if best else None
+    
+    def refine(self, query: str, media_type: str, limit: int, variant: str = "") -> t.Optional[dict]:
+        """Locally filtered results, or None if server has to be asked"""
+        query = self.normalize(query)
+        base = self._find_base(media_type, variant, query)
+        if base is None:
+            return None
+        tokens = query.split()
+        part_limit = (limit + 1) // 2 if media_type == "Both" else limit
+        data = {key: [x for x in entries if self.matches(x, tokens)][:part_limit] for key, entries in base.items()}
+        if not any(data.values()):
+            # Server matches more loosely (transliteration, typos), empty local answer is not trusted
+            return None
+        logger.debug("Query %r refined locally", query)
+        return data
+    
+    def clear(self):
+        self._sets.clear()
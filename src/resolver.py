@@ -0,0 +1,219 @@
+# Bulk resolver of titles, Shikimori IDs and MyAnimeList IDs into Shikimori entries, see resolve.py
+# Output is JSON lines written as soon as each batch completes; with `--output` file already resolved inputs
+# are skipped, so interrupted run is resumed by running it again
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+import typing as t
+
+if t.TYPE_CHECKING:
+    from .search import AsyncSearchQLClient, MEDIA_TYPE
+    from .shiki.graphql import MediaEntryFromGraph
+
+logger = logging.getLogger(__name__)
+
+KIND_TYPE: t.TypeAlias = t.Literal['auto', 'title', 'id', 'mal']
+
+
+class ResolveItem(t.NamedTuple):
+    line: int
+    raw: str
+    kind: str
+    value: str | int
+
+
+def parse_item(line: int, raw: str, kind: KIND_TYPE = "auto") -> ResolveItem:
+    """In auto mode `mal:123` is MAL ID, bare number is Shikimori ID and anything else is title"""
+    if kind == "auto":
+        matched = re.fullmatch(r"(?i)(mal|id):\s*(\d+)", raw)
+        if matched:
+            kind, value = matched.group(1).lower(), matched.group(2)
+        else:
+            kind, value = ("id", raw) if raw.isdigit() else ("title", raw)
+    else:
+        value = raw
+    return ResolveItem(line, raw, kind, int(value) if kind in ("id", "mal") else value)
+
+
+def read_items(lines: t.Iterable[str], kind: KIND_TYPE = "auto") -> list[ResolveItem]:
+    items = list()
+    for line, raw in enumerate(lines, 1):
+        raw = raw.strip()
+        if not raw or raw.startswith("#"):
+            continue
+        try:
+            items.append(parse_item(line, raw, kind))
+        except ValueError:
+            logger.warning("Line %d is not a valid %s: %r", line, kind, raw)
+    return items
+
+
+def read_done(path: t.Optional[str]) -> set[str]:
+    """Inputs already resolved in previous run, failed ones are retried"""
+    done = set()
+    if path is None or not os.path.exists(path):
+        return done
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # Line cut by interruption
+                continue
+            if record.get("status") != "error":
+                done.add(record["input"])
+    return done
+
+
+class BulkResolver:
+    """Resolves items with concurrent batched requests: IDs go in chunks of by-ids queries,
+    titles in aliased batches of searches. Pace is set by client's rate limiter, not by `concurrency`"""
+    TITLE_LIMIT = 5
+    TITLES_BATCH = 10
+    
+    def __init__(self, client: "AsyncSearchQLClient", media_type: "MEDIA_TYPE" = "Both", concurrency: int = 8,
+                 output: t.TextIO = sys.stdout, progress: t.Optional[t.TextIO] = sys.stderr):
+        self.client = client
+        self.media_type = media_type
+        self.concurrency = concurrency
+        self.output = output
+        self.progress = progress
+        self.total = 0
+        self.done = 0
+        self.counters = {"found": 0, "not_found": 0, "error": 0}
+        self._started = time.monotonic()
+        self._last_progress = 0.0
+    
+    @staticmethod
+    def make_record(item: ResolveItem, entry: t.Optional["MediaEntryFromGraph"] = None, **extra) -> dict:
+        record = {"line": item.line, "input": item.raw, "kind": item.kind}
+        if entry is None:
+            return {**record, "status": "not_found", **extra}
+        return {**record, "status": "found", "type": entry.type_, "id": entry.id_, "mal_id": entry.mal_id,
+                "name": entry.name, "russian": entry.russian, "english": entry.english, "url": entry.url, **extra}
+    
+    def write(self, items: list[ResolveItem], records: list[dict]):
+        for record in records:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.counters[record["status"]] += 1
+        self.output.flush()
+        self.done += len(items)
+        self.report()
+    
+    def report(self, final: bool = False):
+        now = time.monotonic()
+        if self.progress is None or (not final and now - self._last_progress < 1):
+            return
+        self._last_progress = now
+        rate = self.done / max(now - self._started, 1e-9)
+        self.progress.write(f"\r{self.done}/{self.total} resolved ({rate:.1f}/s), found {self.counters['found']}, "
+                            f"not found {self.counters['not_found']}, errors {self.counters['error']}"
+                            + ("\n" if final else ""))
+        self.progress.flush()
+    
+    @staticmethod
+    def entries(data: t.Optional[dict]) -> list["MediaEntryFromGraph"]:
+        return list((data or dict()).get("animes") or ()) + list((data or dict()).get("mangas") or ())
+    
+    async def resolve_ids(self, items: list[ResolveItem]) -> list[dict]:
+        # Shikimori reuses MyAnimeList IDs, so MAL IDs are looked up as Shikimori ones and checked afterwards
+        data = await self.client.search_by_ids([x.value for x in items], self.media_type)
+        by_id = dict()
+        for entry in self.entries(data):
+            by_id.setdefault(entry.id_, list()).append(entry)
+        records = list()
+        for item in items:
+            found = [x for x in by_id.get(item.value, ()) if item.kind == "id" or x.mal_id == item.value]
+            records += [self.make_record(item, x) for x in found] or [self.make_record(item)]
+        return records
+    
+    def title_record(self, item: ResolveItem, data: t.Optional[dict]) -> dict:
+        entries = self.entries(data)
+        if not entries:
+            return self.make_record(item)
+        title = item.value.casefold()
+        exact = [x for x in entries if any(isinstance(name, str) and name.casefold() == title for name in x.get_names_tuple())]
+        return self.make_record(item, (exact or entries)[0], exact=bool(exact))
+    
+    async def resolve_titles(self, items: list[ResolveItem]) -> list[dict]:
+        results = await self.client.search_many_by_query([x.value for x in items], self.TITLE_LIMIT, self.media_type,
+                                                         profile="list")
+        return [self.title_record(item, data) for item, data in zip(items, results)]
+    
+    async def _run_batch(self, semaphore: asyncio.Semaphore, items: list[ResolveItem]):
+        import httpx
+        
+        async with semaphore:
+            try:
+                if items[0].kind == "title":
+                    records = await self.resolve_titles(items)
+                else:
+                    records = await self.resolve_ids(items)
+            except httpx.HTTPError as e:
+                logger.warning("Got exc %s while resolving lines %s", e, [x.line for x in items])
+                records = [self.make_record(x, status="error", error=str(e)) for x in items]
+        self.write(items, records)
+    
+    def batches(self, items: list[ResolveItem]) -> list[list[ResolveItem]]:
+        titles = [x for x in items if x.kind == "title"]
+        ids = [x for x in items if x.kind != "title"]
+        chunk = self.client.IDS_CHUNK
+        return [titles[i:i + self.TITLES_BATCH] for i in range(0, len(titles), self.TITLES_BATCH)] \
+            + [ids[i:i + chunk] for i in range(0, len(ids), chunk)]
+    
+    async def run(self, items: list[ResolveItem]):
+        self.total = len(items)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._run_batch(semaphore, x) for x in self.batches(items)))
+        self.report(final=True)
+
+
+def main(argv: t.Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog="python resolve.py",
+                                     description="Resolve titles, Shikimori IDs or MAL IDs into Shikimori entries (JSON lines)")
+    parser.add_argument("input", nargs="?", default="-", help="File with one item per line, '-' for stdin")
+    parser.add_argument("-o", "--output", default=None, help="Append results here and skip inputs resolved before")
+    parser.add_argument("-k", "--kind", choices=("auto", "title", "id", "mal"), default="auto",
+                        help="How to read lines, auto: 'mal:123' is MAL ID, number is Shikimori ID, other is title")
+    parser.add_argument("-t", "--type", dest="media_type", choices=("Anime", "Manga", "Both"), default="Both")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Batches in flight")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No progress on stderr")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    
+    if args.input == "-":
+        items = read_items(sys.stdin, args.kind)
+    else:
+        with open(args.input, mode="r", encoding="utf-8") as f:
+            items = read_items(f, args.kind)
+    done = read_done(args.output)
+    items = [x for x in items if x.raw not in done]
+    if done and not args.quiet:
+        sys.stderr.write(f"Resuming, {len(done)} inputs are already resolved\n")
+    
+    from .search import AsyncSearchQLClient
+    from .query_cache import QueryCache
+    from .entity_cache import EntityCache
+    from .rate_limit import SharedRateLimiter
+    
+    async def run():
+        # Shares caches and rate limit with running plugin, waits in queue instead of being dropped
+        client = AsyncSearchQLClient("ShikiFlow", cache=QueryCache(), entities=EntityCache(),
+                                     rate_limiter=SharedRateLimiter(max_wait=60))
+        output = open(args.output, mode="a", encoding="utf-8") if args.output else sys.stdout
+        try:
+            async with client:
+                resolver = BulkResolver(client, args.media_type, args.concurrency, output,
+                                        None if args.quiet else sys.stderr)
+                await resolver.run(items)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    
+    asyncio.run(run())
@@ -1,15 +1,16 @@
 import logging
 
-from httpx import URL
 from pyflowlauncher import Result, api
 from pyflowlauncher.icons import BROWSER, COPYLINK, APP
 
 from .shiki.types import MediaEntry, AnimeEntry, MangaEntry,\
     AnimeKindEnum, AnimeStatusEnum, MangaKindEnum, MangaStatusEnum
 from .shiki.graphql import MediaEntryFromGraph
-from .shared import FS_ICO_PATH, SETTINGS_TYPE, FAVICON_FOLDER_ROOT, FAVICON_FOLDER_CUSTOM
+from .shared import FS_ICO_PATH, SETTINGS_TYPE, url_host
 from .osettings import osettings
-from .favicon import FaviconManager
+from .favicon import get_favicon_manager
+from .entity_cache import EntityCache
+from .poster_cache import PosterCache
 
 import typing as t
 
@@ -108,19 +109,30 @@ class ResultConstructor:
         }
     }
     
-    def __init__(self, settings: SETTINGS_TYPE, lang: t.Optional[t.Literal['ru', 'en']] = None):
+    def __init__(self, settings: SETTINGS_TYPE, lang: t.Optional[t.Literal['ru', 'en']] = None,
+                 entities: t.Optional[EntityCache] = None, posters: t.Optional[PosterCache] = None):
         self.settings = settings
+        self.entities = entities
+        self.posters = posters
         if lang:
             self.lang = lang
         else:
             self.lang = self.settings.get('language', 'Russian')[:2].lower()
-        
-        self.fav_man = FaviconManager([FAVICON_FOLDER_CUSTOM, FAVICON_FOLDER_ROOT])
-
+    
     def result_generator(self, data, preferable_title: PREFERABLE_TITLE_TYPE = "English"):
         for x in (list(data.get("animes", list())) + list(data.get("mangas", list()))):
             yield self.make_result(media=x)
     
+    def make_context_data(self, media: MediaEntry) -> dict:
+        # Small handle if entry can be found locally later, whole entry otherwise
+        if self.entities is not None and isinstance(media, MediaEntryFromGraph):
+            return self.entities.make_handle(media)
+        return media.raw_dict
+    
+    def get_icon(self, media: MediaEntry) -> t.Optional[str]:
+        # Local poster once it is fetched, Flow downloads remote one on every query
+        return (self.posters.get(media) if self.posters is not None else None) or media.icon_url
+    
     def make_result(self, media: MediaEntry):
         if isinstance(media, AnimeEntry):
             return self.make_result_from_anime(media)
@@ -165,7 +177,16 @@ class ResultConstructor:
             return ext_links["anime_db"]
         elif "myanimelist" in ext_links:
             return ext_links["myanimelist"]
-        return ext_links.values()[0]
+        return next(iter(ext_links.values()))
+    
+    def make_open_action(self, media: MediaEntry) -> dict:
+        url = self.find_any_link(media)
+        if url:
+            return api.open_url(url)
+        if media.is_censored and isinstance(media, MediaEntryFromGraph) and not media.has_details:
+            # Lean entry has no external links, they are fetched on open
+            return dict(method="open_media", parameters=[self.make_context_data(media)])
+        return api.copy_to_clipboard(self.get_preferable_title_from_chosen(media))
     
     def make_result_from_anime(self, anime: AnimeEntry):
         if anime.episodes_aired:
@@ -175,14 +196,13 @@ class ResultConstructor:
                     episodes = episodes + "/" + str(anime.episodes)
         else:
             episodes = str(anime.episodes) if anime.episodes else None
-        url = self.find_any_link(anime)
         result = Result(
             Title=self.get_preferable_title_from_chosen(anime),
             SubTitle=f"{ {'ru': 'Тип', 'en': 'Format'}[self.lang]}: {self.ANIME_KINDS[self.lang].get(anime.kind, f'N/A [' + {'ru': 'Аниме', 'en': 'Anime' }[self.lang] + ']')} | { {'ru': 'Статус', 'en': 'Status'}[self.lang] }: {self.ANIME_STATUSES[self.lang].get(anime.status, 'N/A')}\n" +\
                 (f"{ {'ru': 'Эпизодов', 'en': 'Episodes'}[self.lang] }: {episodes}" if episodes else "") + ((f" | { {'ru': 'Сезон', 'en': 'Season' }[self.lang] }: {self.from_season_string_with_current(anime.season)}") if anime.season else ""),
-            IcoPath=anime.icon_url,
-            ContextData=anime.raw_dict,
-            JsonRPCAction=api.open_url(url) if url else api.copy_to_clipboard(self.get_preferable_title_from_chosen(anime))
+            IcoPath=self.get_icon(anime),
+            ContextData=self.make_context_data(anime),
+            JsonRPCAction=self.make_open_action(anime)
         )
         return result
     
@@ -192,13 +212,12 @@ class ResultConstructor:
             ch_vol = ch_vol + f"{ {'ru': 'Глав', 'en': 'Chapters:' }[self.lang] }: {manga.chapters}"
         if manga.volumes:
             ch_vol = ch_vol + f" | { {'ru': 'Томов', 'en': 'Volumes' }[self.lang] }: {manga.volumes}"
-        url = self.find_any_link(manga)
         result = Result(
             Title=self.get_preferable_title_from_chosen(manga),
             SubTitle=f"{ {'ru': 'Тип', 'en': 'Format'}[self.lang]}: {self.MANGA_KINDS[self.lang].get(manga.kind, f'N/A [' + {'ru': 'Манга', 'en': 'Manga' }[self.lang] + ']')} | { {'ru': 'Статус', 'en': 'Status'}[self.lang] }: {self.MANGA_STATUSES[self.lang].get(manga.status, 'N/A')}" +  ch_vol,
-            IcoPath=manga.icon_url,
-            ContextData=manga.raw_dict,
-            JsonRPCAction=api.open_url(url) if url else api.copy_to_clipboard(self.get_preferable_title_from_chosen(manga))
+            IcoPath=self.get_icon(manga),
+            ContextData=self.make_context_data(manga),
+            JsonRPCAction=self.make_open_action(manga)
         )
         return result
     
@@ -212,7 +231,7 @@ class ResultConstructor:
         if url:
             results.append(Result(
                 Title="Скопировать ссылку" if self.lang == 'ru' else "Copy link",
-                SubTitle=f"{ {'ru': 'на', 'en': 'on'}[self.lang] } Shikimori" if not media.is_censored else ("на {0} (Цензура)".format(str(URL(url).host)) if self.lang == "ru" else "on {0} (Censored)".format(str(URL(url).host))),
+                SubTitle=f"{ {'ru': 'на', 'en': 'on'}[self.lang] } Shikimori" if not media.is_censored else ("на {0} (Цензура)".format(url_host(url)) if self.lang == "ru" else "on {0} (Censored)".format(url_host(url))),
                 IcoPath=COPYLINK,
                 JsonRPCAction=api.copy_to_clipboard(url)
             ))
@@ -229,8 +248,8 @@ class ResultConstructor:
                     continue
                 results.append(Result(
                     Title=media.EXT_LINKS_NAMES[ext],
-                    SubTitle=f"Открыть на {URL(url_ext).host}" if self.lang == 'ru' else f"Open on {URL(url_ext).host}",
-                    IcoPath=self.fav_man.get_fav_path(url_ext) or BROWSER,
+                    SubTitle=f"Открыть на {url_host(url_ext)}" if self.lang == 'ru' else f"Open on {url_host(url_ext)}",
+                    IcoPath=get_favicon_manager().get_fav_path(url_ext) or BROWSER,
                     JsonRPCAction=api.open_url(url_ext)
                 ))
         # ExtSearch
@@ -245,8 +264,8 @@ class ResultConstructor:
                 results.append(
                     Result(
                         Title=ext.name,
-                        SubTitle=f"Искать на {URL(search_url).host}" if self.lang == 'ru' else f"Search on {URL(search_url).host}",
-                        IcoPath=self.fav_man.get_fav_path(search_url) or BROWSER,
+                        SubTitle=f"Искать на {url_host(search_url)}" if self.lang == 'ru' else f"Search on {url_host(search_url)}",
+                        IcoPath=get_favicon_manager().get_fav_path(search_url) or BROWSER,
                         JsonRPCAction=api.open_url(search_url)
                     )
                 )
@@ -1,51 +1,344 @@
+import asyncio
 import logging
+import threading
 
-from .shiki.graphql import GraphQLShikiClient
-from .graphql_queries import GraphQLQueryConstructor
+from .graphql_queries import GraphQLQueryConstructor, PreparedQuery, BatchedQuery, PROFILE_TYPE
+from .shiki.graphql import AsyncGraphQLShikiClient, MediaEntryFromGraph, GraphQLError
+from .shiki.raw_shiki import RateLimiter
 from .shiki.types import AnimeEntry, MangaEntry
+from .query_cache import QueryCache
+from .entity_cache import EntityCache
+from .refine import PrefixRefiner
+from .stats import stats
+from .supersession import note_network
+from .log import LazyJson
 
 import typing as t
 
 logger = logging.getLogger(__name__)
+payload_logger = logging.getLogger(__name__ + ".payload")
 
-class SearchQLClient(GraphQLShikiClient):
-    def search_by_query(self, query: str, limit: int, media_type: t.Literal['Anime', 'Manga', 'Both']) -> t.Optional[list[AnimeEntry | MangaEntry]]:
-        if media_type == 'Anime':
-            return self.search_anime_by_query(query, limit)
-        elif media_type == "Manga":
-            return self.search_manga_by_query(query, limit)
-        else:
-            return self.search_both_by_query(query, limit)
+MEDIA_TYPE: t.TypeAlias = t.Literal['Anime', 'Manga', 'Both']
+
+
+class AsyncSearchQLClient(AsyncGraphQLShikiClient):
+    IDS_CHUNK = 50  # Max limit of Shikimori GraphQL
+    IDS_BATCH = 2  # Chunks per aliased request, Both lookup of up to 50 ids is one round trip
+    IDS_CONCURRENCY = 4
+    
+    def __init__(self, app_name: str, cache: t.Optional[QueryCache] = None, entities: t.Optional[EntityCache] = None,
+                 rate_limiter: t.Optional[RateLimiter] = None, refiner: t.Optional[PrefixRefiner] = None):
+        AsyncGraphQLShikiClient.__init__(self, app_name=app_name, rate_limiter=rate_limiter)
+        self.cache = cache
+        self.entities = entities
+        self.refiner = refiner
+    
+    async def get_raw_data(self, query: t.Any, variables: t.Optional[dict] = None):
+        note_network()
+        with stats.span("http"):
+            raw_resp = await self.post(self.api_url("/api/graphql"), json=self.make_payload(query, variables))
+            raw_resp.raise_for_status()
+        stats.add_bytes(len(raw_resp.content))
+        with stats.span("json"):
+            data = raw_resp.json()
+        payload_logger.debug("%s", LazyJson(data))
+        return data
     
-    def search_by_ids(self, ids: t.Iterable[int], media_type: t.Literal['Anime', 'Manga', 'Both']) -> t.Optional[list[AnimeEntry | MangaEntry]]:
+    @classmethod
+    def parse_data(cls, data: dict):
+        with stats.span("parse"):
+            return super().parse_data(data)
+    
+    def remember(self, data: t.Optional[dict]):
+        if self.entities is not None:
+            self.entities.put_many(data)
+    
+    @staticmethod
+    def merge_raw_data(*payloads: dict) -> dict:
+        merged = {"data": dict()}
+        for payload in payloads:
+            merged["data"].update(payload.get("data") or dict())
+            if payload.get("errors"):
+                merged.setdefault("errors", list()).extend(payload["errors"])
+        return merged
+    
+    async def get_raw_batch(self, queries: t.Sequence[PreparedQuery]) -> list[dict]:
+        """Raw responses of independent queries, fetched in one aliased request"""
+        if len(queries) == 1:
+            return [await self.get_raw_data(queries[0])]
+        batch: BatchedQuery = GraphQLQueryConstructor.batch(queries)
+        return self.split_batch(await self.get_raw_data(batch), batch.aliases)
+    
+    @staticmethod
+    def search_queries(query: str, limit: int, media_type: MEDIA_TYPE,
+                       profile: PROFILE_TYPE = "detail") -> list[PreparedQuery]:
         if media_type == 'Anime':
-            return self.search_anime_by_ids(ids)
+            return [GraphQLQueryConstructor.anime_get_main_search(search=query, limit=limit, profile=profile)]
         elif media_type == 'Manga':
-            return self.search_manga_by_ids(ids)
-        else:
-            return self.search_both_by_ids(ids)
+            return [GraphQLQueryConstructor.manga_get_main_search(search=query, limit=limit, profile=profile)]
+        # Both: two independent searches, each one for half of limit
+        half_limit = (limit + 1) // 2
+        return [GraphQLQueryConstructor.anime_get_main_search(search=query, limit=half_limit, profile=profile),
+                GraphQLQueryConstructor.manga_get_main_search(search=query, limit=half_limit, profile=profile)]
     
-    def search_anime_by_query(self, query: str, limit: int) -> t.Optional[list[AnimeEntry]]:
-        data = self.get_data(GraphQLQueryConstructor.anime_get_main_search(search=query, limit=limit))
-        return data
+    async def get_raw_search(self, query: str, limit: int, media_type: MEDIA_TYPE,
+                             profile: PROFILE_TYPE = "detail") -> dict:
+        return self.merge_raw_data(*await self.get_raw_batch(self.search_queries(query, limit, media_type, profile)))
     
-    def search_manga_by_query(self, query: str, limit: int) -> t.Optional[list[MangaEntry]]:
-        data = self.get_data(GraphQLQueryConstructor.manga_get_main_search(search=query, limit=limit))
+    def store_search(self, query: str, media_type: MEDIA_TYPE, limit: int, variant: str, raw_data: dict) -> dict:
+        """Parse fetched search, remember its entries and cache it"""
+        if raw_data.get("errors"):
+            logger.warning("Got errors while searching %r: %s", query, raw_data["errors"])
+        data = self.parse_data(raw_data)
+        self.remember(data)
+        if not raw_data.get("errors"):
+            if self.cache is not None:
+                # Entries themselves are in entity cache, query cache needs only their ids
+                payload = {"ids": {k: [x.id_ for x in v] for k, v in data.items()}} if self.entities is not None else raw_data
+                self.cache.set(query, media_type, limit, payload, variant)
+            if self.refiner is not None:
+                self.refiner.remember(query, media_type, limit, data, variant)
         return data
     
-    def search_both_by_query(self, query: str, limit: int) -> t.Optional[list[AnimeEntry | MangaEntry]]:
-        data = self.get_data(GraphQLQueryConstructor.both_get_main_search(search=query, limit=limit))
+    async def search_many_by_query(self, queries: t.Sequence[str], limit: int, media_type: MEDIA_TYPE,
+                                   profile: PROFILE_TYPE = "detail") -> list[dict[str, list[AnimeEntry | MangaEntry]]]:
+        """Several searches at once: cached ones are answered locally, the rest are fetched in one batched request"""
+        results = [self.get_cached_search(x, media_type, limit, profile) for x in queries]
+        missing = [index for index, data in enumerate(results) if data is None]
+        if not missing:
+            return results
+        parts = [self.search_queries(queries[x], limit, media_type, profile) for x in missing]
+        raw_parts = iter(await self.get_raw_batch([x for part in parts for x in part]))
+        for index, part in zip(missing, parts):
+            raw_data = self.merge_raw_data(*(next(raw_parts) for _ in part))
+            results[index] = self.store_search(queries[index], media_type, limit, profile, raw_data)
+        return results
+    
+    async def search_by_query(self, query: str, limit: int, media_type: MEDIA_TYPE,
+                              profile: PROFILE_TYPE = "detail") -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        with stats.span("cache"):
+            data = self.get_cached_search(query, media_type, limit, profile)
+        stats.set_cache_hit(data is not None)
+        if data is not None:
+            return data
+        if self.refiner is not None:
+            with stats.span("refine"):
+                data = self.refiner.refine(query, media_type, limit, profile)
+            if data is not None:
+                return data
+        raw_data = await self.get_raw_search(query, limit, media_type, profile)
+        return self.store_search(query, media_type, limit, profile, raw_data)
+    
+    def get_cached_search(self, query: str, media_type: MEDIA_TYPE, limit: int,
+                          variant: str) -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        payload = self.cache.get(query, media_type, limit, variant) if self.cache is not None else None
+        if payload is None:
+            return None
+        if "ids" not in payload:  # Whole payload, stored without entity cache
+            return self.parse_data(payload)
+        if self.entities is None:
+            return None
+        data = dict()
+        for key, ids in payload["ids"].items():
+            found, missing = self.entities.get_many(key[:-1], ids)
+            if missing:  # Evicted from entity cache, ask server again
+                return None
+            data[key] = [found[x] for x in ids]
         return data
     
+    async def iter_by_ids(self, ids: t.Iterable[int], media_type: MEDIA_TYPE) -> t.AsyncIterator[dict[str, list[AnimeEntry | MangaEntry]]]:
+        """Detailed entries by ids, yielded in batches as soon as they are known: cached ones at once,
+        then every fetched request of `IDS_BATCH` aliased chunks as it completes.
+        
+        Only ids missing from entity cache (or stale) are fetched, and only for types they may be of.
+        Chunks answered with errors are neither remembered nor marked absent, GraphQLError is raised for them
+        after all other batches are yielded"""
+        ids = list(dict.fromkeys(int(x) for x in ids))
+        types = ("Anime", "Manga") if media_type == "Both" else (media_type, )
+        cached, chunks = dict(), list()
+        for x in types:
+            if self.entities is not None:
+                known, missing = self.entities.get_many(x, ids, detailed=True)
+                absent = self.entities.absent(x, missing) if media_type == "Both" else set()
+                missing = [id_ for id_ in missing if id_ not in absent]
+            else:
+                known, missing = dict(), ids
+            cached[x.lower() + "s"] = [known[id_] for id_ in ids if id_ in known]
+            chunks += [(x, missing[i:i + self.IDS_CHUNK]) for i in range(0, len(missing), self.IDS_CHUNK)]
+        if any(cached.values()):
+            yield cached
+        if not chunks:
+            return
+        
+        queries = {"Anime": GraphQLQueryConstructor.anime_get_main_by_ids,
+                   "Manga": GraphQLQueryConstructor.manga_get_main_by_ids}
+        semaphore = asyncio.Semaphore(self.IDS_CONCURRENCY)  # Rate limiter paces them further
+        
+        async def fetch(group: list[tuple[str, list[int]]]):
+            async with semaphore:
+                raw = await self.get_raw_batch([queries[chunk_type](chunk) for chunk_type, chunk in group])
+            return group, raw
+        
+        groups = [chunks[i:i + self.IDS_BATCH] for i in range(0, len(chunks), self.IDS_BATCH)]
+        tasks = [asyncio.ensure_future(fetch(x)) for x in groups]
+        errors = list()
+        try:
+            for future in asyncio.as_completed(tasks):
+                group, raw_parts = await future
+                batch = dict()
+                for (chunk_type, chunk), raw in zip(group, raw_parts):
+                    key = chunk_type.lower() + "s"
+                    if not self.is_answered(raw, key):
+                        # Missing entries may exist, and present ones may be cut, so nothing is learned from it
+                        chunk_errors = raw.get("errors") or [{"message": f"No {key} in response"}]
+                        logger.warning("Got errors for %d %s ids from %d: %s", len(chunk), key, chunk[0], chunk_errors)
+                        errors += chunk_errors
+                        continue
+                    data = self.parse_data(raw)
+                    by_id = {entry.id_: entry for entry in data.get(key) or ()}
+                    self.remember(data)
+                    if self.entities is not None:
+                        self.entities.mark_absent(chunk_type, [id_ for id_ in chunk if id_ not in by_id])
+                    batch.setdefault(key, list()).extend(by_id[id_] for id_ in chunk if id_ in by_id)
+                yield batch
+        finally:
+            for task in tasks:
+                task.cancel()
+        if errors:
+            raise GraphQLError(errors)
+    
+    async def search_by_ids(self, ids: t.Iterable[int], media_type: MEDIA_TYPE) -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        """Detailed entries in order of `ids`, see `iter_by_ids`. GraphQLError carries entries found before it"""
+        ids = [int(x) for x in ids]
+        found = {x: dict() for x in (("animes", "mangas") if media_type == "Both" else (media_type.lower() + "s", ))}
+        try:
+            async for batch in self.iter_by_ids(ids, media_type):
+                for key, entries in batch.items():
+                    found[key].update((entry.id_, entry) for entry in entries)
+        except GraphQLError as e:
+            e.data = {key: [by_id[id_] for id_ in ids if id_ in by_id] for key, by_id in found.items()}
+            raise
+        return {key: [by_id[id_] for id_ in ids if id_ in by_id] for key, by_id in found.items()}
+    
+    async def resolve_handle(self, handle: dict) -> t.Optional[MediaEntryFromGraph]:
+        """Get detailed entry for result's ContextData handle, from entity cache if possible"""
+        entry = self.entities.resolve_handle(handle) if self.entities is not None else None
+        if entry is not None:
+            return await self.hydrate(entry)
+        data = await self.search_by_ids((int(handle["id"]), ), handle["type_"].capitalize())
+        entries = data.get(handle["type_"].lower() + "s") if data else None
+        return entries[0] if entries else None
+    
+    async def hydrate(self, entry: MediaEntryFromGraph) -> MediaEntryFromGraph:
+        """Fill fields missing from lean (list profile) entry with detail profile fetched by ID"""
+        if entry.has_details:
+            return entry
+        data = await self.search_by_ids((entry.id_, ), entry.type_)
+        entries = data.get(entry.type_.lower() + "s") if data else None
+        if entries:
+            entry.hydrate(entries[0])
+            self.remember({entry.type_.lower() + "s": [entry]})
+        return entry
+    
+    async def search_anime_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[AnimeEntry]]]:
+        return self.parse_data(await self.get_raw_search(query, limit, 'Anime'))
+    
+    async def search_manga_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[MangaEntry]]]:
+        return self.parse_data(await self.get_raw_search(query, limit, 'Manga'))
+    
+    async def search_both_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        return self.parse_data(await self.get_raw_search(query, limit, 'Both'))
+    
+    async def search_anime_by_ids(self, ids: t.Iterable[int]):
+        return await self.get_data(GraphQLQueryConstructor.anime_get_main_by_ids(ids))
+    
+    async def search_manga_by_ids(self, ids: t.Iterable[int]):
+        return await self.get_data(GraphQLQueryConstructor.manga_get_main_by_ids(ids))
+    
+    async def search_both_by_ids(self, ids: t.Iterable[int]):
+        return await self.search_by_ids(ids, "Both")
+
+
+class SearchQLClient:
+    """Synchronous API over AsyncSearchQLClient, coroutines are run on private event loop thread"""
+    def __init__(self, app_name: str, cache: t.Optional[QueryCache] = None, entities: t.Optional[EntityCache] = None,
+                 rate_limiter: t.Optional[RateLimiter] = None, refiner: t.Optional[PrefixRefiner] = None):
+        self.async_client = AsyncSearchQLClient(app_name=app_name, cache=cache, entities=entities,
+                                                rate_limiter=rate_limiter, refiner=refiner)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="search-loop", daemon=True)
+        self._thread.start()
+    
+    def _run(self, coro: t.Coroutine):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+    
+    @property
+    def cache(self) -> t.Optional[QueryCache]:
+        return self.async_client.cache
+    
+    def get_raw_data(self, query: str | PreparedQuery, variables: t.Optional[dict] = None):
+        return self._run(self.async_client.get_raw_data(query=query, variables=variables))
+    
+    def get_data(self, query: str | PreparedQuery, variables: t.Optional[dict] = None):
+        return self._run(self.async_client.get_data(query=query, variables=variables))
+    
+    def parse_data(self, data: dict):
+        return self.async_client.parse_data(data)
+    
+    def search_by_query(self, query: str, limit: int, media_type: MEDIA_TYPE,
+                        profile: PROFILE_TYPE = "detail") -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        return self._run(self.async_client.search_by_query(query=query, limit=limit, media_type=media_type,
+                                                           profile=profile))
+    
+    def search_many_by_query(self, queries: t.Sequence[str], limit: int, media_type: MEDIA_TYPE,
+                             profile: PROFILE_TYPE = "detail") -> list[dict[str, list[AnimeEntry | MangaEntry]]]:
+        return self._run(self.async_client.search_many_by_query(queries=queries, limit=limit, media_type=media_type,
+                                                                profile=profile))
+    
+    def search_by_ids(self, ids: t.Iterable[int], media_type: MEDIA_TYPE) -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        return self._run(self.async_client.search_by_ids(ids=ids, media_type=media_type))
+    
+    def iter_by_ids(self, ids: t.Iterable[int], media_type: MEDIA_TYPE) -> t.Iterator[dict[str, list[AnimeEntry | MangaEntry]]]:
+        batches = self.async_client.iter_by_ids(ids=ids, media_type=media_type)
+        try:
+            while True:
+                try:
+                    yield self._run(batches.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self._run(batches.aclose())
+    
+    def hydrate(self, entry: MediaEntryFromGraph) -> MediaEntryFromGraph:
+        return self._run(self.async_client.hydrate(entry))
+    
+    def resolve_handle(self, handle: dict) -> t.Optional[MediaEntryFromGraph]:
+        return self._run(self.async_client.resolve_handle(handle))
+    
+    def search_anime_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[AnimeEntry]]]:
+        return self._run(self.async_client.search_anime_by_query(query, limit))
+    
+    def search_manga_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[MangaEntry]]]:
+        return self._run(self.async_client.search_manga_by_query(query, limit))
+    
+    def search_both_by_query(self, query: str, limit: int) -> t.Optional[dict[str, list[AnimeEntry | MangaEntry]]]:
+        return self._run(self.async_client.search_both_by_query(query, limit))
+    
     def search_anime_by_ids(self, ids: t.Iterable[int]):
-        data = self.get_data(GraphQLQueryConstructor.anime_get_main_by_ids(ids))
-        return data
+        return self._run(self.async_client.search_anime_by_ids(ids))
     
     def search_manga_by_ids(self, ids: t.Iterable[int]):
-        data = self.get_data(GraphQLQueryConstructor.manga_get_main_by_ids(ids))
-        return data
+        return self._run(self.async_client.search_manga_by_ids(ids))
     
     def search_both_by_ids(self, ids: t.Iterable[int]):
-        data = self.get_data(GraphQLQueryConstructor.both_get_main_by_ids(ids))
-        return data
-    
\ No newline at end of file
+        return self._run(self.async_client.search_both_by_ids(ids))
+    
+    def close(self):
+        self._run(self.async_client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -16,7 +16,7 @@ def title_search(url: str, title: str):
 
 
 def search_syntax(url, title):
-    logger.debug(f"{url} ||| {title}")
+    logger.debug("%s ||| %s", url, title)
     match = re.search(r"{searchterm(?:\((?P<sym>.)\))?(?P<options>\[[^[\]]*\])?}", url)
     if not match:
         return url
@@ -0,0 +1,134 @@
+# Flow Launcher JSON-RPC v2: one resident process, newline-delimited JSON-RPC 2.0 over stdio
+
+import sys
+import json
+import asyncio
+import logging
+import threading
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+FLOW_API_PREFIX = "Flow.Launcher."
+
+
+class JsonRPCServer:
+    def __init__(self, plugin, on_initialize: t.Optional[t.Callable[[dict], None]] = None,
+                 on_settings: t.Optional[t.Callable[[dict], None]] = None):
+        self.plugin = plugin
+        self.on_initialize = on_initialize
+        self.on_settings = on_settings
+        
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: dict[t.Any, asyncio.Task] = dict()
+        self._pending: dict[str, asyncio.Future] = dict()
+        self._request_counter = 0
+        self._closed: t.Optional[asyncio.Event] = None
+    
+    def write(self, message: dict):
+        sys.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+    
+    def _reader(self):
+        # Blocking stdin reads stay off the event loop (and work with any loop on Windows)
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                self._loop.call_soon_threadsafe(self.dispatch, line)
+        self._loop.call_soon_threadsafe(self._closed.set)
+    
+    def dispatch(self, line: str):
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Got malformed message: {line}")
+            return
+        if "method" not in message:
+            # Response to our request to Flow
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+            return
+        if message["method"] == "$/cancelRequest":
+            task = self._tasks.get((message.get("params") or dict()).get("id"))
+            if task is not None:
+                task.cancel()
+            return
+        task = asyncio.ensure_future(self.handle(message))
+        if "id" in message:
+            self._tasks[message["id"]] = task
+            task.add_done_callback(lambda _: self._tasks.pop(message["id"], None))
+    
+    async def handle(self, message: dict):
+        request_id = message.get("id")
+        try:
+            result = await self.call(message["method"], message.get("params"))
+        except asyncio.CancelledError:
+            if request_id is not None:
+                self.write({"jsonrpc": "2.0", "id": request_id,
+                            "error": {"code": -32800, "message": "Request cancelled"}})
+            return
+        except Exception as e:
+            logger.exception(e)
+            if request_id is not None:
+                self.write({"jsonrpc": "2.0", "id": request_id,
+                            "error": {"code": -32603, "message": str(e)}})
+            return
+        if request_id is not None:
+            self.write({"jsonrpc": "2.0", "id": request_id, "result": result})
+    
+    async def call(self, method: str, params: t.Optional[list | dict]):
+        params = params if params is not None else list()
+        if method == "initialize":
+            context = params[0] if isinstance(params, list) and params else params
+            if self.on_initialize:
+                self.on_initialize(context or dict())
+            return dict()
+        if method == "close":
+            self._closed.set()
+            return None
+        if method.startswith(FLOW_API_PREFIX):
+            # Result actions are sent back to the plugin in v2, pass them on to Flow's public API
+            if len(params) == 1 and isinstance(params[0], list):
+                params = params[0]
+            await self.request(method[len(FLOW_API_PREFIX):], list(params))
+            return {"Hide": True}
+        if method == "query":
+            query, settings = (params + [None, None])[:2]
+            if settings and self.on_settings:
+                self.on_settings(settings)
+            params = [query.get("search", "") if isinstance(query, dict) else query]
+        if isinstance(params, dict):
+            return await self.plugin._event_handler.trigger_event(method, **params)
+        return await self.plugin._event_handler.trigger_event(method, *params)
+    
+    async def request(self, method: str, params: list):
+        self._request_counter += 1
+        request_id = f"shikiflow-{self._request_counter}"
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        self.write({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+        return await future
+    
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        threading.Thread(target=self._reader, name="stdin-reader", daemon=True).start()
+        logger.info("JSON-RPC v2 server started")
+        await self._closed.wait()
+        for task in tuple(self._tasks.values()):
+            task.cancel()
+        logger.info("JSON-RPC v2 server stopped")
+
+
+def serve():
+    from .plugin import plugin, update_settings, get_posters
+    from .supersession import supersession
+    supersession.keep_in_memory()
+    get_posters().enable_prefetch()
+    server = JsonRPCServer(plugin, on_settings=update_settings)
+    asyncio.run(server.serve())
@@ -1,4 +1,5 @@
 import os
+from urllib.parse import urlsplit
 
 from pyflowlauncher import JsonRPCAction
 
@@ -13,7 +14,8 @@ SETTINGS_TYPE = t.TypedDict('Settings', {
 	'default_media_type': t.Literal["Anime", "Manga", "Both"],
 	'preferable_name': t.Literal["Russian", "Licensed Russian", "English", "Japanese"],
 	'limit': str,
-	'language': t.Literal['Russian', 'English']
+	'language': t.Literal['Russian', 'English'],
+	'cache_ttl': str
 })
 
 FLOW_PROGRAM_DIRECTORY = os.environ.get("FLOW_PROGRAM_DIRECTORY")
@@ -37,3 +39,8 @@ PLUGIN_CACHE_FOLDER = os.path.join(PLUGIN_SETTINGS_DIRECTORY, "Cache") if PLUGIN
 
 FAVICON_FOLDER_ROOT = os.path.join(ROOT_PATH, "Favs")
 FAVICON_FOLDER_CUSTOM = os.path.join(PLUGIN_SETTINGS_DIRECTORY, "Favs") if PLUGIN_SETTINGS_DIRECTORY else None
+
+
+def url_host(url: str) -> str:
+    """Host part of url, same as httpx.URL(url).host but without importing httpx"""
+    return urlsplit(str(url)).hostname or ""
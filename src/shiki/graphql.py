@@ -1,47 +1,118 @@
 from datetime import date
+from enum import Enum
 import json
 import logging
 
-from .raw_shiki import BaseShikiClient
+import httpx
+
+from .raw_shiki import BaseShikiClient, AsyncBaseShikiClient, RateLimiter
 from .types import MediaEntry, AnimeEntry, MangaEntry, AnimeKindEnum, AnimeStatusEnum, MangaKindEnum, MangaStatusEnum
 
 import typing as t
 
 logger = logging.getLogger(__name__)
+payload_logger = logging.getLogger(__name__ + ".payload")  # Off unless enabled, responses can be huge
 
 
-class GraphQLShikiClient(BaseShikiClient):
-    def __init__(self, app_name: str):
-        # Seems like GraphQL does not need auth for now
-        BaseShikiClient.__init__(self, app_name=app_name)
-    
-    def get_raw_data(self, query: str, variables: t.Optional[dict] = None):
-        raw_resp = self.post(f"https://{self.DOMAIN}/api/graphql",
-                             data=dict(query=query, variables=variables if variables is not None else dict()))
-        raw_resp.raise_for_status()
-        resp = raw_resp.json()
-        return resp
+class GraphQLError(httpx.HTTPError):
+    """Server answered some operations with `errors`, `data` is what was answered by the rest"""
+    def __init__(self, errors: list[dict], data: t.Optional[dict] = None):
+        super().__init__("; ".join(str(x.get("message", x)) for x in errors))
+        self.errors = errors
+        self.data = data
+
+
+class GraphQLDataParser:
+    @staticmethod
+    def make_payload(query: t.Any, variables: t.Optional[dict] = None) -> dict:
+        if not isinstance(query, str):  # PreparedQuery-like: static document with its own variables
+            query, variables = query.query, {**query.variables, **(variables or dict())}
+        return dict(query=query, variables=variables if variables is not None else dict())
     
-    def get_data(self, query: str, variables: t.Optional[dict] = None):
-        data = self.get_raw_data(query=query, variables=variables)
-        logger.debug(json.dumps(data, ensure_ascii=False))
-        return self.parse_data(data)
+    @staticmethod
+    def is_answered(raw: dict, field: str) -> bool:
+        """Raw response of one operation has `field` list and no errors, so entries missing from it do not exist"""
+        return not raw.get("errors") and isinstance((raw.get("data") or dict()).get(field), list)
     
     @classmethod
     def parse_data(cls, data: dict):
         if "data" in data:
             data = data["data"]
         if "animes" in data:
-            data["animes"] = [AnimeEntryFromGraph(x) for x in data["animes"]]
+            data["animes"] = [AnimeRecord(x) for x in data["animes"]]
         if "mangas" in data:
-            data["mangas"] = [MangaEntryFromGraph(x) for x in data["mangas"]]
+            data["mangas"] = [MangaRecord(x) for x in data["mangas"]]
         return data
+    
+    @staticmethod
+    def split_batch(data: dict, aliases: t.Sequence[dict[str, str]]) -> list[dict]:
+        """Raw response of aliased batch (see GraphQLQueryConstructor.batch) as raw responses of every operation"""
+        nodes = data.get("data") or dict()
+        results = [{"data": {field: nodes[alias] for alias, field in x.items() if nodes.get(alias) is not None}}
+                   for x in aliases]
+        for error in data.get("errors") or ():
+            alias = (error.get("path") or [None])[0]
+            for result, operation_aliases in zip(results, aliases):
+                if alias is None or alias in operation_aliases:  # Error without path concerns everyone
+                    result.setdefault("errors", list()).append(error)
+        return results
+    
+    @classmethod
+    def parse_batch(cls, data: dict, aliases: t.Sequence[dict[str, str]]) -> list[dict]:
+        return [cls.parse_data(x) for x in cls.split_batch(data, aliases)]
+
+
+class GraphQLShikiClient(GraphQLDataParser, BaseShikiClient):
+    def __init__(self, app_name: str, rate_limiter: t.Optional[RateLimiter] = None):
+        # Seems like GraphQL does not need auth for now
+        BaseShikiClient.__init__(self, app_name=app_name, rate_limiter=rate_limiter)
+    
+    def get_raw_data(self, query: t.Any, variables: t.Optional[dict] = None):
+        raw_resp = self.post(self.api_url("/api/graphql"), json=self.make_payload(query, variables))
+        raw_resp.raise_for_status()
+        resp = raw_resp.json()
+        return resp
+    
+    def get_data(self, query: t.Any, variables: t.Optional[dict] = None):
+        data = self.get_raw_data(query=query, variables=variables)
+        if payload_logger.isEnabledFor(logging.DEBUG):
+            payload_logger.debug(json.dumps(data, ensure_ascii=False))
+        return self.parse_data(data)
+
+
+class AsyncGraphQLShikiClient(GraphQLDataParser, AsyncBaseShikiClient):
+    def __init__(self, app_name: str, rate_limiter: t.Optional[RateLimiter] = None):
+        AsyncBaseShikiClient.__init__(self, app_name=app_name, rate_limiter=rate_limiter)
+    
+    async def get_raw_data(self, query: t.Any, variables: t.Optional[dict] = None):
+        raw_resp = await self.post(self.api_url("/api/graphql"), json=self.make_payload(query, variables))
+        raw_resp.raise_for_status()
+        resp = raw_resp.json()
+        return resp
+    
+    async def get_data(self, query: t.Any, variables: t.Optional[dict] = None):
+        data = await self.get_raw_data(query=query, variables=variables)
+        if payload_logger.isEnabledFor(logging.DEBUG):
+            payload_logger.debug(json.dumps(data, ensure_ascii=False))
+        return self.parse_data(data)
 
 
 class MediaEntryFromGraph(MediaEntry):
+    # Fields only fetched with detail selection, entries from lean list selection lack them
+    DETAIL_FIELDS = ("malId", "name", "russian", "licenseNameRu", "english", "japanese", "synonyms",
+                     "licensors", "airedOn", "externalLinks")
+    
     def __init__(self, data: dict):
         self._data = data
     
+    @property
+    def has_details(self) -> bool:
+        return all(x in self._data for x in self.DETAIL_FIELDS)
+    
+    def hydrate(self, other: t.Union["MediaEntryFromGraph", dict]):
+        """Merge fields of `other` entry of the same ID into this one"""
+        merge_node(self._data, other._data if isinstance(other, MediaEntryFromGraph) else other)
+    
     def _try_value(self, name: str | tuple[str], convert: t.Optional[t.Callable] = None,
                    *, custom_data = None):
         data = self._data if custom_data is None else custom_data
@@ -134,9 +205,9 @@ class MediaEntryFromGraph(MediaEntry):
     @classmethod
     def from_raw_dict(cls, raw_dict):
         if raw_dict.get("type_") == "Anime":
-            obj = AnimeEntryFromGraph
+            obj = AnimeRecord
         elif raw_dict.get("type_") == "Manga":
-            obj = MangaEntryFromGraph
+            obj = MangaRecord
         else:
             obj = cls
         new = obj(data=raw_dict["_data"])
@@ -180,3 +251,105 @@ class MangaEntryFromGraph(MediaEntryFromGraph, MangaEntry):
     @property
     def volumes(self) -> t.Optional[int]:
         return self._try_value("volumes", int)
+
+
+def _or_none(value, convert: t.Optional[t.Callable] = None):
+    # Same semantics as MediaEntryFromGraph._try_value: falsy values are treated as missing
+    if not value:
+        return None
+    return convert(value) if convert is not None and not isinstance(value, convert) else value
+
+
+def _enum_or_none(enum_cls: type[Enum], value: t.Optional[str]):
+    return enum_cls._value2member_map_.get(value) if value else None
+
+
+def _date_or_none(value: t.Optional[dict]) -> t.Optional[date]:
+    if not value or not value.get("date"):
+        return None
+    try:
+        return date.fromisoformat(value["date"])
+    except ValueError:
+        return None
+
+
+class _MediaRecordMixin:
+    """Decodes GraphQL node once into instance attributes instead of looking it up on every property access.
+    
+    Costs about 10x of lazy entry to construct, pays off when fields are read repeatedly (results, cache, mirror)"""
+    # Plain class attributes shadow read-only properties of FromGraph classes, so decoded values can be assigned
+    id_ = mal_id = name = russian = license_name_ru = english = japanese = synonyms = licensors = None
+    is_censored = url = aired_on = description = description_source = external_links = icon_url = None
+    
+    def __init__(self, data: dict):
+        self._data = data
+        self.decode()
+    
+    def decode(self):
+        d = self._data
+        self.id_ = int(d["id"])
+        self.mal_id = _or_none(d.get("malId"), int)
+        self.name = d.get("name") or None
+        self.russian = d.get("russian") or None
+        self.license_name_ru = d.get("licenseNameRu") or None
+        self.english = d.get("english") or None
+        self.japanese = d.get("japanese") or None
+        self.synonyms = _or_none(d.get("synonyms"), tuple)
+        self.licensors = _or_none(d.get("licensors"), list)
+        self.is_censored = d.get("isCensored") or None
+        self.url = d["url"] if "url" in d else f"https://shikimori.one/{self.type_.lower()}s/{self.id_}"
+        self.aired_on = _date_or_none(d.get("airedOn"))
+        self.description = d.get("description") or None
+        self.description_source = d.get("descriptionSource") or None
+        self.external_links = {x["kind"]: x["url"] for x in d["externalLinks"]} if d.get("externalLinks") else None
+        poster = d.get("poster")
+        self.icon_url = (poster.get("previewUrl") or None) if poster else None
+    
+    def hydrate(self, other: t.Union["MediaEntryFromGraph", dict]):
+        MediaEntryFromGraph.hydrate(self, other)
+        self.decode()
+    
+    @property
+    def raw_dict(self):
+        # Raw node is already JSON-ready, nothing to convert
+        return {"_data": self._data, "type_": self.type_}
+
+
+class AnimeRecord(_MediaRecordMixin, AnimeEntryFromGraph):
+    kind = season = episodes = episodes_aired = status = None
+    
+    def decode(self):
+        _MediaRecordMixin.decode(self)
+        d = self._data
+        self.kind = _enum_or_none(AnimeKindEnum, d.get("kind"))
+        self.season = d.get("season") or None
+        self.episodes = _or_none(d.get("episodes"), int)
+        self.episodes_aired = _or_none(d.get("episodesAired"), int)
+        self.status = _enum_or_none(AnimeStatusEnum, d.get("status"))
+
+
+class MangaRecord(_MediaRecordMixin, MangaEntryFromGraph):
+    kind = status = chapters = volumes = None
+    
+    def decode(self):
+        _MediaRecordMixin.decode(self)
+        d = self._data
+        self.kind = _enum_or_none(MangaKindEnum, d.get("kind"))
+        self.status = _enum_or_none(MangaStatusEnum, d.get("status"))
+        self.chapters = _or_none(d.get("chapters"), int)
+        self.volumes = _or_none(d.get("volumes"), int)
+
+
+def merge_node(target: dict, other: dict) -> dict:
+    """Merge projection `other` of the same node into `target`, nested objects are merged too
+    (list selection's `poster { previewUrl }` must not drop `originalUrl` of detail one)"""
+    for key, value in other.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            target[key] = {**target[key], **value}
+        else:
+            target[key] = value
+    return target
+
+
+def decode_node(media_type: str, data: dict) -> AnimeRecord | MangaRecord:
+    return AnimeRecord(data) if media_type.capitalize() == "Anime" else MangaRecord(data)
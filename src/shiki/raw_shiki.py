@@ -1,4 +1,7 @@
 from datetime import datetime
+import os
+import time
+import asyncio
 
 import httpx
 
@@ -6,10 +9,39 @@ import typing as t
 import logging
 
 class BaseShikiClass:
-    DOMAIN = "shikimori.one"
+    # Overridable from environment, e.g. to point at local stand-in server (see benchmarks/standin.py)
+    DOMAIN = os.environ.get("SHK_DOMAIN", "shikimori.one")
+    SCHEME = os.environ.get("SHK_SCHEME", "https")
+    
+    @classmethod
+    def api_url(cls, path: str) -> str:
+        return f"{cls.SCHEME}://{cls.DOMAIN}{path}"
+
+
+class RequestDropped(httpx.HTTPError):
+    """Request was not sent, because it would wait for rate limit longer than allowed"""
+
+
+class RateLimiter(t.Protocol):
+    def reserve(self) -> float:
+        """Take slot for one request, returns seconds to wait before sending. Raises RequestDropped"""
+    
+    def penalize(self, retry_after: float):
+        """Server answered 429, nobody should send anything for `retry_after` seconds"""
+    
+    @property
+    def max_wait(self) -> float:
+        ...
+
 
+def get_retry_after(response: httpx.Response, default: float = 1.0) -> float:
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", default)))
+    except ValueError:  # HTTP-date form is not used by Shikimori
+        return default
 
-class ShikimoriAuthorizationCode(httpx.Auth):
+
+class ShikimoriAuthorizationCode(BaseShikiClass, httpx.Auth):
     FORCE_APP_NAME: bool = True
     
     def __init__(self, client_id: str, client_secret: str,
@@ -44,7 +76,7 @@ class ShikimoriAuthorizationCode(httpx.Auth):
         elif not scope:
             scope = ""
         
-        return httpx.URL(f"https://{self.DOMAIN}/oauth/authorize").copy_merge_params(dict(
+        return httpx.URL(self.api_url("/oauth/authorize")).copy_merge_params(dict(
             client_id=self.client_id,
             redirect_uri=self.redirect_uri,
             response_type="code",
@@ -53,7 +85,7 @@ class ShikimoriAuthorizationCode(httpx.Auth):
     
     def get_new_access_token(self, auth_code: str):
         with httpx.Client(headers={"User-Agent": self.app_name}) as client:  # XXX: move getting client to separate function
-            raw_resp = client.post(f"https://{self.DOMAIN}/oauth/token",
+            raw_resp = client.post(self.api_url("/oauth/token"),
                                data=dict(
                                    grant_type="authorization_code",
                                    client_id=self.client_id,
@@ -70,7 +102,7 @@ class ShikimoriAuthorizationCode(httpx.Auth):
     
     def refresh_access_token(self):
         with httpx.Client(headers={"User-Agent": self.app_name}) as client:
-            raw_resp = client.post(f"https://{self.DOMAIN}/oauth/token",
+            raw_resp = client.post(self.api_url("/oauth/token"),
                                    data=dict(
                                        grant_type="refresh_token",
                                        client_id=self.client_id,
@@ -92,19 +124,27 @@ class BaseShikiClient(BaseShikiClass, httpx.Client):
                  *,
                  client_id: t.Optional[str] = None, client_secret: t.Optional[str] = None,
                  access_token: t.Optional[str] = None, refresh_token: t.Optional[str] = None,
-                 redirect_uri: t.Optional[str] = None):
+                 redirect_uri: t.Optional[str] = None, rate_limiter: t.Optional[RateLimiter] = None):
         self.app_name = app_name
+        self.rate_limiter = rate_limiter
+        
+        auth = self.make_auth(app_name=app_name, client_id=client_id, client_secret=client_secret,
+                              access_token=access_token, refresh_token=refresh_token, redirect_uri=redirect_uri)
         
+        httpx.Client.__init__(self, auth=auth, headers={"User-Agent": self.app_name})
+    
+    @staticmethod
+    def make_auth(app_name: str,
+                  client_id: t.Optional[str] = None, client_secret: t.Optional[str] = None,
+                  access_token: t.Optional[str] = None, refresh_token: t.Optional[str] = None,
+                  redirect_uri: t.Optional[str] = None) -> t.Optional[ShikimoriAuthorizationCode]:
         if client_id is not None and client_secret is not None:
-            auth = ShikimoriAuthorizationCode(client_id=client_id, client_secret=client_secret,
+            return ShikimoriAuthorizationCode(client_id=client_id, client_secret=client_secret,
                                               app_name=app_name,
                                               access_token=access_token, refresh_token=refresh_token,
                                               redirect_uri=redirect_uri)
-        else:
-            auth = None
-        
-        httpx.Client.__init__(self, auth=auth, headers={"User-Agent": self.app_name})
-
+        return None
+    
     @property
     def auth(self) -> t.Optional[ShikimoriAuthorizationCode]:
         return self._auth
@@ -112,3 +152,54 @@ class BaseShikiClient(BaseShikiClass, httpx.Client):
     def get_auth_grant_url(scope: t.Optional[t.Union[str, tuple, list]] = None) -> t.Optional[httpx.URL]:
         if self._auth:
             return self._auth.get_auth_grant_url(scope)
+    
+    def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if self.rate_limiter is None:
+            return httpx.Client.send(self, request, **kwargs)
+        time.sleep(self.rate_limiter.reserve())
+        response = httpx.Client.send(self, request, **kwargs)
+        if response.status_code == 429:
+            # Whole bucket backs off, then this request gets one more try if it fits into allowed wait
+            retry_after = get_retry_after(response)
+            self.rate_limiter.penalize(retry_after)
+            if retry_after <= self.rate_limiter.max_wait:
+                response.close()
+                time.sleep(self.rate_limiter.reserve())
+                response = httpx.Client.send(self, request, **kwargs)
+        return response
+
+
+class AsyncBaseShikiClient(BaseShikiClass, httpx.AsyncClient):
+    _auth: t.Optional[ShikimoriAuthorizationCode]
+    
+    def __init__(self, app_name: str,
+                 *,
+                 client_id: t.Optional[str] = None, client_secret: t.Optional[str] = None,
+                 access_token: t.Optional[str] = None, refresh_token: t.Optional[str] = None,
+                 redirect_uri: t.Optional[str] = None, rate_limiter: t.Optional[RateLimiter] = None):
+        self.app_name = app_name
+        self.rate_limiter = rate_limiter
+        
+        auth = BaseShikiClient.make_auth(app_name=app_name, client_id=client_id, client_secret=client_secret,
+                                         access_token=access_token, refresh_token=refresh_token, redirect_uri=redirect_uri)
+        
+        httpx.AsyncClient.__init__(self, auth=auth, headers={"User-Agent": self.app_name})
+    
+    @property
+    def auth(self) -> t.Optional[ShikimoriAuthorizationCode]:
+        return self._auth
+    
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        if self.rate_limiter is None:
+            return await httpx.AsyncClient.send(self, request, **kwargs)
+        # Shared limiter takes file lock, which must not block event loop
+        await asyncio.sleep(await asyncio.to_thread(self.rate_limiter.reserve))
+        response = await httpx.AsyncClient.send(self, request, **kwargs)
+        if response.status_code == 429:
+            retry_after = get_retry_after(response)
+            await asyncio.to_thread(self.rate_limiter.penalize, retry_after)
+            if retry_after <= self.rate_limiter.max_wait:
+                await response.aclose()
+                await asyncio.sleep(await asyncio.to_thread(self.rate_limiter.reserve))
+                response = await httpx.AsyncClient.send(self, request, **kwargs)
+        return response
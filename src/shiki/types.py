@@ -36,6 +36,7 @@ class MediaEntry:
     type_: str = "none"
     
     def get_names_tuple(self) -> tuple:
+        res = list()
         for x in (self.name, self.russian, self.license_name_ru,
                   self.english, self.japanese):
             if x is not None:
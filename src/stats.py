@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import contextvars
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .osettings import osettings
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "stats.jsonl") if PLUGIN_CACHE_FOLDER else None
+
+# Pipeline stages in order they happen, used for ordering s:stats menu
+STAGES = ("tags", "debounce", "cache", "refine", "http", "json", "parse", "offline", "results", "send", "total")
+
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("record", "stage", "start")
+    
+    def __init__(self, record: dict, stage: str):
+        self.record = record
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        stages = self.record["stages"]
+        stages[self.stage] = stages.get(self.stage, 0.0) + (time.perf_counter() - self.start) * 1000
+        return False
+
+
+class QueryStats:
+    """Timing spans of query pipeline stages, written as JSON lines and summarized over rolling window.
+    
+    Every call is a no-op when disabled or outside of `begin`/`finish`"""
+    WINDOW = 200
+    MAX_FILE_SIZE = 256 * 1024
+    
+    def __init__(self, path: t.Optional[str] = STATS_FILE, enabled: bool = False):
+        self.path = path
+        self.enabled = enabled
+        # Per query record, shared with tasks spawned by it (asyncio.gather copies context)
+        self._record: contextvars.ContextVar[t.Optional[dict]] = contextvars.ContextVar("query_stats_record", default=None)
+    
+    def begin(self, method: str):
+        if not self.enabled:
+            return
+        self._record.set({"ts": time.time(), "method": method, "stages": dict(), "bytes": 0,
+                          "cache_hit": None, "superseded": False, "_start": time.perf_counter()})
+    
+    def span(self, stage: str) -> _Span | _NullSpan:
+        if not self.enabled:
+            return _NULL_SPAN
+        record = self._record.get()
+        return _Span(record, stage) if record is not None else _NULL_SPAN
+    
+    def add_bytes(self, count: int):
+        record = self._record.get() if self.enabled else None
+        if record is not None:
+            record["bytes"] += count
+    
+    def set_cache_hit(self, hit: bool):
+        record = self._record.get() if self.enabled else None
+        if record is not None:
+            record["cache_hit"] = hit
+    
+    def set_superseded(self):
+        record = self._record.get() if self.enabled else None
+        if record is not None:
+            record["superseded"] = True
+    
+    def finish(self):
+        record = self._record.get() if self.enabled else None
+        if record is None:
+            return
+        self._record.set(None)
+        record["stages"]["total"] = (time.perf_counter() - record.pop("_start")) * 1000
+        line = json.dumps(record, ensure_ascii=False)
+        logger.debug(f"Query stats: {line}")
+        if self.path is None:
+            return
+        try:
+            with open(self.path, mode="a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            if os.path.getsize(self.path) > self.MAX_FILE_SIZE:
+                self._truncate()
+        except OSError as e:
+            logger.warning(f"Got exc {e} while writing query stats")
+    
+    def _truncate(self):
+        lines = self._read_lines()[-self.WINDOW:]
+        with open(self.path, mode="w", encoding="utf-8") as f:
+            f.writelines(x + "\n" for x in lines)
+    
+    def _read_lines(self) -> list[str]:
+        if self.path is None or not os.path.exists(self.path):
+            return list()
+        with open(self.path, mode="r", encoding="utf-8") as f:
+            return [x.strip() for x in f if x.strip()]
+    
+    def load(self) -> list[dict]:
+        records = list()
+        for line in self._read_lines()[-self.WINDOW:]:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return records
+    
+    @staticmethod
+    def percentile(values: list[float], q: float) -> float:
+        # Nearest-rank, values must be sorted
+        return values[max(0, min(len(values) - 1, int(round(q * len(values) + 0.5)) - 1))]
+    
+    def summary(self) -> dict:
+        """p50/p95 per stage in ms, cache hit and superseded ratios and mean response size over rolling window"""
+        records = self.load()
+        stages = dict()
+        for record in records:
+            for stage, ms in record.get("stages", dict()).items():
+                stages.setdefault(stage, list()).append(ms)
+        result = {"count": len(records), "stages": dict()}
+        for stage in sorted(stages, key=lambda x: STAGES.index(x) if x in STAGES else len(STAGES)):
+            values = sorted(stages[stage])
+            result["stages"][stage] = (self.percentile(values, 0.5), self.percentile(values, 0.95), len(values))
+        cache_flags = [x["cache_hit"] for x in records if x.get("cache_hit") is not None]
+        result["cache_hit_ratio"] = sum(cache_flags) / len(cache_flags) if cache_flags else None
+        result["superseded_ratio"] = sum(1 for x in records if x.get("superseded")) / len(records) if records else None
+        sizes = [x["bytes"] for x in records if x.get("bytes")]
+        result["mean_bytes"] = sum(sizes) / len(sizes) if sizes else None
+        return result
+    
+    def clear(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+stats = QueryStats(enabled=osettings.stats_enabled)
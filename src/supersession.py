@@ -0,0 +1,192 @@
+# Typing "naruto" fires queries for every prefix, only the last one matters. Every network query claims
+# generation, shared by plugin processes through small file (or kept in memory of resident v2 process),
+# and is abandoned once newer one is claimed
+
+import os
+import json
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import nullcontext
+
+from .shared import PLUGIN_CACHE_FOLDER
+from .file_lock import FileLock
+from .stats import stats
+
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+SUPERSESSION_FILE = os.path.join(PLUGIN_CACHE_FOLDER, "supersession.json") if PLUGIN_CACHE_FOLDER else None
+
+# Turn whose `run` spawned current task, tasks copy context on creation
+_active_turn: contextvars.ContextVar[t.Optional["Turn"]] = contextvars.ContextVar("supersession_turn", default=None)
+
+
+class Superseded(Exception):
+    """Newer query was claimed while this one was waiting or in flight"""
+
+
+class Turn:
+    """One claimed query: awaits network coroutines and cancels them when superseded"""
+    def __init__(self, owner: "Supersession", generation: int):
+        self.owner = owner
+        self.generation = generation
+        self.started = time.monotonic()
+        self.superseded = False
+        self.networked = False  # Only answers from network tell how fast it is, not cache or refiner hits
+        self._tasks: set[asyncio.Task] = set()
+    
+    def supersede(self):
+        self.superseded = True
+        for task in self._tasks:
+            task.cancel()
+    
+    def check(self):
+        if self.superseded or self.owner.current() != self.generation:
+            self.supersede()
+            raise Superseded(f"Query {self.generation} is superseded")
+    
+    async def _watch(self):
+        # Other processes can not cancel our tasks, so their claims are polled
+        while not self.superseded:
+            await asyncio.sleep(self.owner.POLL_INTERVAL)
+            if self.owner.current() != self.generation:
+                self.supersede()
+    
+    async def run(self, coro: t.Awaitable):
+        """Await `coro`, raises Superseded (and cancels it) as soon as newer query is claimed"""
+        if self.superseded:
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise Superseded(f"Query {self.generation} is superseded")
+        token = _active_turn.set(self)
+        try:
+            task = asyncio.ensure_future(coro)
+        finally:
+            _active_turn.reset(token)
+        self._tasks.add(task)
+        watcher = asyncio.ensure_future(self._watch()) if self.owner.path else None
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if self.superseded and task.cancelled():
+                raise Superseded(f"Query {self.generation} is superseded") from None
+            raise
+        finally:
+            self._tasks.discard(task)
+            if watcher is not None:
+                watcher.cancel()
+    
+    def finish(self):
+        self.owner.release(self)
+
+
+class Supersession:
+    """Generation counter with adaptive debounce.
+    
+    Queries arriving faster than the network answers are held back for a bit more than typing interval,
+    so intermediate prefixes are skipped without sending anything"""
+    POLL_INTERVAL = 0.05
+    MAX_DEBOUNCE = 0.3
+    IDLE = 1.0  # Pause after which next query starts new typing burst and is not debounced
+    SMOOTHING = 0.3
+    
+    def __init__(self, path: t.Optional[str] = SUPERSESSION_FILE):
+        self.path = path
+        self.lock_file = FileLock(path, timeout=1.0) if path else None
+        self._state = {"generation": 0, "last": 0.0, "interval": None, "latency": None}
+        self._turns: list[Turn] = list()
+    
+    def keep_in_memory(self):
+        """Resident process sees every query itself: no file to poll and no lock to block event loop on"""
+        self._state = self._load()
+        self.path = None
+        self.lock_file = None
+    
+    def _load(self) -> dict:
+        if self.path is None:
+            return self._state
+        try:
+            with open(self.path, mode="r", encoding="utf-8") as f:
+                return {**self._state, **json.load(f)}
+        except (OSError, json.JSONDecodeError):
+            return self._state
+    
+    def _save(self, state: dict):
+        self._state = state
+        if self.path is None:
+            return
+        try:
+            # Readers poll without lock, so file is replaced at once instead of being rewritten
+            with open(self.path + ".tmp", mode="w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logger.warning("Got exc %s while writing supersession state", e)
+    
+    def _update(self, func: t.Callable[[dict], t.Any]) -> t.Any:
+        with self.lock_file.held() if self.lock_file else nullcontext():
+            state = self._load()
+            result = func(state)
+            self._save(state)
+            return result
+    
+    def current(self) -> int:
+        return self._load()["generation"]
+    
+    def _smooth(self, old: t.Optional[float], new: float) -> float:
+        return new if old is None else old + (new - old) * self.SMOOTHING
+    
+    def _claim(self, state: dict) -> tuple[int, float]:
+        now = time.time()
+        interval = now - state["last"]
+        state["generation"] += 1
+        state["last"] = now
+        if interval >= self.IDLE:
+            return state["generation"], 0.0
+        state["interval"] = self._smooth(state["interval"], interval)
+        if state["latency"] is None or state["interval"] >= state["latency"]:
+            return state["generation"], 0.0
+        return state["generation"], min(self.MAX_DEBOUNCE, state["interval"] * 1.5)
+    
+    def claim(self) -> tuple[Turn, float]:
+        """New turn, superseding all previous ones, and how long it should be debounced"""
+        generation, debounce = self._update(self._claim)
+        for turn in self._turns:
+            turn.supersede()
+        turn = Turn(self, generation)
+        self._turns = [turn]
+        return turn, debounce
+    
+    async def begin(self, debounce: bool = True) -> Turn:
+        turn, delay = self.claim()
+        if debounce and delay > 0:
+            with stats.span("debounce"):
+                await asyncio.sleep(delay)
+            turn.check()
+            turn.started = time.monotonic()
+        return turn
+    
+    def _record_latency(self, state: dict, latency: float):
+        state["latency"] = self._smooth(state["latency"], latency)
+    
+    def release(self, turn: Turn):
+        """Completed turns that went to network teach debounce how fast it answers"""
+        if turn in self._turns:
+            self._turns.remove(turn)
+        if not turn.networked:
+            return
+        latency = time.monotonic() - turn.started
+        self._update(lambda state: self._record_latency(state, latency))
+
+
+def note_network():
+    """Called by client sending request: turn it runs in learns network latency"""
+    turn = _active_turn.get()
+    if turn is not None:
+        turn.networked = True
+
+
+supersession = Supersession()
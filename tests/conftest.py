@@ -0,0 +1,5 @@
+# src reads Flow's environment on import, point it to throwaway data directory as benchmarks do
+
+from benchmarks._bootstrap import setup_environment
+
+setup_environment()
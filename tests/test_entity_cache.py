@@ -0,0 +1,18 @@
+import pytest
+
+from benchmarks._bootstrap import make_node
+from src.entity_cache import EntityCache
+from src.shiki.graphql import decode_node
+
+
+def test_failed_batch_is_rolled_back():
+    cache = EntityCache(path=None)
+    broken = decode_node("Anime", make_node(2))
+    broken._data["name"] = object()  # Not serializable
+    with pytest.raises(TypeError):
+        cache.put_many({"animes": [decode_node("Anime", make_node(1)), broken]})
+    assert len(cache) == 0
+    assert cache.get("Anime", 1) is None
+    
+    cache.put_many({"animes": [decode_node("Anime", make_node(1))]})
+    assert cache.get("Anime", 1).id_ == 1
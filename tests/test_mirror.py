@@ -0,0 +1,60 @@
+import pytest
+
+from benchmarks._bootstrap import make_node
+from src.mirror import CatalogMirror
+from src.shiki.graphql import GraphQLError
+
+
+class PageClient:
+    """Answers every page request with the same raw response"""
+    def __init__(self, response: dict):
+        self.response = response
+    
+    def get_raw_data(self, query, variables=None):
+        return self.response
+
+
+def make_mirror() -> CatalogMirror:
+    mirror = CatalogMirror(path=None)
+    mirror.PAGE_DELAY = 0
+    return mirror
+
+
+@pytest.mark.parametrize("response", [
+    {"data": None, "errors": [{"message": "Internal error"}]},
+    {"data": {"animes": [make_node(1)]}, "errors": [{"message": "Field error", "path": ["animes", 0, "poster"]}]},
+    {"data": {"animes": None}},
+])
+def test_failed_page_stops_download(response):
+    mirror = make_mirror()
+    with pytest.raises(GraphQLError):
+        mirror.download(PageClient(response), "Anime")
+    assert mirror.max_id("Anime") == 0
+
+
+def test_download():
+    mirror = make_mirror()
+    mirror.download(PageClient({"data": {"animes": [make_node(1), make_node(2)]}}), "Anime")
+    assert mirror.max_id("Anime") == 2
+
+
+class OperationClient:
+    """Answers each request with nodes for its operation name"""
+    def __init__(self, nodes: dict[str, list[dict]]):
+        self.nodes = nodes
+        self.ids = []
+    
+    def get_raw_data(self, query, variables=None):
+        if query.document.name.endswith("ByIds"):
+            self.ids.append(query.variables["ids"])
+        return {"data": {"animes": self.nodes[query.document.name]}}
+
+
+def test_refresh_refetches_stored_ongoing():
+    mirror = make_mirror()
+    mirror.upsert("Anime", [make_node(1) | {"status": "ongoing"}, make_node(2)])
+    client = OperationClient({"AnimePage": [], "AnimeByIds": [make_node(1)]})
+    mirror.refresh(client, "Anime")
+    assert client.ids == ["1"]
+    assert mirror.changing_ids("Anime") == []
+    assert not mirror.is_refreshing
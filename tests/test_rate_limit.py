@@ -0,0 +1,30 @@
+import os
+import asyncio
+
+import pytest
+
+from src.file_lock import FileLock
+from src.rate_limit import SharedRateLimiter
+
+
+def open_descriptors() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="Needs /proc to count descriptors")
+def test_reserve_from_many_threads(tmp_path):
+    path = str(tmp_path / "rate_limit.json")
+    limiter = SharedRateLimiter(path=path, max_wait=1000.0, buckets={"rps": (1000, 1000.0)})
+    before = open_descriptors()
+    
+    async def run():
+        return await asyncio.gather(*(asyncio.to_thread(limiter.reserve) for _ in range(200)),
+                                    return_exceptions=True)
+    
+    results = asyncio.run(run())
+    assert [x for x in results if isinstance(x, BaseException)] == list()
+    assert open_descriptors() == before
+    lock = FileLock(path, timeout=0.0)
+    fd = lock.acquire()
+    assert fd is not None
+    lock.release(fd)
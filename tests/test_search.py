@@ -0,0 +1,69 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks._bootstrap import make_node
+from src.entity_cache import EntityCache
+from src.search import AsyncSearchQLClient
+from src.shiki.graphql import GraphQLError
+
+
+def make_client(responses: list[dict]) -> tuple[AsyncSearchQLClient, list[dict]]:
+    """Client answering requests with `responses` in order, sent payloads are collected to returned list"""
+    sent = list()
+    
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, json=responses.pop(0))
+    
+    client = AsyncSearchQLClient("ShikiFlow", entities=EntityCache(path=None))
+    client._transport = httpx.MockTransport(handler)
+    return client, sent
+
+
+def search_by_ids(client: AsyncSearchQLClient, ids: list[int]):
+    async def run():
+        return await client.search_by_ids(ids, "Both")
+    return asyncio.run(run())
+
+
+def test_failed_operation_does_not_mark_absent():
+    client, sent = make_client([
+        {"data": {"o0_animes": None, "o1_mangas": []}, "errors": [{"message": "boom", "path": ["o0_animes"]}]},
+        {"data": {"animes": [make_node(5)]}},
+    ])
+    with pytest.raises(GraphQLError) as e:
+        search_by_ids(client, [5])
+    assert e.value.data == {"animes": [], "mangas": []}
+    assert client.entities.absent("Anime", [5]) == set()
+    assert client.entities.absent("Manga", [5]) == {5}
+    
+    result = search_by_ids(client, [5])
+    assert len(sent) == 2
+    assert [x.id_ for x in result["animes"]] == [5]
+    assert result["mangas"] == []
+
+
+def test_error_without_path_does_not_mark_absent():
+    client, sent = make_client([
+        {"data": None, "errors": [{"message": "Internal error"}]},
+    ])
+    with pytest.raises(GraphQLError, match="Internal error"):
+        search_by_ids(client, [5])
+    assert client.entities.absent("Anime", [5]) == set()
+    assert client.entities.absent("Manga", [5]) == set()
+
+
+def test_failed_operation_is_not_remembered():
+    client, sent = make_client([
+        {"data": {"o0_animes": [make_node(5)], "o1_mangas": [make_node(6, "Manga")]},
+         "errors": [{"message": "Field error", "path": ["o0_animes", 0, "poster"]}]},
+    ])
+    with pytest.raises(GraphQLError) as e:
+        search_by_ids(client, [5, 6])
+    assert [x.id_ for x in e.value.data["mangas"]] == [6]
+    assert e.value.data["animes"] == []
+    assert client.entities.get_many("Anime", [5], detailed=True)[0] == dict()
+    assert list(client.entities.get_many("Manga", [6], detailed=True)[0]) == [6]
@@ -0,0 +1,41 @@
+import asyncio
+
+from src.supersession import Supersession, note_network
+
+
+async def fetched():
+    note_network()
+    return "fetched"
+
+
+async def cached():
+    return "cached"
+
+
+def run_turn(owner: Supersession, coro) -> str:
+    async def run():
+        turn = await owner.begin(debounce=False)
+        result = await turn.run(coro)
+        turn.finish()
+        return result
+    return asyncio.run(run())
+
+
+def test_latency_is_learned_only_from_network():
+    owner = Supersession(path=None)
+    assert run_turn(owner, cached()) == "cached"
+    assert owner._state["latency"] is None
+    assert run_turn(owner, fetched()) == "fetched"
+    assert owner._state["latency"] is not None
+
+
+def test_kept_in_memory_does_not_touch_file(tmp_path):
+    path = tmp_path / "supersession.json"
+    owner = Supersession(path=str(path))
+    run_turn(owner, fetched())
+    generation = owner.current()
+    path.unlink()
+    owner.keep_in_memory()
+    run_turn(owner, fetched())
+    assert owner.current() == generation + 1
+    assert not path.exists()